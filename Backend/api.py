@@ -1,32 +1,64 @@
-from flask import Flask, request, send_file , send_from_directory
+from flask import Flask, request, send_file, jsonify, Response
 from flask_cors import CORS
-import geopandas as gpd
-import folium
 import zipfile
 import tempfile
 import os
-import glob
+import importlib
 
-import rasterio
-from PIL import Image
-import numpy as np
+from model_cache import ProjectCache
+from jobs import JobStore, JobQueue, JobConflict
+from instrumentation import metrics
+from workspace import DEFAULT_PROJECT, validate_project_name, project_dir, upload_dir, find_shapefile
 
+# Heavy modules (geopandas, folium, rasterio, sklearn, ...) and Earth Engine
+# are loaded by the endpoints on first use, so a worker starts in well under a
+# second and without network access. warmup() loads them ahead of time, e.g.
+# from a pre-fork server hook; CROPMAP_EAGER_IMPORTS=1 runs it at import.
+WARMUP_MODULES = ["geopandas", "map_preview", "raster_render", "prediction"]
 
-from process_shapefiles import Process
-from preProcess import PreProcess_PipeLine
-from modelCreationp import modelCreation_PipeLine
-from prediction import prediction_PipeLine
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
+# Models, stacks and rendered rasters stay warm across requests in this process
+cache = ProjectCache()
+
+# Pipeline runs execute in a local worker pool; job records persist in SQLite
+job_store = JobStore()
+job_queue = JobQueue(job_store)
+
+def warmup(earth_engine=False):
+    for name in WARMUP_MODULES:
+        importlib.import_module(name)
+    if earth_engine:
+        from ee_client import get_ee
+        get_ee()
+
+if os.environ.get("CROPMAP_EAGER_IMPORTS") == "1":
+    warmup()
+
+def request_project():
+    # Every endpoint is scoped to a project; the frontend's single-project flow
+    # keeps using the default one.
+    return validate_project_name(request.values.get('project', DEFAULT_PROJECT))
+
+@app.before_request
+def resume_jobs():
+    # Other servers never run __main__; their serving processes resume
+    # orphaned jobs before the first request. A no-op after that.
+    job_queue.resume()
+
+@app.errorhandler(ValueError)
+def handle_invalid_request(error):
+    return str(error), 400
+
 @app.route('/uploadBoundry', methods=['POST'])
 def upload_shapefile():
     file = request.files['shapefile']
     if not file:
         return "No file uploaded", 400
 
-    # Create the save directory
-    save_dir = os.path.join(os.getcwd(), 'uploads', 'boundry')
+    # Create the project's save directory
+    save_dir = upload_dir(request_project(), 'boundry')
     os.makedirs(save_dir, exist_ok=True)
 
     # Clear existing files in the directory (optional, to avoid conflicts)
@@ -46,42 +78,15 @@ def upload_shapefile():
     if not shp_file:
         return "Shapefile (.shp) not found in zip", 400
 
+    import geopandas as gpd
+    from map_preview import boundary_preview_map
+
     shp_path = os.path.join(save_dir, shp_file)
     gdf = gpd.read_file(shp_path)
     gdf = gdf.to_crs(epsg=4326)
 
-    # Compute centroids
-    projected = gdf.to_crs(epsg=32644)
-    gdf['centroid'] = projected.centroid.to_crs(epsg=4326)
-
-    bounds = gdf.total_bounds
-    center = [(bounds[1] + bounds[3]) / 2, (bounds[0] + bounds[2]) / 2]
-    m = folium.Map(location=center, zoom_start=8)
-
-    gdf_clean = gdf.drop(columns=['centroid'])
-
-    folium.GeoJson(
-        gdf_clean,
-        name="Shapefile",
-        style_function=lambda x: {
-            'color': 'blue',
-            'weight': 2,
-            'fillOpacity': 0.1
-        }
-    ).add_to(m)
-
-    for _, row in gdf.iterrows():
-        label = row.get('type', 'No Label')
-        point = row['centroid']
-        folium.Marker(
-            location=[point.y, point.x],
-            popup=str(label),
-            icon=folium.Icon(color='red')
-        ).add_to(m)
-
     # Save the map in the same directory
-    output_path = os.path.join(save_dir, 'map.html')
-    m.save(output_path)
+    output_path = boundary_preview_map(gdf, os.path.join(save_dir, 'map.html'))
 
     return send_file(output_path, mimetype='text/html')
 
@@ -91,8 +96,8 @@ def upload_markers():
     if not file:
         return "No file uploaded", 400
 
-    # Define permanent directory
-    save_dir = os.path.join(os.getcwd(), 'uploads', 'markers')
+    # Define the project's permanent directory
+    save_dir = upload_dir(request_project(), 'markers')
     os.makedirs(save_dir, exist_ok=True)
 
     # Optional: Clean existing files before new upload
@@ -111,6 +116,9 @@ def upload_markers():
     if not shp_file:
         return "Shapefile (.shp) not found in zip", 400
 
+    import geopandas as gpd
+    from map_preview import markers_preview_map
+
     shp_path = os.path.join(save_dir, shp_file)
     gdf = gpd.read_file(shp_path)
 
@@ -119,93 +127,116 @@ def upload_markers():
         return "Uploaded shapefile must contain point geometries.", 400
 
     gdf = gdf.to_crs(epsg=4326)
-    bounds = gdf.total_bounds
-    center = [(bounds[1] + bounds[3]) / 2, (bounds[0] + bounds[2]) / 2]
-    m = folium.Map(location=center, zoom_start=8)
-
-    # Optional: Marker color mapping
-    type_colors = {
-        'water': 'blue',
-        'rice': 'green',
-        'wheat': 'orange',
-        'maize': 'purple'
-    }
-
-    for _, row in gdf.iterrows():
-        label = row.get('type', 'No Label')
-        color = type_colors.get(str(label).lower(), 'gray')
-        geom = row.geometry
-        folium.Marker(
-            location=[geom.y, geom.x],
-            popup=str(label),
-            icon=folium.Icon(color=color, icon='info-sign')
-        ).add_to(m)
 
     # Save output map
-    output_path = os.path.join(save_dir, 'markers_map.html')
-    m.save(output_path)
+    output_path = markers_preview_map(gdf, os.path.join(save_dir, 'markers_map.html'))
 
     return send_file(output_path, mimetype='text/html')
 
 
-@app.route('/processShapefiles', methods=['GET'])
+@app.route('/processShapefiles', methods=['GET', 'POST'])
 def processShapeFiles():
 
-    directory = '/home/sudharsan/projects/CropMapping/Backend/uploads'
-    shp_files = glob.glob(f'{directory}/**/*.shp', recursive=True)
+    project = request_project()
+    try:
+        roi_path = find_shapefile(upload_dir(project, 'boundry'))
+        markers_path = find_shapefile(upload_dir(project, 'markers'))
+    except FileNotFoundError as error:
+        return str(error), 400
+
+    try:
+        job_id = job_queue.submit({
+            "project_name": project,
+            "roi_path": roi_path,
+            "markers_path": markers_path,
+            "sample_size": 400,
+            "test_size": 0.33,
+            "n_trees": 500,
+            # incremental=1 extends the registered models with the new markers only
+            "incremental": request.values.get('incremental') == '1',
+            "n_new_trees": int(request.values.get('n_new_trees', 100)),
+        })
+    except JobConflict as conflict:
+        return jsonify({"error": str(conflict), "job_id": conflict.job_id}), 409
+
+    return jsonify({"job_id": job_id}), 202
+
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify(job_store.list())
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return "Job not found", 404
+    return jsonify(job)
+
+
+def prediction_output_path(project):
+    return os.path.join(project_dir(project), "Predicted_Cropmap", "output.tif")
+
+
+def cached_png(project, input_path, variant, renderer):
+    # Renders are cached per raster stamp; the ETag is known before rendering,
+    # so a browser revalidating an unchanged map gets a 304 straight away.
+    from raster_render import raster_stamp, render_etag
+    stamp = raster_stamp(input_path)
+    etag = render_etag(input_path, stamp, *variant)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(cache.rendered(project, input_path, stamp, variant, renderer), mimetype='image/png')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
-    roi_path = shp_files[0]
-    markers_path = shp_files[1]
-    
-    processShapeFiles = Process(roi_path, markers_path)
-
-    PreProcess_PipeLine(project_name="ujjain")
+@app.route("/Output",methods=['GET'])
+def serve_tif():
 
-    modelCreation_PipeLine(
-        project_name="ujjain",
-        sample_size=400,
-        test_size=0.33,
-        n_trees=500
-    )
+    project=request_project()
+    from raster_render import render_preview, png_bytes, DEFAULT_MAX_SIZE
+    InputPath=prediction_output_path(project)
+    max_size=int(request.values.get('max_size', DEFAULT_MAX_SIZE))
 
-    prediction_PipeLine('ujjain')
+    # Downsampled preview read from the overviews; use the tiles for full detail
+    return cached_png(project, InputPath, ("preview", max_size), lambda: png_bytes(render_preview(InputPath, max_size)))
 
-    return '', 200
 
+@app.route("/Output/info",methods=['GET'])
+def output_info():
+    from raster_render import raster_info
+    return jsonify(raster_info(prediction_output_path(request_project())))
 
-@app.route("/Output",methods=['GET'])
-def serve_tif():
 
-    project="ujjain"
-    InputPath=f"Crop_mapping_{project}/Predicted_Cropmap/output.tif"
-    OutputPath=f"Crop_mapping_{project}/Predicted_Cropmap/output.png"
+@app.route("/Output/tiles/<int:z>/<int:x>/<int:y>.png",methods=['GET'])
+def output_tile(z, x, y):
+    from raster_render import render_tile
+    project = request_project()
+    input_path = prediction_output_path(project)
+    try:
+        return cached_png(project, input_path, ("tile", z, x, y), lambda: render_tile(input_path, z, x, y))
+    except ValueError as error:
+        return str(error), 404
 
-    convert_raster(InputPath,OutputPath)
-    
-    
-    return send_from_directory(f"Crop_mapping_{project}/Predicted_Cropmap/","output.png")
 
+@app.route("/metrics",methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.prometheus(), mimetype='text/plain; version=0.0.4')
 
 
-def convert_raster(input_path, output_path):
-    with rasterio.open(input_path) as src:
-        count = src.count
+@app.route("/cacheStats",methods=['GET'])
+def cache_stats():
+    return jsonify(cache.stats())
 
-        if count == 1:
-            # Grayscale
-            img_array = src.read(1)
-            img_array = ((img_array - img_array.min()) / (img_array.max() - img_array.min()) * 255).astype(np.uint8)
-            img = Image.fromarray(img_array, mode="L")
-        elif count >= 3:
-            # RGB
-            img_array = src.read([1, 2, 3])
-            img_array = np.transpose(img_array, (1, 2, 0))  # (bands, height, width) -> (height, width, bands)
-            img_array = ((img_array - img_array.min()) / (img_array.max() - img_array.min()) * 255).astype(np.uint8)
-            img = Image.fromarray(img_array, mode="RGB")
-        else:
-            raise ValueError("Unsupported band count")
 
-        img.save(output_path)
 if __name__ == '__main__':
+    warmup()
+    # With the reloader the serving process is the child it spawns; the
+    # watcher process must not resume jobs as well.
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        job_queue.resume()
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,75 @@
+import os
+import glob
+import pandas as pd
+
+# Intermediate tables are stored as uncompressed Feather (Arrow IPC) files,
+# which load memory-mapped without any text parsing. Callers keep addressing
+# artifacts by their historical .csv path; the CSV itself is an optional side
+# output for people who open the files by hand.
+try:
+    import pyarrow.feather as feather
+except ImportError:  # pyarrow is optional; fall back to plain CSV
+    feather = None
+
+ARTIFACT_FORMAT = os.environ.get("CROPMAP_ARTIFACT_FORMAT", "feather" if feather is not None else "csv")
+CSV_EXPORT = os.environ.get("CROPMAP_CSV_EXPORT", "1") == "1"
+
+FEATHER_EXTENSION = ".feather"
+
+
+def artifact_path(csv_path):
+    return os.path.splitext(csv_path)[0] + FEATHER_EXTENSION
+
+
+def artifact_paths(csv_path):
+    return [csv_path, artifact_path(csv_path)]
+
+
+def save_table(df, csv_path, csv_export=None):
+    if csv_export is None:
+        csv_export = CSV_EXPORT
+    if csv_export or ARTIFACT_FORMAT == "csv":
+        df.to_csv(csv_path, index=False)
+    if ARTIFACT_FORMAT == "feather":
+        # Written after the CSV so has_columnar sees it as the current copy.
+        # Feather needs a default index and string column names, like a CSV header
+        table = df.reset_index(drop=True)
+        table.columns = [str(col) for col in table.columns]
+        # Replaced rather than rewritten: frames loaded earlier may still be
+        # memory-mapped on the old file, and truncating it under them is a SIGBUS.
+        path = artifact_path(csv_path)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        feather.write_feather(table, tmp_path, compression="uncompressed")
+        os.replace(tmp_path, path)
+    elif os.path.exists(artifact_path(csv_path)):
+        os.remove(artifact_path(csv_path))  # Never leave a stale columnar copy behind
+
+
+def has_columnar(csv_path):
+    path = artifact_path(csv_path)
+    if feather is None or not os.path.exists(path):
+        return False
+    # A CSV edited by hand after the columnar file was written takes precedence
+    return not os.path.exists(csv_path) or os.path.getmtime(path) >= os.path.getmtime(csv_path)
+
+
+def load_table(csv_path, columns=None):
+    if has_columnar(csv_path):
+        return feather.read_table(artifact_path(csv_path), columns=columns, memory_map=True).to_pandas()
+    return pd.read_csv(csv_path, usecols=columns)
+
+
+def iter_table_chunks(csv_path, chunksize):
+    if has_columnar(csv_path):
+        table = feather.read_table(artifact_path(csv_path), memory_map=True)
+        for batch in table.to_batches(max_chunksize=chunksize):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(csv_path, chunksize=chunksize)
+
+
+def list_tables(directory, pattern):
+    # Artifact paths (in .csv form) matching pattern, whichever format exists
+    stems = {os.path.splitext(path)[0] for path in glob.glob(os.path.join(directory, pattern + ".csv"))}
+    stems |= {os.path.splitext(path)[0] for path in glob.glob(os.path.join(directory, pattern + FEATHER_EXTENSION))}
+    return sorted(stem + ".csv" for stem in stems)
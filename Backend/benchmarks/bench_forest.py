@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+from imblearn.ensemble import BalancedRandomForestClassifier
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compiled_forest import CompiledForest, flatten_forest
+
+# sklearn's predict_proba against CompiledForest on the same fitted
+# BalancedRandomForestClassifier, configured as modelCreationp trains it.
+# The compiled evaluator should only become selectable for prediction once
+# this shows a speedup above 1 at the sizes prediction tiles actually have.
+
+
+def synthetic_training_set(n_samples, n_features, n_classes=4, seed=0):
+    # Classes shifted apart along every feature, with overlapping noise
+    rng = np.random.default_rng(seed)
+    y = rng.integers(0, n_classes, n_samples)
+    X = rng.normal(0, 3, (n_samples, n_features)) + y[:, None]
+    return X.astype(np.float32), y + 1
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare forest evaluators on synthetic pixels.")
+    parser.add_argument("--trees", type=int, nargs="+", default=[50, 200])
+    parser.add_argument("--pixels", type=int, nargs="+", default=[65_536, 262_144])
+    parser.add_argument("--features", type=int, default=36)
+    parser.add_argument("--train-samples", type=int, default=4_000)
+    args = parser.parse_args()
+
+    X_train, y_train = synthetic_training_set(args.train_samples, args.features)
+    print(f"{'trees':>6} {'pixels':>9} {'sklearn_s':>10} {'compiled_s':>11} {'speedup':>8}")
+    for n_trees in args.trees:
+        model = BalancedRandomForestClassifier(
+            n_estimators=n_trees, sampling_strategy="all", replacement=True,
+            random_state=0, bootstrap=False,
+        ).fit(X_train, y_train)
+        compiled = CompiledForest(flatten_forest(model))
+        for n_pixels in args.pixels:
+            X, _ = synthetic_training_set(n_pixels, args.features, seed=1)
+            expected, sklearn_s = timed(model.predict_proba, X)
+            proba, compiled_s = timed(compiled.predict_proba, X)
+            np.testing.assert_allclose(proba, expected, rtol=0, atol=1e-12)
+            print(f"{n_trees:>6} {n_pixels:>9} {sklearn_s:>10.3f} {compiled_s:>11.3f} {sklearn_s / compiled_s:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preProcess import reshape_long_to_wide
+
+INDEX_COLUMNS = ['id', 'crpname_eg', 'lat', 'lon']
+CROPS = np.array(['wheat', 'gram', 'mustard', 'water'])
+
+
+def synthetic_tall_table(n_points, n_dates, prefix='VV', seed=0):
+    # Same layout as the Earth Engine export: date by date, markers in order.
+    rng = np.random.default_rng(seed)
+    lat = rng.uniform(22.8, 23.8, n_points)
+    lon = rng.uniform(75.2, 76.2, n_points)
+    crops = CROPS[rng.integers(0, len(CROPS), n_points)]
+    dates = pd.date_range('2023-10-16', periods=n_dates, freq='12D').strftime('%Y%m%d').astype(int)
+    return pd.DataFrame({
+        prefix: rng.normal(-15, 5, n_points * n_dates),
+        'crpname_eg': np.tile(crops, n_dates),
+        'date': np.repeat(dates, n_points),
+        'geometry': np.nan,
+        'id': np.nan,
+        'lat': np.tile(lat, n_dates),
+        'lon': np.tile(lon, n_dates),
+    })
+
+
+def legacy_reshape(df_tall, prefix, index_columns):
+    # The pivot + per-column compaction previously used by process_time_series
+    df_tall = df_tall.copy()
+    df_tall['id'] = range(1, len(df_tall) + 1)
+    all_dates = df_tall['date'].unique().tolist()
+    pivot_df = df_tall.pivot(index=index_columns, columns='date', values=prefix)
+    pivot_df.reset_index(inplace=True)
+    pivot_df = pivot_df.reindex(columns=index_columns + all_dates)
+    df_moved_up = pivot_df.apply(lambda x: x.dropna().reset_index(drop=True))
+    for col in pivot_df.columns[2:]:
+        pivot_df[col] = df_moved_up[col]
+    return pivot_df.dropna()
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main(sizes=(1_000, 10_000, 100_000), n_dates=12, legacy_limit=10_000):
+    print(f"{'points':>8} {'dates':>6} {'vectorized_s':>13} {'legacy_s':>10}")
+    for n_points in sizes:
+        df_tall = synthetic_tall_table(n_points, n_dates)
+        wide, vectorized_s = timed(reshape_long_to_wide, df_tall, 'VV', INDEX_COLUMNS)
+        wide = wide.dropna()
+
+        legacy_s = float('nan')
+        if n_points <= legacy_limit:
+            legacy, legacy_s = timed(legacy_reshape, df_tall, 'VV', INDEX_COLUMNS)
+            pd.testing.assert_frame_equal(
+                wide.reset_index(drop=True), legacy.reset_index(drop=True),
+                check_dtype=False, check_names=False,
+            )
+        print(f"{n_points:>8} {n_dates:>6} {vectorized_s:>13.3f} {legacy_s:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
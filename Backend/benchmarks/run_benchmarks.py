@@ -0,0 +1,247 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+os.environ.setdefault("MPLBACKEND", "Agg")  # Trainers and prediction draw figures
+
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from bench_reshape import synthetic_tall_table, CROPS
+from artifact_store import save_table
+from preProcess import process_time_series, add_prefix_to_features
+from modelCreationp import (
+    balance_class_samples, custom_train_test_split,
+    custom_random_forest_classifier, custom_balanced_random_forest_classifier,
+)
+from prediction import crop_map_prediction_pipeline
+from raster_render import convert_raster
+
+# Offline benchmark of every pipeline stage on synthetic data. Each stage is
+# timed (best of --repeat runs) and then run once more under tracemalloc for
+# its peak Python/NumPy allocation. The JSON report can be diffed between
+# versions with --baseline.
+SCALES = {
+    "small": dict(points=1_000, dates=12, raster_size=512, trees=50, sample_size=200),
+    "medium": dict(points=10_000, dates=24, raster_size=2048, trees=200, sample_size=1_000),
+    "large": dict(points=100_000, dates=30, raster_size=8192, trees=500, sample_size=5_000),
+}
+BANDS = ['VV', 'VH', 'NDVI']
+# Larger stacks only run the streaming prediction paths; the in-memory path
+# would need the whole stack in RAM.
+IN_MEMORY_PREDICTION_LIMIT = 4096
+PROJECT = "bench"
+
+
+def measure(name, fn, repeat=1):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        seconds.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{name:<40} {min(seconds):>9.3f}s {peak / 1024 ** 2:>10.1f} MiB")
+    return result, {"name": name, "seconds": min(seconds), "runs": seconds, "peak_mib": peak / 1024 ** 2}
+
+
+def write_tall_tables(workdir, points, dates):
+    # The three bands share markers and labels, as the Earth Engine export does
+    paths = {}
+    for band in BANDS:
+        path = os.path.join(workdir, f"{band}_timeseries_{PROJECT}.csv")
+        save_table(synthetic_tall_table(points, dates, prefix=band), path)
+        paths[band] = path
+    return paths
+
+
+def write_training_table(features, path):
+    class_ids = {crop: idx + 1 for idx, crop in enumerate(CROPS)}
+    table = features.drop(columns=['id', 'crpname_eg', 'lat', 'lon'])
+    table['Class'] = features['crpname_eg'].map(class_ids).to_numpy()
+    save_table(table, path)
+    return path
+
+
+def write_synthetic_stack(path, n_bands, size, rows_per_write=256, seed=0):
+    # Written in row strips so large stacks never sit in memory whole
+    rng = np.random.default_rng(seed)
+    profile = dict(
+        driver='GTiff', height=size, width=size, count=n_bands, dtype='float32',
+        crs='EPSG:4326', transform=from_origin(75.2, 23.8, 1e-4, 1e-4),
+        tiled=True, blockxsize=256, blockysize=256, BIGTIFF='IF_SAFER',
+    )
+    with rasterio.open(path, 'w', **profile) as dst:
+        for row_off in range(0, size, rows_per_write):
+            height = min(rows_per_write, size - row_off)
+            strip = rng.normal(-15, 5, (n_bands, height, size)).astype(np.float32)
+            dst.write(strip, window=Window(0, row_off, size, height))
+    return path
+
+
+def run(config, workdir, repeat=1):
+    results = []
+    timeseries_dir = os.path.join(workdir, "timeseries")
+    metrics_dir = os.path.join(workdir, "metrics", "")
+    os.makedirs(timeseries_dir, exist_ok=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+    tall_paths = write_tall_tables(workdir, config["points"], config["dates"])
+    for band in BANDS:
+        wide_path = os.path.join(timeseries_dir, f"{band}_timeseries_{PROJECT}_wide.csv")
+        _, result = measure(
+            f"process_time_series[{band}]",
+            lambda: process_time_series(tall_paths[band], wide_path, band, data_type='crop'),
+            repeat,
+        )
+        results.append(result)
+
+    features_path = os.path.join(timeseries_dir, "features.csv")
+    features, result = measure(
+        "add_prefix_to_features",
+        lambda: add_prefix_to_features(timeseries_dir, features_path, drop_cols=[]),
+        repeat,
+    )
+    results.append(result)
+
+    training_path = write_training_table(features, os.path.join(timeseries_dir, "training.csv"))
+    balanced, result = measure(
+        "balance_class_samples",
+        lambda: balance_class_samples(training_path, config["sample_size"]),
+        repeat,
+    )
+    results.append(result)
+    _, result = measure(
+        "balance_class_samples[streaming]",
+        lambda: balance_class_samples(training_path, config["sample_size"], chunksize=max(1_000, config["points"] // 10)),
+        repeat,
+    )
+    results.append(result)
+
+    X_train, X_test, y_train, y_test = custom_train_test_split(balanced, 0.33)
+    (rf_path, _, _), result = measure(
+        "custom_random_forest_classifier",
+        lambda: custom_random_forest_classifier(X_train, X_test, y_train, y_test, config["trees"], metrics_dir),
+        repeat,
+    )
+    results.append(result)
+    (brf_path, _, _), result = measure(
+        "custom_balanced_random_forest_classifier",
+        lambda: custom_balanced_random_forest_classifier(X_train, X_test, y_train, y_test, config["trees"], metrics_dir),
+        repeat,
+    )
+    results.append(result)
+
+    stack_path = write_synthetic_stack(os.path.join(workdir, "stack.tif"), X_train.shape[1], config["raster_size"])
+    output_path = os.path.join(workdir, "Predicted_Cropmap", "output.tif")
+    for name, model_path, streaming in (
+        ("crop_map_prediction_pipeline", brf_path, False),
+        ("crop_map_prediction_pipeline[streaming]", brf_path, True),
+    ):
+        if not streaming and config["raster_size"] > IN_MEMORY_PREDICTION_LIMIT:
+            print(f"Skipping {name}: stack larger than {IN_MEMORY_PREDICTION_LIMIT} pixels")
+            continue
+        _, result = measure(
+            name,
+            lambda: crop_map_prediction_pipeline(stack_path, model_path, output_path, streaming=streaming),
+            repeat,
+        )
+        results.append(result)
+
+    _, result = measure(
+        "convert_raster",
+        lambda: convert_raster(output_path, os.path.join(workdir, "output.png")),
+        repeat,
+    )
+    results.append(result)
+    return results
+
+
+def library_versions():
+    import sklearn
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "scikit-learn": sklearn.__version__,
+        "rasterio": rasterio.__version__,
+    }
+
+
+def compare(report, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {result["name"]: result for result in json.load(f)["results"]}
+    print(f"\n{'stage':<40} {'time x':>8} {'memory x':>9}")
+    for result in report["results"]:
+        old = baseline.get(result["name"])
+        if old is None:
+            continue
+        time_ratio = result["seconds"] / old["seconds"] if old["seconds"] else float('nan')
+        memory_ratio = result["peak_mib"] / old["peak_mib"] if old["peak_mib"] else float('nan')
+        print(f"{result['name']:<40} {time_ratio:>8.2f} {memory_ratio:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the crop-mapping pipeline on synthetic data.")
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--points", type=int, help="Ground-truth markers")
+    parser.add_argument("--dates", type=int, help="Dates per band")
+    parser.add_argument("--raster-size", type=int, help="Prediction stack width and height")
+    parser.add_argument("--trees", type=int, help="Trees per forest")
+    parser.add_argument("--sample-size", type=int, help="Training samples per class")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--output", default="benchmark_report.json")
+    parser.add_argument("--baseline", help="Earlier report to compare against")
+    parser.add_argument("--keep", action="store_true", help="Keep the synthetic working directory")
+    args = parser.parse_args()
+
+    config = dict(SCALES[args.scale])
+    for key in config:
+        value = getattr(args, key)
+        if value is not None:
+            config[key] = value
+
+    workdir = tempfile.mkdtemp(prefix="cropmap_bench_")
+    print(f"Benchmarking {config} in {workdir}")
+    try:
+        results = run(config, workdir, args.repeat)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "versions": library_versions(),
+        "scale": args.scale,
+        "config": config,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report saved at: {args.output}")
+
+    if args.baseline:
+        compare(report, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cold-start cost of the API: imports the module in a fresh interpreter with
+# -X importtime and reports the wall time plus the slowest modules by
+# cumulative import time. Earth Engine is never initialized by the import, so
+# this runs offline.
+
+
+def parse_importtime(stderr):
+    # Lines look like "import time:   self [us] | cumulative | imported package"
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+        })
+    return modules
+
+
+def measure_import(module, eager=False):
+    env = dict(os.environ, CROPMAP_EAGER_IMPORTS="1" if eager else "0")
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{completed.stderr[-2000:]}")
+    modules = parse_importtime(completed.stderr)
+    return {
+        "module": module,
+        "eager": eager,
+        "wall_seconds": wall,
+        "import_seconds": sum(m["self_ms"] for m in modules) / 1000,
+        "modules": modules,
+    }
+
+
+def top_level(modules, limit):
+    # Top-level imports are the ones the startup path chose to load
+    roots = [m for m in modules if m["depth"] == 0]
+    return sorted(roots, key=lambda m: m["cumulative_ms"], reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the import time of the API process.")
+    parser.add_argument("--module", default="api")
+    parser.add_argument("--eager", action="store_true", help="Also measure with CROPMAP_EAGER_IMPORTS=1")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--output", default="startup_report.json")
+    args = parser.parse_args()
+
+    runs = [measure_import(args.module)]
+    if args.eager:
+        runs.append(measure_import(args.module, eager=True))
+
+    for run in runs:
+        print(f"\nimport {run['module']} ({'eager' if run['eager'] else 'lazy'}): "
+              f"{run['wall_seconds']:.3f}s wall, {run['import_seconds']:.3f}s in imports")
+        print(f"{'module':<40} {'cumulative ms':>14} {'self ms':>9}")
+        for m in top_level(run["modules"], args.top):
+            print(f"{m['module']:<40} {m['cumulative_ms']:>14.1f} {m['self_ms']:>9.1f}")
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "runs": runs,
+        }, f, indent=2)
+    print(f"\nReport saved at: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import numpy as np
+
+# Flat NumPy representation of a fitted RandomForestClassifier /
+# BalancedRandomForestClassifier: every tree's nodes are concatenated into
+# arrays, and trees are evaluated one at a time over all rows. Only
+# benchmarks/bench_forest.py uses it: on deep trees sklearn's Cython traversal
+# is still faster, so training does not export it and prediction keeps
+# loading the joblib model.
+
+# Depth levels descended between compactions of the rows still in flight
+LEVELS_PER_PASS = 4
+
+
+def flatten_forest(model):
+    n_classes = len(model.classes_)
+    roots, features, thresholds, lefts, rights, missing_lefts, values = [], [], [], [], [], [], []
+    offset = 0
+
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        n_nodes = tree.node_count
+        is_leaf = tree.children_left == -1
+
+        # Trees inside a forest are fitted on encoded labels, so a tree's
+        # classes_ are column indices into the forest's classes_.
+        proba = np.zeros((n_nodes, n_classes), dtype=np.float64)
+        node_values = tree.value[:, 0, :]
+        proba[:, np.asarray(estimator.classes_, dtype=np.intp)] = node_values / node_values.sum(axis=1, keepdims=True)
+
+        roots.append(offset)
+        features.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+        thresholds.append(tree.threshold.astype(np.float64))
+        lefts.append(np.where(is_leaf, -1, tree.children_left + offset).astype(np.int32))
+        rights.append(np.where(is_leaf, -1, tree.children_right + offset).astype(np.int32))
+        # NaN goes where sklearn sends it: the side chosen for missing values
+        # when fitting, else the child that got more samples
+        missing_lefts.append(np.asarray(tree.missing_go_to_left, dtype=bool))
+        values.append(proba)
+        offset += n_nodes
+
+    return {
+        "roots": np.asarray(roots, dtype=np.int32),
+        "feature": np.concatenate(features),
+        "threshold": np.concatenate(thresholds),
+        "left": np.concatenate(lefts),
+        "right": np.concatenate(rights),
+        "missing_left": np.concatenate(missing_lefts),
+        "value": np.concatenate(values),
+        "classes": np.asarray(model.classes_),
+        "n_features": np.asarray(model.n_features_in_, dtype=np.int64),
+    }
+
+
+class CompiledForest:
+    def __init__(self, arrays):
+        self.roots = arrays["roots"]
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.left = arrays["left"]
+        self.right = arrays["right"]
+        self.missing_left = arrays["missing_left"]
+        self.value = arrays["value"]
+        self.classes_ = arrays["classes"]
+        self.n_features_in_ = int(arrays["n_features"])
+
+        # children[node, went_left]; leaves point at themselves, so rows that
+        # reached a leaf stay put until the next compaction drops them.
+        self.is_leaf = self.left == -1
+        nodes = np.arange(len(self.left))
+        self.children = np.stack([
+            np.where(self.is_leaf, nodes, self.right),
+            np.where(self.is_leaf, nodes, self.left),
+        ], axis=1).astype(np.intp)
+        self.node_feature = self.feature.astype(np.intp)
+
+    def apply_tree(self, X_flat, n_samples, root):
+        # Leaf reached by every row, with X_flat the row-major X
+        leaves = np.full(n_samples, root, dtype=np.intp)
+        if self.is_leaf[root]:
+            return leaves
+        rows = np.arange(n_samples)
+        offsets = rows * self.n_features_in_
+        nodes = leaves.copy()
+        while rows.size:
+            for _ in range(LEVELS_PER_PASS):
+                values = X_flat[offsets + self.node_feature[nodes]]
+                go_left = (values <= self.threshold[nodes]) | (np.isnan(values) & self.missing_left[nodes])
+                nodes = self.children[nodes, go_left.view(np.uint8)]
+            done = self.is_leaf[nodes]
+            leaves[rows[done]] = nodes[done]
+            pending = ~done
+            rows, nodes, offsets = rows[pending], nodes[pending], offsets[pending]
+        return leaves
+
+    def predict_proba(self, X):
+        # sklearn evaluates trees on float32 input against float64 thresholds.
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.shape[1] != self.n_features_in_:
+            raise ValueError(f"X has {X.shape[1]} features, but the forest expects {self.n_features_in_}.")
+
+        n_samples = X.shape[0]
+        proba = np.zeros((n_samples, len(self.classes_)), dtype=np.float64)
+        if n_samples == 0:
+            return proba
+
+        X_flat = X.ravel()
+        # Accumulate tree by tree, in the same order as sklearn's forest.
+        for root in self.roots:
+            proba += self.value[self.apply_tree(X_flat, n_samples, root)]
+        return proba / len(self.roots)
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1), axis=0)
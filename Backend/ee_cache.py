@@ -0,0 +1,71 @@
+import os
+import sqlite3
+
+# Persistent per-point, per-date band values pulled from Earth Engine, keyed by
+# the marker's geometry hash and by the scope of the collection they came from
+# (ROI, collection and filters; see process_shapefiles.extraction_scope).
+# Re-runs only query EE for markers or dates that are not in here yet.
+EE_CACHE_PATH = os.environ.get("CROPMAP_EE_CACHE", ".ee_cache.sqlite")
+
+# Bumped when the key changes; older tables are dropped, not migrated
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ee_values (
+    scope TEXT NOT NULL,
+    geom_key TEXT NOT NULL,
+    band TEXT NOT NULL,
+    date TEXT NOT NULL,
+    value REAL,
+    lat REAL,
+    lon REAL,
+    PRIMARY KEY (scope, geom_key, band, date)
+);
+"""
+
+# SQLite caps the number of bound parameters per statement.
+QUERY_CHUNK = 500
+
+
+class EECache:
+    def __init__(self, path=EE_CACHE_PATH):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                conn.execute("DROP TABLE IF EXISTS ee_values")
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    def missing(self, scope, keys, band, dates):
+        # date -> keys that have no cached value for it, in the given key order
+        present = {date: set() for date in dates}
+        with self._connect() as conn:
+            for start in range(0, len(dates), QUERY_CHUNK):
+                chunk = dates[start:start + QUERY_CHUNK]
+                rows = conn.execute(
+                    f"SELECT geom_key, date FROM ee_values WHERE scope = ? AND band = ? AND date IN ({','.join('?' * len(chunk))})",
+                    (scope, band, *chunk),
+                )
+                for geom_key, date in rows:
+                    present[date].add(geom_key)
+        return {date: [key for key in keys if key not in present[date]] for date in dates}
+
+    def store(self, scope, band, rows):
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO ee_values (scope, geom_key, band, date, value, lat, lon) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(scope, row['geom_key'], band, str(row['date']), row.get(band), row.get('lat'), row.get('lon')) for row in rows],
+            )
+
+    def values(self, scope, band, date):
+        # geom_key -> (value, lat, lon) for one date
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT geom_key, value, lat, lon FROM ee_values WHERE scope = ? AND band = ? AND date = ?",
+                (scope, band, date),
+            )
+            return {geom_key: (value, lat, lon) for geom_key, value, lat, lon in rows}
@@ -0,0 +1,39 @@
+import os
+import threading
+
+# Earth Engine is initialized on first use rather than at import, so modules
+# that reference it (and the API that imports them) load without network
+# access. Call get_ee() in a pre-fork warmup to pay the cost up front.
+EE_PROJECT = os.environ.get("CROPMAP_EE_PROJECT", "ee-sudharsanr836")
+
+_ee = None
+_lock = threading.Lock()
+
+
+def get_ee():
+    global _ee
+    if _ee is None:
+        with _lock:
+            if _ee is None:
+                import ee as earthengine
+                earthengine.Initialize(project=EE_PROJECT)
+                _ee = earthengine
+    return _ee
+
+
+def set_ee(client):
+    # Replaces the client behind get_ee() and the ee proxy, e.g. with a fake in
+    # tests; None initializes Earth Engine again on next use.
+    global _ee
+    with _lock:
+        _ee = client
+
+
+class _LazyEarthEngine:
+    # Module stand-in: the first attribute access (ee.Geometry, ee.Filter, ...)
+    # imports and initializes the client.
+    def __getattr__(self, name):
+        return getattr(get_ee(), name)
+
+
+ee = _LazyEarthEngine()
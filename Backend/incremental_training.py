@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import shutil
+
+import joblib
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from sklearn.metrics import accuracy_score
+
+import process_shapefiles
+from local_file_upload import geometryKey
+from preProcess import process_time_series, assemble_feature_matrix, DEFAULT_DROP_COLS
+from modelCreationp import sample_per_class, custom_train_test_split
+from model_registry import ModelRegistry, training_fingerprint
+from artifact_store import load_table, save_table
+from workspace import project_dir
+
+# Incremental retraining after new ground-truth markers are uploaded: only
+# markers that are not in the project's marker index are extracted and
+# preprocessed, and the latest registered forests grow extra trees on the new
+# samples plus a rebalanced sample of the existing ones (warm start).
+DELTA_DIRNAME = "delta"
+DEFAULT_NEW_TREES = 100
+
+BANDS = ['VV', 'VH', 'NDVI']
+
+
+def delta_dir(project_name):
+    return os.path.join(project_dir(project_name), DELTA_DIRNAME)
+
+
+def extract_delta_markers(project_name, roi_path, markers_path, backend="ee", raster_dir=None):
+    output_dir = delta_dir(project_name)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.makedirs(output_dir)
+
+    known = set(process_shapefiles.load_marker_index(project_dir(project_name)))
+    gdf = gpd.read_file(markers_path).to_crs(epsg=4326)
+    keys = gdf.geometry.apply(geometryKey)
+    delta = gdf[~keys.isin(known)]
+    print(f"{len(delta)} new markers out of {len(gdf)}")
+
+    with open(os.path.join(output_dir, "keys.json"), 'w') as f:
+        json.dump(keys[delta.index].tolist(), f)
+    if delta.empty:
+        return 0
+
+    delta_path = os.path.join(output_dir, "markers_delta.shp")
+    delta.to_file(delta_path)
+    process_shapefiles.process_crop_time_series(
+        roi_path=roi_path,
+        markers_path=delta_path,
+        start_s1=process_shapefiles.START_S1,
+        end_s1=process_shapefiles.END_S1,
+        start_s2=process_shapefiles.START_S2,
+        end_s2=process_shapefiles.END_S2,
+        output_folder=output_dir,
+        project_name=project_name,
+        backend=backend,
+        raster_dir=raster_dir,
+    )
+    return len(delta)
+
+
+def has_delta(project_name):
+    path = os.path.join(delta_dir(project_name), "keys.json")
+    if not os.path.exists(path):
+        return False
+    with open(path) as f:
+        return bool(json.load(f))
+
+
+def preprocess_delta(project_name, drop_cols=None):
+    if not has_delta(project_name):
+        print("No new markers to preprocess")
+        return
+    output_dir = delta_dir(project_name)
+    wide_frames = {}
+    for band in BANDS:
+        wide_frames[band] = process_time_series(
+            os.path.join(output_dir, f"{band}_timeseries_{project_name}.csv"),
+            os.path.join(output_dir, f"{band}_timeseries_{project_name}_wide.csv"),
+            band,
+            data_type='crop',
+        )
+    X, _, feature_names, meta = assemble_feature_matrix(wide_frames, drop_cols=DEFAULT_DROP_COLS if drop_cols is None else drop_cols)
+    save_table(pd.concat([meta, pd.DataFrame(X, columns=feature_names)], axis=1), os.path.join(output_dir, "timeseries_crops3inc.csv"))
+
+
+def train_incremental(project_name, sample_size, test_size, n_new_trees=DEFAULT_NEW_TREES):
+    if not has_delta(project_name):
+        print("No new markers; keeping the current models")
+        return
+    root = project_dir(project_name)
+    timeseries_dir = os.path.join(root, "timeseries")
+    meta_path = os.path.join(timeseries_dir, "timeseries_crops3inc.csv")
+    features_path = os.path.join(timeseries_dir, "crops3inc_multiclass_S1S2_onlytimeseries_v01.csv")
+    save_path = os.path.join(root, "metrics", "")
+
+    delta = load_table(os.path.join(delta_dir(project_name), "timeseries_crops3inc.csv"))
+    existing_meta = load_table(meta_path)
+    existing = load_table(features_path)
+
+    # Class ids were assigned by first appearance of each crop name, so the
+    # existing table reproduces the mapping. Warm-started trees cannot learn
+    # classes the forest has never seen.
+    crops = pd.unique(existing_meta['crpname_eg'])
+    class_map = {crop: idx + 1 for idx, crop in enumerate(crops)}
+    unknown = sorted(set(delta['crpname_eg']) - set(class_map))
+    if unknown:
+        raise ValueError(f"New crop classes {unknown} need a full retrain")
+
+    registry = ModelRegistry(save_path)
+    if not registry.exists():
+        raise FileNotFoundError("No registered models to extend; run a full training first")
+
+    feature_names = [col for col in existing.columns if col != 'Class']
+    delta_features = delta[feature_names].assign(Class=delta['crpname_eg'].map(class_map).astype(int))
+    # New samples plus a rebalanced draw of the existing ground truth
+    train_df = pd.concat([delta_features, sample_per_class(existing, sample_size)]).sample(frac=1, random_state=42).reset_index(drop=True)
+    X_train, X_test, y_train, y_test = custom_train_test_split(train_df, test_size)
+    fingerprint = training_fingerprint(train_df)
+
+    stamp = time.strftime("%Y%m%d%H%M%S")
+    trained = []
+    for model_type in ("RF", "BRF"):
+        parent = registry.resolve(model_type, "latest")
+        if parent["features"] != feature_names:
+            raise ValueError(f"{model_type} model version {parent['version']} was trained on different features")
+        model = joblib.load(registry.model_path(parent))
+        if not np.array_equal(np.unique(y_train), model.classes_):
+            raise ValueError(f"Update samples must cover all classes {list(model.classes_)}")
+
+        n_trees = model.n_estimators + n_new_trees
+        model.set_params(warm_start=True, n_estimators=n_trees)
+        model.fit(X_train, y_train)
+        model.set_params(warm_start=False)
+        accuracy = accuracy_score(y_test, model.predict(X_test))
+
+        model_filename = f"{save_path}{model_type}_crops3inc_multiclass_inc{stamp}_{accuracy:.4f}.joblib"
+        joblib.dump(model, model_filename)
+        trained.append((model_type, parent, model_filename, accuracy, n_trees))
+
+    # The new markers become part of the project's ground truth. Tables are
+    # written before any model is registered, so a failure here never leaves
+    # registered models trained on rows the tables do not have.
+    updated_meta = pd.concat([existing_meta, delta], ignore_index=True)
+    updated_features = pd.concat([existing, delta_features], ignore_index=True)
+    save_table(updated_meta, meta_path)
+    save_table(updated_features, features_path)
+
+    for model_type, parent, model_filename, accuracy, n_trees in trained:
+        registry.register(
+            model_type,
+            model_filename,
+            metrics={"accuracy": accuracy},
+            features=feature_names,
+            fingerprint=fingerprint,
+            params={**parent["params"], "n_estimators": n_trees, "warm_start_trees": n_new_trees},
+            parent=parent["version"],
+        )
+        print(f"{model_type}: extended version {parent['version']} to {n_trees} trees, accuracy {accuracy:.4f}")
+
+    with open(os.path.join(delta_dir(project_name), "keys.json")) as f:
+        new_keys = json.load(f)
+    process_shapefiles.save_marker_index(root, process_shapefiles.load_marker_index(root) + new_keys)
+    shutil.rmtree(delta_dir(project_name), ignore_errors=True)
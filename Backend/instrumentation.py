@@ -0,0 +1,262 @@
+import os
+import sys
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+
+from workspace import project_dir
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; peak RSS is then not reported
+    resource = None
+
+# Lightweight spans around the pipeline stages: wall time, item counts (rows,
+# pixels, ...) and the peak RSS reached while the span was open. Spans feed the in-process metrics
+# exported at /metrics, and the spans of a pipeline job are also written as a
+# JSON trace in the project directory, which the API process ingests when the
+# job finishes. With CROPMAP_INSTRUMENTATION=0 the decorators return the
+# functions unchanged and spans are no-ops.
+ENABLED = os.environ.get("CROPMAP_INSTRUMENTATION", "1") == "1"
+TRACE_DIRNAME = "traces"
+METRIC_PREFIX = "cropmap"
+PROC_STATUS_PATH = "/proc/self/status"
+PROC_CLEAR_REFS_PATH = "/proc/self/clear_refs"
+
+
+def peak_rss_bytes():
+    # High-water mark of the whole process since it started
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def rss_high_water_mark():
+    # Linux VmHWM: peak RSS since the process started or since the last
+    # reset_rss_high_water_mark()
+    try:
+        with open(PROC_STATUS_PATH) as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_rss_high_water_mark():
+    try:
+        with open(PROC_CLEAR_REFS_PATH, "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+# Spans can only be measured one by one where the kernel lets the high-water
+# mark be reset; elsewhere they report the process high-water mark.
+SPAN_PEAK_RSS = rss_high_water_mark() is not None and reset_rss_high_water_mark()
+PEAK_RSS_SCOPE = "span" if SPAN_PEAK_RSS else "process"
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.spans = {}  # name -> {"count", "errors", "seconds", "last_seconds", "peak_rss_bytes"}
+        self.items = {}  # (span, item) -> total
+
+    def record(self, span):
+        with self._lock:
+            stats = self.spans.setdefault(span["name"], {
+                "count": 0, "errors": 0, "seconds": 0.0, "last_seconds": 0.0, "peak_rss_bytes": 0,
+            })
+            stats["count"] += 1
+            stats["errors"] += span["error"] is not None
+            stats["seconds"] += span["seconds"]
+            stats["last_seconds"] = span["seconds"]
+            stats["peak_rss_bytes"] = max(stats["peak_rss_bytes"], span["peak_rss_bytes"] or 0)
+            for item, value in span["counts"].items():
+                self.items[(span["name"], item)] = self.items.get((span["name"], item), 0) + value
+
+    def prometheus(self):
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{escape_label(val)}"' for key, val in labels.items())
+                label_text = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"{METRIC_PREFIX}_{name}{label_text} {value}")
+
+        with self._lock:
+            spans = sorted(self.spans.items())
+            items = sorted(self.items.items())
+        family("span_seconds_total", "counter", "Wall time spent in each instrumented stage.",
+               [({"span": name}, stats["seconds"]) for name, stats in spans])
+        family("span_runs_total", "counter", "Completed runs of each instrumented stage.",
+               [({"span": name}, stats["count"]) for name, stats in spans])
+        family("span_errors_total", "counter", "Runs of each instrumented stage that raised.",
+               [({"span": name}, stats["errors"]) for name, stats in spans])
+        family("span_last_seconds", "gauge", "Wall time of the latest run of each stage.",
+               [({"span": name}, stats["last_seconds"]) for name, stats in spans])
+        family("span_peak_rss_bytes", "gauge", f"Highest peak RSS reached during each stage ({PEAK_RSS_SCOPE} high-water mark).",
+               [({"span": name}, stats["peak_rss_bytes"]) for name, stats in spans])
+        family("span_items_total", "counter", "Rows, pixels and other items processed by each stage.",
+               [({"span": name, "item": item}, value) for (name, item), value in items])
+        family("process_peak_rss_bytes", "gauge", "Peak RSS of the API process.",
+               [({}, peak_rss_bytes() or 0)])
+        return "\n".join(lines) + "\n"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Metrics()
+_local = threading.local()
+_trace_lock = threading.Lock()
+_trace = None  # Spans of the job currently traced in this process
+_rss_lock = threading.Lock()
+_open_spans = set()  # Of every thread: a reset must not lose their peaks
+
+
+class Span:
+    def __init__(self, name, parent):
+        self.name = name
+        self.parent = parent
+        self.counts = {}
+        self.peak_rss_bytes = 0
+
+    def count(self, item, value):
+        self.counts[item] = self.counts.get(item, 0) + int(value)
+
+
+class _NullSpan:
+    def count(self, item, value):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+def _open_rss_span(current):
+    # The mark is reset for the new span; the spans already open keep the
+    # peak they reached before it.
+    if not SPAN_PEAK_RSS:
+        return
+    with _rss_lock:
+        peak = rss_high_water_mark() or 0
+        for other in _open_spans:
+            other.peak_rss_bytes = max(other.peak_rss_bytes, peak)
+        _open_spans.add(current)
+        reset_rss_high_water_mark()
+
+
+def _close_rss_span(current):
+    if not SPAN_PEAK_RSS:
+        return peak_rss_bytes()
+    with _rss_lock:
+        _open_spans.discard(current)
+        return max(current.peak_rss_bytes, rss_high_water_mark() or 0)
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+@contextmanager
+def span(name):
+    if not ENABLED:
+        yield NULL_SPAN
+        return
+    stack = _stack()
+    current = Span(name, stack[-1].name if stack else None)
+    stack.append(current)
+    _open_rss_span(current)
+    started_at = time.time()
+    start = time.perf_counter()
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        stack.pop()
+        peak_rss = _close_rss_span(current)
+        record = {
+            "name": name,
+            "parent": current.parent,
+            "started_at": started_at,
+            "seconds": time.perf_counter() - start,
+            "counts": current.counts,
+            "peak_rss_bytes": peak_rss,
+            "peak_rss_scope": PEAK_RSS_SCOPE,
+            "error": error,
+        }
+        metrics.record(record)
+        with _trace_lock:
+            if _trace is not None:
+                _trace["spans"].append(record)
+
+
+def count(item, value):
+    # Adds to the innermost open span of this thread
+    stack = _stack() if ENABLED else None
+    if stack:
+        stack[-1].count(item, value)
+
+
+def instrumented(name=None):
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name or fn.__name__):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_path(project_name, run_id):
+    return os.path.join(project_dir(project_name), TRACE_DIRNAME, f"{run_id}.json")
+
+
+@contextmanager
+def trace(path, **attributes):
+    # Collects every span of the enclosed run and writes them to path
+    global _trace
+    if not ENABLED:
+        yield
+        return
+    with _trace_lock:
+        _trace = {**attributes, "started_at": time.time(), "spans": []}
+    try:
+        yield
+    finally:
+        with _trace_lock:
+            run, _trace = _trace, None
+        run["finished_at"] = time.time()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(run, f, indent=2)
+        os.replace(tmp_path, path)
+
+
+def ingest_trace(path):
+    # Spans recorded by a worker process become part of this process's metrics
+    if not ENABLED or not os.path.exists(path):
+        return
+    with open(path) as f:
+        for record in json.load(f)["spans"]:
+            metrics.record(record)
@@ -0,0 +1,443 @@
+import os
+import json
+import sqlite3
+import time
+import traceback
+import uuid
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import instrumentation
+
+JOBS_DB_PATH = os.environ.get("CROPMAP_JOBS_DB", "jobs.sqlite")
+JOB_WORKERS = int(os.environ.get("CROPMAP_JOB_WORKERS", 2))
+
+PIPELINE_STAGES = ["extraction", "preprocess", "training", "prediction"]
+
+QUEUED, RUNNING, DONE, FAILED, PENDING = "queued", "running", "done", "failed", "pending"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    owner_pid INTEGER
+);
+CREATE TABLE IF NOT EXISTS job_stages (
+    job_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    PRIMARY KEY (job_id, name)
+);
+"""
+
+ORPHANED_ERROR = "The server process running this job stopped before it finished."
+
+
+def pid_alive(pid):
+    if pid is None:
+        return False
+    if pid == os.getpid():
+        return True
+    if os.name == "nt":
+        return False  # os.kill would terminate the process; only this one counts as alive
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobStore:
+    # Job records live in SQLite so they are shared between the API process and
+    # the pipeline worker processes, and survive restarts.
+
+    def __init__(self, db_path=JOBS_DB_PATH):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            # Databases created before jobs recorded their owning process
+            if "owner_pid" not in {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}:
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner_pid INTEGER")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create(self, params, owner_pid=None):
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, params, created_at, owner_pid) VALUES (?, ?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(params), time.time(), owner_pid),
+            )
+            conn.executemany(
+                "INSERT INTO job_stages (job_id, position, name, status) VALUES (?, ?, ?, ?)",
+                [(job_id, position, name, PENDING) for position, name in enumerate(PIPELINE_STAGES)],
+            )
+        return job_id
+
+    def update_job(self, job_id, **fields):
+        columns = ", ".join(f"{column} = ?" for column in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def update_stage(self, job_id, name, **fields):
+        columns = ", ".join(f"{column} = ?" for column in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE job_stages SET {columns} WHERE job_id = ? AND name = ?", (*fields.values(), job_id, name))
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            job = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            stages = conn.execute(
+                "SELECT * FROM job_stages WHERE job_id = ? ORDER BY position", (job_id,)
+            ).fetchall()
+        return format_job(job, stages)
+
+    def list(self, limit=50):
+        with self._connect() as conn:
+            ids = [row["id"] for row in conn.execute("SELECT id FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,))]
+        return [self.get(job_id) for job_id in ids]
+
+    def active_job(self, project_name):
+        with self._connect() as conn:
+            for row in conn.execute(
+                "SELECT id, params FROM jobs WHERE status IN (?, ?) ORDER BY created_at", (QUEUED, RUNNING)
+            ):
+                if json.loads(row["params"]).get("project_name") == project_name:
+                    return row["id"]
+        return None
+
+    def orphaned(self):
+        # Queued or running jobs whose owning API process is gone
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, params, owner_pid FROM jobs WHERE status IN (?, ?) ORDER BY created_at", (QUEUED, RUNNING)
+            ).fetchall()
+        return [(row["id"], json.loads(row["params"]), row["owner_pid"]) for row in rows if not pid_alive(row["owner_pid"])]
+
+    def claim(self, job_id, old_owner, new_owner):
+        # Only one process can take over an orphaned job
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET owner_pid = ? WHERE id = ? AND owner_pid IS ? AND status IN (?, ?)",
+                (new_owner, job_id, old_owner, QUEUED, RUNNING),
+            )
+        return cursor.rowcount == 1
+
+    def fail_orphaned(self):
+        # Orphans nobody resumed would otherwise block their project forever
+        failed = []
+        for job_id, _, owner in self.orphaned():
+            with self._connect() as conn:
+                cursor = conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ? AND owner_pid IS ? AND status IN (?, ?)",
+                    (FAILED, ORPHANED_ERROR, time.time(), job_id, owner, QUEUED, RUNNING),
+                )
+                if cursor.rowcount == 1:
+                    conn.execute(
+                        "UPDATE job_stages SET status = ?, finished_at = ? WHERE job_id = ? AND status = ?",
+                        (FAILED, time.time(), job_id, RUNNING),
+                    )
+                    failed.append(job_id)
+        return failed
+
+    def reset_unfinished_stages(self, job_id):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE job_stages SET status = ?, started_at = NULL, finished_at = NULL WHERE job_id = ? AND status != ?",
+                (PENDING, job_id, DONE),
+            )
+            conn.execute("UPDATE jobs SET status = ? WHERE id = ?", (QUEUED, job_id))
+
+
+def format_job(job, stages):
+    stage_list = []
+    for stage in stages:
+        duration = None
+        if stage["started_at"] is not None and stage["finished_at"] is not None:
+            duration = stage["finished_at"] - stage["started_at"]
+        stage_list.append({
+            "name": stage["name"],
+            "status": stage["status"],
+            "started_at": stage["started_at"],
+            "finished_at": stage["finished_at"],
+            "duration": duration,
+        })
+    done = sum(stage["status"] == DONE for stage in stage_list)
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "params": json.loads(job["params"]),
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "progress": done / len(stage_list) if stage_list else 0.0,
+        "stages": stage_list,
+    }
+
+
+# ------------------ Worker side ------------------ #
+# Pool workers outlive a job, so models and stacks loaded by the prediction
+# stage stay warm for the next job of the same project in this worker.
+_worker_cache = None
+
+
+def worker_cache():
+    global _worker_cache
+    if _worker_cache is None:
+        from model_cache import ProjectCache
+        _worker_cache = ProjectCache()
+    return _worker_cache
+
+
+def pipeline_stage_functions(params):
+    # Imported in the worker so the API process never loads Earth Engine or the
+    # training stack just to queue a job.
+    import process_shapefiles
+    from preProcess import PreProcess_PipeLine, DEFAULT_DROP_COLS
+    from modelCreationp import modelCreation_PipeLine, register_restored_run, training_run_outputs
+    from prediction import prediction_PipeLine
+    from stage_cache import StageCache, shapefile_parts
+    from workspace import project_dir
+    from artifact_store import artifact_paths
+    from raster_stack import band_dir
+
+    project_name = params["project_name"]
+    root = project_dir(project_name)
+    drop_cols = params.get("drop_cols", DEFAULT_DROP_COLS)
+    tall_csvs = [os.path.join(root, f"{band}_timeseries_{project_name}.csv") for band in ("VV", "VH", "NDVI")]
+    features_csv = os.path.join(root, "timeseries", "crops3inc_multiclass_S1S2_onlytimeseries_v01.csv")
+    extraction_backend = params.get("extraction_backend", "ee")
+    # The local backend's band rasters are inputs of the extraction stage
+    extraction_inputs = shapefile_parts(params["roi_path"]) + shapefile_parts(params["markers_path"])
+    if extraction_backend == "local":
+        extraction_inputs.append(params.get("raster_dir") or band_dir(project_name))
+
+    def extraction():
+        process_shapefiles.Process(
+            params["roi_path"], params["markers_path"], project_name,
+            backend=extraction_backend, raster_dir=params.get("raster_dir"),
+        )
+
+    def preprocess():
+        PreProcess_PipeLine(project_name=project_name, drop_cols=drop_cols)
+
+    def training():
+        modelCreation_PipeLine(
+            project_name=project_name,
+            sample_size=params["sample_size"],
+            test_size=params["test_size"],
+            n_trees=params["n_trees"],
+            chunksize=params.get("chunksize"),
+        )
+
+    if params.get("incremental"):
+        # Only markers missing from the project's index are extracted and
+        # preprocessed; the registered forests are extended by warm start.
+        import incremental_training
+        return {
+            "extraction": lambda: incremental_training.extract_delta_markers(
+                project_name, params["roi_path"], params["markers_path"],
+                backend=extraction_backend, raster_dir=params.get("raster_dir"),
+            ),
+            "preprocess": lambda: incremental_training.preprocess_delta(project_name, drop_cols),
+            "training": lambda: incremental_training.train_incremental(
+                project_name,
+                sample_size=params["sample_size"],
+                test_size=params["test_size"],
+                n_new_trees=params.get("n_new_trees", incremental_training.DEFAULT_NEW_TREES),
+            ),
+            "prediction": lambda: prediction_PipeLine(project_name, cache=worker_cache()),
+        }
+
+    if not params.get("use_stage_cache", True):
+        return {
+            "extraction": extraction,
+            "preprocess": preprocess,
+            "training": training,
+            "prediction": lambda: prediction_PipeLine(project_name, cache=worker_cache()),
+        }
+
+    # Unchanged inputs and parameters restore a stage's previous outputs
+    # instead of re-running it.
+    cache = StageCache()
+
+    def cached_training():
+        restored = cache.run(
+            "training",
+            artifact_paths(features_csv) + [tall_csvs[2]],
+            {
+                "sample_size": params["sample_size"], "test_size": params["test_size"],
+                "n_trees": params["n_trees"], "chunksize": params.get("chunksize"),
+            },
+            # Only this run's files: metrics/ also keeps every earlier model
+            lambda: training_run_outputs(project_name),
+            training,
+            root=root,
+            project=project_name,
+        )
+        if restored:
+            # The registry is not a stage output; restored models join it again
+            register_restored_run(project_name)
+
+    return {
+        "extraction": lambda: cache.run(
+            "extraction",
+            extraction_inputs,
+            {
+                "start_s1": process_shapefiles.START_S1, "end_s1": process_shapefiles.END_S1,
+                "start_s2": process_shapefiles.START_S2, "end_s2": process_shapefiles.END_S2,
+                "backend": extraction_backend,
+            },
+            # The marker index lets a later incremental run find the new markers
+            tall_csvs + [os.path.join(root, process_shapefiles.MARKER_INDEX_FILENAME)],
+            extraction,
+            root=root,
+            project=project_name,
+        ),
+        "preprocess": lambda: cache.run(
+            "preprocess",
+            tall_csvs,
+            {"drop_cols": drop_cols},
+            [os.path.join(root, "timeseries"), os.path.join(root, "timeseries_trend_figures")],
+            preprocess,
+            root=root,
+            project=project_name,
+        ),
+        "training": cached_training,
+        "prediction": lambda: prediction_PipeLine(project_name, cache=worker_cache()),
+    }
+
+
+def run_pipeline_job(db_path, job_id, params):
+    store = JobStore(db_path)
+    store.update_job(job_id, status=RUNNING, started_at=time.time())
+    try:
+        stages = pipeline_stage_functions(params)
+    except Exception:
+        store.update_job(job_id, status=FAILED, error=traceback.format_exc(), finished_at=time.time())
+        return
+    completed = {stage["name"] for stage in store.get(job_id)["stages"] if stage["status"] == DONE}
+
+    # The job's spans are written to the project's trace directory; the API
+    # process ingests them into /metrics when the job finishes.
+    with instrumentation.trace(instrumentation.trace_path(params["project_name"], job_id), job_id=job_id, params=params):
+        for name in PIPELINE_STAGES:
+            if name in completed:
+                continue  # Finished before a restart
+            store.update_stage(job_id, name, status=RUNNING, started_at=time.time())
+            try:
+                with instrumentation.span(f"stage_{name}"):
+                    stages[name]()
+            except Exception:
+                store.update_stage(job_id, name, status=FAILED, finished_at=time.time())
+                store.update_job(job_id, status=FAILED, error=traceback.format_exc(), finished_at=time.time())
+                return
+            store.update_stage(job_id, name, status=DONE, finished_at=time.time())
+
+    store.update_job(job_id, status=DONE, finished_at=time.time())
+
+
+# ------------------ API side ------------------ #
+class JobConflict(Exception):
+    # The project already has an active job with different parameters
+    def __init__(self, job_id):
+        super().__init__(f"Job {job_id} is already running for this project with different parameters")
+        self.job_id = job_id
+
+
+class JobQueue:
+    def __init__(self, store, max_workers=JOB_WORKERS):
+        self.store = store
+        self.owner_pid = os.getpid()
+        self.max_workers = max_workers
+        self._submit_lock = threading.Lock()
+        self._executor_lock = threading.Lock()
+        self._resumed = False
+        self.executor = self._new_executor()
+
+    def _new_executor(self):
+        # spawn: workers start from a clean interpreter rather than forking the
+        # threaded Flask process.
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def _replace_broken_executor(self, executor):
+        # A worker that died takes the whole pool down with it; the first
+        # caller to notice starts a new one for the jobs that follow.
+        with self._executor_lock:
+            if self.executor is executor:
+                self.executor = self._new_executor()
+                executor.shutdown(wait=False)
+            return self.executor
+
+    def submit(self, params):
+        # Runs of different projects proceed in parallel; a second run of a
+        # project that is already queued or running joins the existing job
+        # when the parameters match and is refused otherwise, instead of
+        # racing on its workspace.
+        with self._submit_lock:
+            self.store.fail_orphaned()
+            active = self.store.active_job(params["project_name"])
+            if active is not None:
+                if self.store.get(active)["params"] != json.loads(json.dumps(params)):
+                    raise JobConflict(active)
+                return active
+            job_id = self.store.create(params, owner_pid=self.owner_pid)
+        self._run(job_id, params)
+        return job_id
+
+    def _run(self, job_id, params):
+        executor = self.executor
+        try:
+            try:
+                future = executor.submit(run_pipeline_job, self.store.db_path, job_id, params)
+            except BrokenProcessPool:
+                executor = self._replace_broken_executor(executor)
+                future = executor.submit(run_pipeline_job, self.store.db_path, job_id, params)
+        except Exception:
+            # Never leave a queued row that no worker will pick up
+            self.store.update_job(job_id, status=FAILED, error=traceback.format_exc(), finished_at=time.time())
+            raise
+        trace = instrumentation.trace_path(params["project_name"], job_id)
+        future.add_done_callback(lambda done: self._finished(job_id, trace, executor, done))
+
+    def _finished(self, job_id, trace, executor, future):
+        if not future.cancelled() and future.exception() is not None:
+            # The worker process died; run_pipeline_job records every other failure
+            if isinstance(future.exception(), BrokenProcessPool):
+                self._replace_broken_executor(executor)
+            self.store.update_job(job_id, status=FAILED, error=repr(future.exception()), finished_at=time.time())
+        instrumentation.ingest_trace(trace)
+
+    def resume(self):
+        # Re-queue jobs whose server stopped while they were queued or running;
+        # stages that already finished are skipped. Runs once per process, and
+        # each orphan is claimed by a single process.
+        with self._submit_lock:
+            if self._resumed:
+                return []
+            self._resumed = True
+            resumed = []
+            for job_id, params, owner in self.store.orphaned():
+                if self.store.claim(job_id, owner, self.owner_pid):
+                    self.store.reset_unfinished_stages(job_id)
+                    self._run(job_id, params)
+                    resumed.append(job_id)
+        return resumed
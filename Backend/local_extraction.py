@@ -0,0 +1,159 @@
+import os
+import glob
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import rasterio
+from rasterio.windows import Window
+
+from local_file_upload import geometryKey
+from raster_stack import band_dir
+
+# Offline alternative to the Earth Engine extraction: marker values are sampled
+# from local per-date rasters named <band>_<date>.tif (the same files the
+# prediction stack is built from). Points are grouped by raster block so each
+# block is read once, and every point takes the mean of the pixels within a
+# 10 m footprint, like reduceRegions(scale=10). The tall tables have the
+# columns and row order of the Earth Engine export.
+FOOTPRINT_METERS = 10
+NODATA_VALUE = -9999
+METERS_PER_DEGREE = 111320
+MAX_WORKERS = 4
+
+
+def band_rasters(raster_dir, band_name, start=None, end=None):
+    # (date, path) pairs in date order; the date is the file name after "<band>_"
+    rasters = []
+    for path in glob.glob(os.path.join(raster_dir, f"{band_name}_*.tif")):
+        date = os.path.splitext(os.path.basename(path))[0][len(band_name) + 1:]
+        timestamp = pd.to_datetime(date)
+        if start is not None and timestamp < pd.Timestamp(start):
+            continue
+        if end is not None and timestamp >= pd.Timestamp(end):
+            continue
+        rasters.append((timestamp, date, path))
+    return [(date, path) for _, date, path in sorted(rasters)]
+
+
+def footprint_halo(src, footprint_meters=FOOTPRINT_METERS):
+    # Pixels on each side of the centre pixel that fall inside the footprint
+    resolution = abs(src.transform.a)
+    if src.crs is not None and src.crs.is_geographic:
+        resolution *= METERS_PER_DEGREE
+    return max(0, int(round((footprint_meters / resolution - 1) / 2)))
+
+
+def sample_raster(src, xs, ys, footprint_meters=FOOTPRINT_METERS):
+    # xs/ys in the raster's CRS; NaN where a point has no valid pixel
+    cols_f, rows_f = ~src.transform * (xs, ys)
+    rows = np.floor(rows_f).astype(np.int64)
+    cols = np.floor(cols_f).astype(np.int64)
+    values = np.full(len(xs), np.nan)
+
+    inside = np.flatnonzero((rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width))
+    if inside.size == 0:
+        return values
+
+    halo = footprint_halo(src, footprint_meters)
+    offsets = np.arange(-halo, halo + 1)
+    dr = np.repeat(offsets, len(offsets))
+    dc = np.tile(offsets, len(offsets))
+
+    block_height, block_width = src.block_shapes[0]
+    block_cols = -(-src.width // block_width)
+    block_ids = (rows[inside] // block_height) * block_cols + cols[inside] // block_width
+    order = np.argsort(block_ids, kind='stable')
+    inside, block_ids = inside[order], block_ids[order]
+    starts = np.flatnonzero(np.r_[True, block_ids[1:] != block_ids[:-1]])
+
+    for points in np.split(inside, starts[1:]):
+        # One read per block, padded by the footprint halo
+        block_row, block_col = rows[points[0]] // block_height, cols[points[0]] // block_width
+        row_off = max(block_row * block_height - halo, 0)
+        col_off = max(block_col * block_width - halo, 0)
+        height = min((block_row + 1) * block_height + halo, src.height) - row_off
+        width = min((block_col + 1) * block_width + halo, src.width) - col_off
+        data = src.read(1, window=Window(col_off, row_off, width, height)).astype(np.float64)
+        if src.nodata is not None:
+            data[data == src.nodata] = np.nan
+
+        rr = rows[points, None] - row_off + dr
+        cc = cols[points, None] - col_off + dc
+        within = (rr >= 0) & (rr < height) & (cc >= 0) & (cc < width)
+        samples = np.where(within, data[np.clip(rr, 0, height - 1), np.clip(cc, 0, width - 1)], np.nan)
+        counts = np.sum(~np.isnan(samples), axis=1)
+        sums = np.nansum(samples, axis=1)
+        values[points] = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+    return values
+
+
+def marker_table(markers_path):
+    # Marker attributes as extract_time_series sets them: empty id when
+    # missing, crop name from crpname_eg, then type, else 'unknown'.
+    gdf = gpd.read_file(markers_path).to_crs(epsg=4326)
+    centroids = gdf.geometry.centroid
+    ids = gdf['id'] if 'id' in gdf.columns else pd.Series("", index=gdf.index)
+    crops = pd.Series('unknown', index=gdf.index, dtype=object)
+    for column in ('type', 'crpname_eg'):
+        if column in gdf.columns:
+            present = gdf[column].notna() & (gdf[column] != "")
+            crops[present] = gdf.loc[present, column]
+    markers = pd.DataFrame({
+        'id': ids.where(ids.notna() & (ids != ""), ""),
+        'crpname_eg': crops,
+        'lat': centroids.y,
+        'lon': centroids.x,
+        'geometry': "",
+    })
+    return gdf, markers.reset_index(drop=True)
+
+
+def sample_band(gdf, rasters, max_workers=MAX_WORKERS):
+    # Marker coordinates are reprojected once per raster CRS
+    projected = {}
+
+    def sample(path):
+        with rasterio.open(path) as src:
+            key = src.crs.to_string() if src.crs else None
+            if key not in projected:
+                points = gdf.geometry.centroid if src.crs is None else gdf.to_crs(src.crs).geometry.centroid
+                projected[key] = (points.x.to_numpy(), points.y.to_numpy())
+            xs, ys = projected[key]
+            return sample_raster(src, xs, ys)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(sample, [path for _, path in rasters]))
+
+
+def write_local_time_series(markers, band_name, rasters, band_values, output_path):
+    # Date by date, markers in upload order, columns sorted by name
+    frames = []
+    for (date, _), values in zip(rasters, band_values):
+        frame = markers.copy()
+        frame['date'] = date
+        frame[band_name] = np.where(np.isnan(values), NODATA_VALUE, values)
+        frames.append(frame)
+    columns = sorted(['id', 'date', band_name, 'crpname_eg', 'lat', 'lon', 'geometry'])
+    table = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+    table[columns].to_csv(output_path, index=False)
+
+
+def extract_local_time_series(markers_path, output_folder, project_name, raster_dir=None, date_ranges=None, max_workers=MAX_WORKERS):
+    # date_ranges: optional {band: (start, end)} season filter per band
+    raster_dir = raster_dir or band_dir(project_name)
+    gdf, markers = marker_table(markers_path)
+    os.makedirs(output_folder, exist_ok=True)
+
+    for band_name in ('VV', 'VH', 'NDVI'):
+        start, end = (date_ranges or {}).get(band_name, (None, None))
+        rasters = band_rasters(raster_dir, band_name, start, end)
+        if not rasters:
+            raise FileNotFoundError(f"No {band_name}_<date>.tif rasters in '{raster_dir}'")
+        print(f"Sampling {len(markers)} markers from {len(rasters)} {band_name} rasters...")
+        band_values = sample_band(gdf, rasters, max_workers)
+        write_local_time_series(markers, band_name, rasters, band_values, f'{output_folder}/{band_name}_timeseries_{project_name}.csv')
+        print(f"Exported {band_name} time series")
+
+    return [geometryKey(geometry) for geometry in gdf.geometry]
@@ -1,33 +1,50 @@
-import ee
 import geopandas as gpd
 import json
-
-ee.Initialize(project='ee-sudharsanr836')
+import hashlib
+from ee_client import ee
 
 
 
 def localFeature(local_shapefile_path):
 
+    # Create an ee.FeatureCollection from the list
+    return ee.FeatureCollection(localFeatureList(local_shapefile_path))
+
+
+def localFeatureList(local_shapefile_path):
+
+    features, _ = localMarkers(local_shapefile_path)
+    return features
+
+
+def geometryKey(geometry):
+    # Stable hash of a WGS84 geometry; coordinates are rounded to ~1 cm so the
+    # same marker re-uploaded from another tool still matches.
+    rounded = json.loads(json.dumps(geometry.__geo_interface__), parse_float=lambda v: round(float(v), 7))
+    return hashlib.sha1(json.dumps(rounded, sort_keys=True).encode()).hexdigest()
+
+
+def localMarkers(local_shapefile_path):
+
     gdf = gpd.read_file(local_shapefile_path)
 
     # Convert to WGS84 (lat/lon), required for Earth Engine
     gdf = gdf.to_crs(epsg=4326)
 
-    # Convert GeoDataFrame to a list of ee.Feature objects
+    # Convert GeoDataFrame to a list of ee.Feature objects, plus the local
+    # properties of each feature for rebuilding rows without Earth Engine
     features = []
+    records = []
     for index, row in gdf.iterrows():
         geojson_geometry = json.loads(json.dumps(row.geometry.__geo_interface__))
         ee_geometry = ee.Geometry(geojson_geometry)
-        
+
         # Remove any non-serializable values from properties
         props = {k: v for k, v in row.to_dict().items() if isinstance(v, (str, int, float, bool, type(None)))}
-        
+        props['geom_key'] = geometryKey(row.geometry)
+
         feature = ee.Feature(ee_geometry, props)
         features.append(feature)
+        records.append(props)
 
-    # Create an ee.FeatureCollection from the list
-    local_fc = ee.FeatureCollection(features)
-
-    return local_fc
-
-
+    return features, records
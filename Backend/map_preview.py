@@ -0,0 +1,159 @@
+import os
+import json
+
+import numpy as np
+import folium
+from folium.plugins import MarkerCluster
+from folium.template import Template
+
+# Upload previews. Small uploads keep one folium.Marker per feature; above the
+# threshold the points are emitted as one compact payload (quantised integer
+# coordinates and label codes) that the browser turns into a clustered layer.
+# Above the aggregation threshold the points are first binned on a grid and
+# each occupied cell becomes one marker with its point count, so the HTML
+# stays small for very large ground-truth sets.
+CLUSTER_THRESHOLD = int(os.environ.get("CROPMAP_PREVIEW_CLUSTER_THRESHOLD", 1000))
+AGGREGATE_THRESHOLD = int(os.environ.get("CROPMAP_PREVIEW_AGGREGATE_THRESHOLD", 20000))
+AGGREGATE_GRID = 128  # Cells per side of the bounding box
+COORDINATE_SCALE = 10 ** 5  # ~1 m; payload coordinates are integer offsets in these units
+
+MARKER_TYPE_COLORS = {
+    'water': 'blue',
+    'rice': 'green',
+    'wheat': 'orange',
+    'maize': 'purple'
+}
+DEFAULT_MARKER_COLOR = 'gray'
+
+
+
+class CompactPointCluster(MarkerCluster):
+    # Clustered circle markers decoded in the browser from a payload of
+    # {origin, scale, lat, lon, code, labels, colors[, count]}
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function(){
+                var points = {{ this.payload }};
+                var cluster = L.markerClusterGroup({{ this.options|tojavascript }});
+                for (var i = 0; i < points.lat.length; i++) {
+                    var code = points.code[i];
+                    var color = points.colors[code];
+                    var n = points.count ? points.count[i] : 1;
+                    var marker = L.circleMarker(new L.LatLng(
+                        points.origin[0] + points.lat[i] / points.scale,
+                        points.origin[1] + points.lon[i] / points.scale
+                    ), {
+                        radius: n > 1 ? 5 + Math.log2(n) : 5,
+                        color: color, fillColor: color, fillOpacity: 0.8, weight: 1
+                    });
+                    marker.bindPopup(n > 1 ? points.labels[code] + " (" + n + " points)" : points.labels[code]);
+                    marker.addTo(cluster);
+                }
+                cluster.addTo({{ this._parent.get_name() }});
+                return cluster;
+            })();
+        {% endmacro %}""")
+
+    def __init__(self, payload, name=None):
+        super().__init__(name=name)
+        self._name = "CompactPointCluster"
+        # "</" would end the script element early if a label contained it
+        self.payload = json.dumps(payload, separators=(",", ":")).replace("</", "<\\/")
+
+
+def aggregate_points(lat, lon, codes, n_labels, grid=AGGREGATE_GRID):
+    # Mean position, point count and most common label of every occupied
+    # cell of a grid x grid binning of the bounding box
+    def cell_index(values):
+        span = values.max() - values.min()
+        if span == 0:
+            return np.zeros(len(values), dtype=np.int64)
+        return np.minimum(((values - values.min()) / span * grid).astype(np.int64), grid - 1)
+
+    cells, cell_of_point = np.unique(cell_index(lat) * grid + cell_index(lon), return_inverse=True)
+    counts = np.bincount(cell_of_point, minlength=len(cells))
+    cell_lat = np.bincount(cell_of_point, weights=lat, minlength=len(cells)) / counts
+    cell_lon = np.bincount(cell_of_point, weights=lon, minlength=len(cells)) / counts
+    label_counts = np.bincount(cell_of_point * n_labels + codes, minlength=len(cells) * n_labels)
+    cell_codes = label_counts.reshape(len(cells), n_labels).argmax(axis=1)
+    return cell_lat, cell_lon, cell_codes, counts
+
+
+def point_payload(lat, lon, labels, colors, aggregate_threshold=AGGREGATE_THRESHOLD):
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    unique_labels, first, codes = np.unique(labels, return_index=True, return_inverse=True)
+    counts = None
+    if len(lat) > aggregate_threshold:
+        lat, lon, codes, counts = aggregate_points(lat, lon, codes, len(unique_labels))
+    origin = [float(lat.min()), float(lon.min())]
+    payload = {
+        "origin": origin,
+        "scale": COORDINATE_SCALE,
+        "lat": np.rint((lat - origin[0]) * COORDINATE_SCALE).astype(np.int64).tolist(),
+        "lon": np.rint((lon - origin[1]) * COORDINATE_SCALE).astype(np.int64).tolist(),
+        "code": codes.tolist(),
+        "labels": [str(label) for label in unique_labels],
+        "colors": [str(color) for color in np.asarray(colors)[first]],
+    }
+    if counts is not None:
+        payload["count"] = counts.tolist()
+    return payload
+
+
+def centered_map(gdf):
+    bounds = gdf.total_bounds
+    center = [(bounds[1] + bounds[3]) / 2, (bounds[0] + bounds[2]) / 2]
+    return folium.Map(location=center, zoom_start=8)
+
+
+def point_labels(gdf):
+    if 'type' not in gdf.columns:
+        return np.full(len(gdf), 'No Label', dtype=object)
+    return gdf['type'].astype(str).to_numpy()
+
+
+def add_points(m, lat, lon, labels, colors, icon=None, threshold=CLUSTER_THRESHOLD, aggregate_threshold=AGGREGATE_THRESHOLD):
+    # colors: one per point, the same for every point of a label
+    if len(lat) > threshold:
+        CompactPointCluster(point_payload(lat, lon, labels, colors, aggregate_threshold), name="Points").add_to(m)
+        return
+    for y, x, label, color in zip(lat, lon, labels, colors):
+        folium.Marker(
+            location=[y, x],
+            popup=label,
+            icon=folium.Icon(color=color, icon=icon) if icon else folium.Icon(color=color)
+        ).add_to(m)
+
+
+def boundary_preview_map(gdf, output_path, threshold=CLUSTER_THRESHOLD, aggregate_threshold=AGGREGATE_THRESHOLD):
+    # gdf in EPSG:4326; centroids are computed in a projected CRS
+    centroids = gdf.to_crs(epsg=32644).centroid.to_crs(epsg=4326)
+    m = centered_map(gdf)
+
+    folium.GeoJson(
+        gdf,
+        name="Shapefile",
+        style_function=lambda x: {
+            'color': 'blue',
+            'weight': 2,
+            'fillOpacity': 0.1
+        }
+    ).add_to(m)
+
+    colors = np.full(len(gdf), 'red', dtype=object)
+    add_points(m, centroids.y.to_numpy(), centroids.x.to_numpy(), point_labels(gdf), colors, threshold=threshold, aggregate_threshold=aggregate_threshold)
+    m.save(output_path)
+    return output_path
+
+
+def markers_preview_map(gdf, output_path, threshold=CLUSTER_THRESHOLD, aggregate_threshold=AGGREGATE_THRESHOLD):
+    # gdf of points in EPSG:4326
+    m = centered_map(gdf)
+    labels = point_labels(gdf)
+    colors = np.array([MARKER_TYPE_COLORS.get(label.lower(), DEFAULT_MARKER_COLOR) for label in np.unique(labels)], dtype=object)
+    # One dictionary lookup per distinct label, broadcast back to the points
+    _, inverse = np.unique(labels, return_inverse=True)
+    add_points(m, gdf.geometry.y.to_numpy(), gdf.geometry.x.to_numpy(), labels, colors[inverse], icon='info-sign', threshold=threshold, aggregate_threshold=aggregate_threshold)
+    m.save(output_path)
+    return output_path
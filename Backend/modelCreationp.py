@@ -3,6 +3,8 @@
 Modularized crop classification pipeline using Random Forest and Balanced Random Forest
 """
 
+import os
+import json
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
@@ -12,23 +14,70 @@ from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score, confusion_matrix, ConfusionMatrixDisplay, classification_report
 from sklearn.ensemble import RandomForestClassifier
 from imblearn.ensemble import BalancedRandomForestClassifier
+from workspace import project_dir
+from artifact_store import load_table, iter_table_chunks
+from model_search import search_models, best_params, LEADERBOARD_FILENAME
+from model_registry import ModelRegistry, training_fingerprint
+from instrumentation import instrumented, count
+
+
+SAMPLE_SEED = 42
+# Files and models of the latest training run. The files are the training
+# stage's cached outputs, and the models are registered again after they are
+# restored from the stage cache.
+TRAINING_RUN_FILENAME = "training_run.json"
 
 
 # ------------------ Data Utilities ------------------ #
-def balance_class_samples(input_file_path, sample_size):
-    df = pd.read_csv(input_file_path)
+def balance_class_samples(input_file_path, sample_size, chunksize=None):
+    # With a chunksize the table is streamed instead of loaded whole
+    if chunksize:
+        return stream_sample_per_class(input_file_path, sample_size, chunksize)
+    df = load_table(input_file_path)
+    return sample_per_class(df, sample_size)
+
+
+def stream_sample_per_class(input_file_path, sample_size, chunksize, seed=SAMPLE_SEED):
+    # One pass of per-class reservoir sampling: every row draws a random key
+    # and each class keeps the sample_size rows with the smallest keys, which
+    # is a uniform sample without replacement. Memory is bounded by
+    # classes x sample_size rows plus one chunk.
+    rng = np.random.default_rng(seed)
+    reservoir = None
+    class_counts = pd.Series(dtype=np.int64)
+    for chunk in iter_table_chunks(input_file_path, chunksize):
+        class_counts = class_counts.add(chunk['Class'].value_counts(), fill_value=0)
+        chunk = chunk.assign(_key=rng.random(len(chunk)))
+        pool = chunk if reservoir is None else pd.concat([reservoir, chunk], ignore_index=True)
+        pool = pool.sort_values('_key', kind='stable')
+        reservoir = pool[pool.groupby('Class').cumcount() < sample_size]
+
+    if reservoir is None:
+        raise ValueError(f"No rows to sample in {input_file_path}")
+    print('Original Class Distribution:', class_counts.astype(np.int64).sort_values(ascending=False))
+    for class_label, count in class_counts.items():
+        if count < sample_size:
+            print(f"Class {class_label} has only {int(count)} samples. Using all.")
+
+    # Rows are already in random key order, so the result comes out shuffled
+    df_balanced = reservoir.drop(columns='_key').reset_index(drop=True)
+    print('Balanced Class Distribution:', df_balanced['Class'].value_counts())
+    return df_balanced
+
+
+def sample_per_class(df, sample_size):
     print('Original Class Distribution:', df['Class'].value_counts())
 
     balanced_classes = []
     for class_label in df['Class'].unique():
         class_subset = df[df['Class'] == class_label]
         if len(class_subset) >= sample_size:
-            balanced_classes.append(class_subset.sample(n=sample_size, random_state=42))
+            balanced_classes.append(class_subset.sample(n=sample_size, random_state=SAMPLE_SEED))
         else:
             print(f"Class {class_label} has only {len(class_subset)} samples. Using all.")
             balanced_classes.append(class_subset)
 
-    df_balanced = pd.concat(balanced_classes).sample(frac=1, random_state=42).reset_index(drop=True)
+    df_balanced = pd.concat(balanced_classes).sample(frac=1, random_state=SAMPLE_SEED).reset_index(drop=True)
     print('Balanced Class Distribution:', df_balanced['Class'].value_counts())
     return df_balanced
 
@@ -55,8 +104,8 @@ def plot_feature_importance(model, columns, save_path):
     plt.savefig(save_path)
 
 
-def custom_random_forest_classifier(X_train, X_test, y_train, y_test, n_estimators, save_path):
-    rfc = RandomForestClassifier(n_estimators=n_estimators, random_state=0)
+def custom_random_forest_classifier(X_train, X_test, y_train, y_test, n_estimators, save_path, params=None):
+    rfc = RandomForestClassifier(**{"n_estimators": n_estimators, "random_state": 0, **(params or {})})
     rfc.fit(X_train, y_train)
     y_pred = rfc.predict(X_test)
     accuracy = accuracy_score(y_test, y_pred)
@@ -67,14 +116,15 @@ def custom_random_forest_classifier(X_train, X_test, y_train, y_test, n_estimato
     return model_filename, accuracy, y_pred
 
 
-def custom_balanced_random_forest_classifier(X_train, X_test, y_train, y_test, n_estimators, save_path):
-    brfc = BalancedRandomForestClassifier(
-        n_estimators=n_estimators,
-        sampling_strategy="all",
-        replacement=True,
-        random_state=0,
-        bootstrap=False
-    )
+def custom_balanced_random_forest_classifier(X_train, X_test, y_train, y_test, n_estimators, save_path, params=None):
+    brfc = BalancedRandomForestClassifier(**{
+        "n_estimators": n_estimators,
+        "sampling_strategy": "all",
+        "replacement": True,
+        "random_state": 0,
+        "bootstrap": False,
+        **(params or {})
+    })
     brfc.fit(X_train, y_train)
     y_pred = brfc.predict(X_test)
     accuracy = accuracy_score(y_test, y_pred)
@@ -105,26 +155,97 @@ def evaluation_metrics(labels, y_test, y_pred, save_path, model_type, accuracy):
 
 
 # ------------------ Main Runner ------------------ #
-def modelCreation_PipeLine(project_name, sample_size, test_size, n_trees):
-    input_dir = rf"Crop_mapping_{project_name}"
-    save_path = rf"{input_dir}/metrics/"
-    input_file_path = rf"{input_dir}/timeseries/crops3inc_multiclass_S1S2_onlytimeseries_v01.csv"
-    label_file_path = f"{input_dir}/NDVI_timeseries_{project_name}.csv"
+@instrumented()
+def modelCreation_PipeLine(project_name, sample_size, test_size, n_trees, search=False, n_iter=None, cv=5, n_jobs=-1, chunksize=None):
+    input_dir = project_dir(project_name)
+    save_path = os.path.join(input_dir, "metrics", "")
+    input_file_path = os.path.join(input_dir, "timeseries", "crops3inc_multiclass_S1S2_onlytimeseries_v01.csv")
+    label_file_path = os.path.join(input_dir, f"NDVI_timeseries_{project_name}.csv")
+    os.makedirs(save_path, exist_ok=True)
 
-    df_labels = pd.read_csv(label_file_path)
+    df_labels = load_table(label_file_path)
     if 'crpname_eg' not in df_labels.columns:
         raise KeyError(f"The file {label_file_path} does not contain the 'crpname_eg' column.")
     labels = df_labels['crpname_eg'].unique().tolist()
     print("Extracted labels:", labels)
 
-    balanced_df = balance_class_samples(input_file_path, sample_size)
+    balanced_df = balance_class_samples(input_file_path, sample_size, chunksize)
+    count("training_rows", len(balanced_df))
     X_train, X_test, y_train, y_test = custom_train_test_split(balanced_df, test_size)
 
-    model_rfc, acc_rfc, y_pred_rfc = custom_random_forest_classifier(X_train, X_test, y_train, y_test, n_trees, save_path)
-    model_brfc, acc_brfc, y_pred_brfc = custom_balanced_random_forest_classifier(X_train, X_test, y_train, y_test, n_trees, save_path)
+    rf_params = brf_params = None
+    if search:
+        # Searched on the training split only; the held-out split still scores the final models
+        leaderboard = search_models(X_train, y_train, save_path, n_iter=n_iter, cv=cv, n_jobs=n_jobs, max_trees=n_trees)
+        rf_params = best_params(leaderboard, "RF")
+        brf_params = best_params(leaderboard, "BRF")
+
+    model_rfc, acc_rfc, y_pred_rfc = custom_random_forest_classifier(X_train, X_test, y_train, y_test, n_trees, save_path, rf_params)
+    model_brfc, acc_brfc, y_pred_brfc = custom_balanced_random_forest_classifier(X_train, X_test, y_train, y_test, n_trees, save_path, brf_params)
+
+    outputs = [LEADERBOARD_FILENAME] if search else []
+    for model_type, model_filename, accuracy, y_pred in (
+        ("RF", model_rfc, acc_rfc, y_pred_rfc),
+        ("BRF", model_brfc, acc_brfc, y_pred_brfc),
+    ):
+        outputs += [
+            model_filename,
+            model_filename.replace(".joblib", "_FeatureImportance.png"),
+            *evaluation_metrics(labels, y_test, y_pred, save_path, model_type, accuracy),
+        ]
+
+    registry = ModelRegistry(save_path)
+    fingerprint = training_fingerprint(balanced_df)
+    models = []
+    for model_type, model_filename, accuracy, params in (
+        ("RF", model_rfc, acc_rfc, rf_params),
+        ("BRF", model_brfc, acc_brfc, brf_params),
+    ):
+        models.append({
+            "model_type": model_type,
+            # File names only: cached outputs are shared between projects
+            "model_path": os.path.basename(model_filename),
+            "metrics": {"accuracy": accuracy},
+            "features": list(X_train.columns),
+            "fingerprint": fingerprint,
+            "params": {"n_estimators": n_trees, **(params or {})},
+        })
+        registry.register(**models[-1])
+
+    with open(os.path.join(save_path, TRAINING_RUN_FILENAME), 'w') as f:
+        json.dump({"outputs": [os.path.basename(path) for path in outputs], "models": models}, f, indent=2)
+
+
+def training_run_outputs(project_name):
+    # Paths the latest training run wrote, its run record included
+    save_path = os.path.join(project_dir(project_name), "metrics")
+    run_path = os.path.join(save_path, TRAINING_RUN_FILENAME)
+    with open(run_path) as f:
+        outputs = json.load(f)["outputs"]
+    return [run_path] + [os.path.join(save_path, name) for name in outputs]
+
+
+def register_restored_run(project_name):
+    # After a stage-cache hit: registers the restored models unless they
+    # already are the latest versions.
+    save_path = os.path.join(project_dir(project_name), "metrics", "")
+    run_path = os.path.join(save_path, TRAINING_RUN_FILENAME)
+    if not os.path.exists(run_path):
+        print(f"No {TRAINING_RUN_FILENAME} in the restored outputs; models not registered")
+        return
+    with open(run_path) as f:
+        models = json.load(f)["models"]
 
-    evaluation_metrics(labels, y_test, y_pred_rfc, save_path, "RF", acc_rfc)
-    evaluation_metrics(labels, y_test, y_pred_brfc, save_path, "BRF", acc_brfc)
+    registry = ModelRegistry(save_path)
+    for model in models:
+        try:
+            latest = registry.resolve(model["model_type"], "latest")
+        except FileNotFoundError:
+            latest = None
+        if latest is not None and latest["path"] == model["model_path"]:
+            continue
+        model.pop("compiled_path", None)  # Recorded by runs cached before compiled forests were dropped
+        registry.register(**model)
 
 
 # ------------------ Entry Point ------------------ #
@@ -0,0 +1,127 @@
+import os
+import threading
+from collections import OrderedDict
+
+# Total size of the deserialized models kept warm in the API process; least
+# recently used entries are evicted beyond it.
+CACHE_MAX_BYTES = int(os.environ.get("CROPMAP_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+# Raster stacks are kept open rather than read, so they are bounded by count
+RASTER_CACHE_MAX_ENTRIES = int(os.environ.get("CROPMAP_RASTER_CACHE_MAX_ENTRIES", 16))
+# Rendered PNG previews and tiles are small; they get their own budget
+RENDER_CACHE_MAX_BYTES = int(os.environ.get("CROPMAP_RENDER_CACHE_MAX_BYTES", 256 * 1024 ** 2))
+
+
+class LRUCache:
+    def __init__(self, max_bytes, max_entries=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.oversize = 0
+        self._entries = OrderedDict()  # key -> (stamp, value, size)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, stamp, loader, sizeof):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value = loader()
+        size = sizeof(value)
+
+        with self._lock:
+            stale = self._entries.pop(key, None)
+            if stale is not None:
+                self._size -= stale[2]
+            if size > self.max_bytes:
+                # Returned to the caller but never kept: it would evict
+                # everything else and still exceed the budget.
+                self.oversize += 1
+                return value
+            self._entries[key] = (stamp, value, size)
+            self._size += size
+            while self._size > self.max_bytes or (self.max_entries is not None and len(self._entries) > self.max_entries):
+                # Evicted rasters are closed by rasterio once the last
+                # in-flight request drops its reference.
+                _, (_, _, old_size) = self._entries.popitem(last=False)
+                self._size -= old_size
+                self.evictions += 1
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "oversize": self.oversize,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+
+class ProjectCache:
+    # Warm models, open raster stacks and model-file lookups for the API
+    # process. Entries are keyed by (project, path) and invalidated by the
+    # file's mtime.
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, render_max_bytes=RENDER_CACHE_MAX_BYTES, raster_max_entries=RASTER_CACHE_MAX_ENTRIES):
+        self.model_files = LRUCache(max_bytes)
+        self.models = LRUCache(max_bytes)
+        self.rasters = LRUCache(max_bytes, max_entries=raster_max_entries)
+        self.renders = LRUCache(render_max_bytes)
+
+    # prediction (rasterio, sklearn) is imported on first use so the API
+    # process starts without it.
+    def model_file(self, project_name, directory, prefix, extension):
+        from prediction import find_model_file
+        return self.model_files.get(
+            (project_name, directory, prefix, extension),
+            os.stat(directory).st_mtime_ns,
+            lambda: find_model_file(directory, prefix, extension),
+            lambda _: 0,
+        )
+
+    def model(self, project_name, model_path):
+        from prediction import load_trained_model
+        return self.models.get(
+            (project_name, model_path),
+            os.stat(model_path).st_mtime_ns,
+            lambda: load_trained_model(model_path),
+            lambda _: os.path.getsize(model_path),
+        )
+
+    def raster(self, project_name, raster_path):
+        # The opened dataset, with its profile and block layout; pixels are
+        # read per call, so no process holds a whole stack between runs.
+        import rasterio
+        return self.rasters.get(
+            (project_name, raster_path),
+            os.stat(raster_path).st_mtime_ns,
+            lambda: rasterio.open(raster_path),
+            lambda _: 0,
+        )
+
+    def rendered(self, project_name, raster_path, stamp, variant, renderer):
+        # PNG bytes of one rendering (preview size, tile address) of a raster
+        return self.renders.get(
+            (project_name, raster_path, variant),
+            stamp,
+            renderer,
+            len,
+        )
+
+    def stats(self):
+        return {
+            "model_files": self.model_files.stats(),
+            "models": self.models.stats(),
+            "rasters": self.rasters.stats(),
+            "renders": self.renders.stats(),
+        }
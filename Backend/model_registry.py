@@ -0,0 +1,110 @@
+import os
+import json
+import time
+import hashlib
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; registry writes are then unlocked
+    fcntl = None
+
+# Index of the trained models in a project's metrics directory. Each version
+# records its files, metrics, feature order and training-data fingerprint, and
+# per-model-type "latest"/"best" pointers make resolution a dictionary lookup.
+# The index itself sits next to the metrics directory, outside the training
+# stage's cached outputs, so restoring those never rolls it back.
+REGISTRY_FILENAME = "registry.json"
+
+
+def training_fingerprint(df):
+    # Content hash of the training table, independent of its file format
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    sha = hashlib.sha256(row_hashes.tobytes())
+    sha.update(json.dumps([str(col) for col in df.columns]).encode())
+    return sha.hexdigest()
+
+
+class ModelRegistry:
+    def __init__(self, model_dir):
+        self.model_dir = model_dir
+        self.path = os.path.join(os.path.dirname(os.path.normpath(model_dir)), REGISTRY_FILENAME)
+        legacy_path = os.path.join(model_dir, REGISTRY_FILENAME)
+        if not os.path.exists(self.path) and os.path.exists(legacy_path):
+            os.replace(legacy_path, self.path)  # Registries written inside the metrics directory
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _load(self):
+        if not self.exists():
+            return {"versions": {}, "latest": {}, "best": {}}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def _save(self, registry):
+        tmp_path = f"{self.path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(registry, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.model_dir, exist_ok=True)
+        with open(self.path + ".lock", "w") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def register(self, model_type, model_path, metrics, features, fingerprint, params=None, parent=None):
+        with self._locked():
+            registry = self._load()
+            version = max((int(v) for v in registry["versions"]), default=0) + 1
+            entry = {
+                "version": version,
+                "model_type": model_type,
+                # Stored relative to the metrics directory so projects can move
+                "path": os.path.basename(model_path),
+                "metrics": metrics,
+                "features": list(features),
+                "training_fingerprint": fingerprint,
+                "params": params or {},
+                "parent": parent,
+                "created_at": time.time(),
+            }
+            registry["versions"][str(version)] = entry
+            registry["latest"][model_type] = version
+
+            best = registry["best"].get(model_type)
+            if best is None or metrics["accuracy"] > registry["versions"][str(best)]["metrics"]["accuracy"]:
+                registry["best"][model_type] = version
+
+            self._save(registry)
+        print(f"Registered {model_type} model version {version}")
+        return entry
+
+    def resolve(self, model_type="BRF", which="latest"):
+        # which: "latest", "best" or an explicit version number
+        registry = self._load()
+        if which in ("latest", "best"):
+            version = registry[which].get(model_type)
+            if version is None:
+                raise FileNotFoundError(f"No {model_type} model registered in '{self.path}'.")
+        else:
+            version = int(which)
+        entry = registry["versions"].get(str(version))
+        if entry is None:
+            raise FileNotFoundError(f"Model version {version} is not registered in '{self.path}'.")
+        if entry["model_type"] != model_type:
+            # Versions are numbered across model types; a pinned one may be another type
+            raise ValueError(f"Model version {version} is a {entry['model_type']} model, not {model_type}.")
+        return entry
+
+    def model_path(self, entry):
+        return os.path.join(self.model_dir, entry["path"])
@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import StratifiedKFold, ParameterGrid, ParameterSampler, train_test_split
+from sklearn.ensemble import RandomForestClassifier
+from imblearn.ensemble import BalancedRandomForestClassifier
+
+# Forest size is not part of the grid: every candidate grows trees in steps
+# until its score plateaus, which favours small forests that are cheap to
+# evaluate over a whole district. RF stops on its out-of-bag score; BRF is
+# searched as production trains it, without bootstrapping, so it has no
+# out-of-bag samples and stops on a held-out split of the training data.
+SEARCH_SPACE = {
+    "RF": {
+        "max_depth": [None, 12, 20],
+        "max_features": ["sqrt", "log2", 0.5],
+        "min_samples_leaf": [1, 2, 5],
+    },
+    "BRF": {
+        "max_depth": [None, 12, 20],
+        "max_features": ["sqrt", "log2", 0.5],
+        "sampling_strategy": ["all", "not minority", "auto"],
+        "replacement": [True, False],
+    },
+}
+
+MAX_TREES = 500
+TREE_STEP = 25
+PLATEAU_TOLERANCE = 1e-3
+PLATEAU_PATIENCE = 2
+HOLDOUT_SIZE = 0.2
+
+LEADERBOARD_FILENAME = "model_search_leaderboard.csv"
+
+
+def base_estimator(model_type, params):
+    if model_type == "RF":
+        return RandomForestClassifier(random_state=0, **params)
+    if model_type == "BRF":
+        # As modelCreationp trains it
+        return BalancedRandomForestClassifier(random_state=0, bootstrap=False, **params)
+    raise ValueError(f"Unknown model type: {model_type}")
+
+
+def grow_until_plateau(estimator, X, y, holdout=None, max_trees=MAX_TREES, step=TREE_STEP, tol=PLATEAU_TOLERANCE, patience=PLATEAU_PATIENCE):
+    # Warm-started growth: each round only fits the newly added trees. Scored
+    # on holdout=(X, y) when given, else on the out-of-bag samples.
+    estimator.set_params(warm_start=True, oob_score=holdout is None, n_estimators=min(step, max_trees))
+    best_score, best_trees, stale = -np.inf, step, 0
+    while True:
+        estimator.fit(X, y)
+        n_trees = estimator.n_estimators
+        if holdout is None:
+            score = estimator.oob_score_
+        else:
+            score = accuracy_score(holdout[1], estimator.predict(holdout[0]))
+        if score > best_score + tol:
+            best_score, best_trees, stale = score, n_trees, 0
+        else:
+            stale += 1
+        if stale >= patience or n_trees >= max_trees:
+            return best_trees, best_score
+        estimator.set_params(n_estimators=min(n_trees + step, max_trees))
+
+
+def evaluate_candidate(model_type, params, X, y, folds, max_trees):
+    start = time.perf_counter()
+    if model_type == "BRF":
+        X_fit, X_holdout, y_fit, y_holdout = train_test_split(X, y, test_size=HOLDOUT_SIZE, stratify=y, random_state=0)
+        n_trees, stopping_score = grow_until_plateau(
+            base_estimator(model_type, params), X_fit, y_fit, holdout=(X_holdout, y_holdout), max_trees=max_trees,
+        )
+    else:
+        n_trees, stopping_score = grow_until_plateau(base_estimator(model_type, params), X, y, max_trees=max_trees)
+
+    estimator = base_estimator(model_type, params).set_params(n_estimators=n_trees, n_jobs=1)
+    scores = []
+    for train_idx, test_idx in folds:
+        model = clone(estimator).fit(X[train_idx], y[train_idx])
+        scores.append(accuracy_score(y[test_idx], model.predict(X[test_idx])))
+
+    return {
+        "model_type": model_type,
+        "params": json.dumps(params, sort_keys=True),
+        "n_estimators": n_trees,
+        # Out-of-bag accuracy for RF, held-out accuracy for BRF
+        "stopping_score": stopping_score,
+        "cv_mean": float(np.mean(scores)),
+        "cv_std": float(np.std(scores)),
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def candidate_params(model_type, n_iter=None, random_state=0):
+    space = SEARCH_SPACE[model_type]
+    if n_iter is None:
+        return list(ParameterGrid(space))
+    return list(ParameterSampler(space, n_iter=n_iter, random_state=random_state))
+
+
+def search_models(X, y, save_path, model_types=("RF", "BRF"), n_iter=None, cv=5, n_jobs=-1, max_trees=MAX_TREES):
+    X = np.asarray(X, dtype=np.float32)
+    y = np.asarray(y)
+    folds = list(StratifiedKFold(n_splits=cv, shuffle=True, random_state=42).split(X, y))
+
+    candidates = [(model_type, params) for model_type in model_types for params in candidate_params(model_type, n_iter)]
+    print(f"Searching {len(candidates)} candidates with {cv}-fold CV...")
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(evaluate_candidate)(model_type, params, X, y, folds, max_trees) for model_type, params in candidates
+    )
+
+    # Ties on accuracy go to the smaller, faster-to-evaluate forest
+    leaderboard = pd.DataFrame(results).sort_values(["cv_mean", "n_estimators"], ascending=[False, True]).reset_index(drop=True)
+    leaderboard.insert(0, "rank", range(1, len(leaderboard) + 1))
+    leaderboard_path = os.path.join(save_path, LEADERBOARD_FILENAME)
+    leaderboard.to_csv(leaderboard_path, index=False)
+    print(f"Leaderboard saved at: {leaderboard_path}")
+    print(leaderboard.head(10).to_string(index=False))
+    return leaderboard
+
+
+def best_params(leaderboard, model_type):
+    # Parameters of the top-ranked candidate of one model type, including its
+    # early-stopped forest size.
+    row = leaderboard[leaderboard["model_type"] == model_type].iloc[0]
+    params = json.loads(row["params"])
+    params["n_estimators"] = int(row["n_estimators"])
+    return params
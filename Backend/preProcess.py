@@ -1,32 +1,52 @@
 import os
-import glob
 import pandas as pd
 import numpy as np
 from matplotlib import pyplot as plt
+from workspace import project_dir
+from artifact_store import load_table, save_table, list_tables
+from instrumentation import instrumented, count
+
+DEFAULT_DROP_COLS = ['NDVI_2023-10-31']
+
+def reshape_long_to_wide(df_tall, prefix, index_columns):
+    # A marker is identified by its attributes other than the synthetic id;
+    # the occurrence rank within a date keeps duplicate points apart.
+    key_columns = [col for col in index_columns if col != 'id']
+    occurrence = df_tall.groupby(key_columns + ['date'], sort=False, dropna=False).cumcount().to_numpy()
+    marker_keys = pd.MultiIndex.from_frame(df_tall[key_columns].assign(occurrence=occurrence))
+
+    marker_idx, markers = marker_keys.factorize()
+    date_idx, dates = pd.factorize(df_tall['date'])
+
+    # Dense (markers x dates) matrix in one scatter; dates a marker was not
+    # observed on stay NaN.
+    values = np.full((len(markers), len(dates)), np.nan)
+    values[marker_idx, date_idx] = df_tall[prefix].to_numpy(dtype=np.float64)
+
+    wide = markers.set_names(key_columns + ['occurrence']).to_frame(index=False)[key_columns]
+    wide.insert(0, 'id', np.arange(1, len(markers) + 1))
+    wide = pd.concat([wide, pd.DataFrame(values, columns=list(dates))], axis=1)
+    return wide[index_columns + list(dates)]
 
 def process_time_series(input_file_path, output_file_path, prefix, data_type):
     print(f"Processing {input_file_path}...")
-    df_tall = pd.read_csv(input_file_path)
+    df_tall = load_table(input_file_path)
     
     if data_type == 'crop':
         if 'crpname_eg' not in df_tall.columns:
             raise KeyError("The 'crpname_eg' column is missing from the input DataFrame.")
         index_columns = ['id', 'crpname_eg', 'lat', 'lon']
 
-    df_tall['id'] = range(1, len(df_tall) + 1)
-    all_dates = df_tall['date'].unique().tolist()
-    pivot_df = df_tall.pivot(index=index_columns, columns='date', values=prefix)
-    pivot_df.reset_index(inplace=True)
-    pivot_df = pivot_df.reindex(columns=index_columns + all_dates)
-    df_moved_up = pivot_df.apply(lambda x: x.dropna().reset_index(drop=True))
-    for col in pivot_df.columns[2:]:
-        pivot_df[col] = df_moved_up[col]
+    pivot_df = reshape_long_to_wide(df_tall, prefix, index_columns)
+    incomplete = pivot_df.isna().any(axis=1).sum()
+    if incomplete:
+        print(f"Dropping {incomplete} markers with missing dates")
     pivot_df = pivot_df.dropna()
-    pivot_df.to_csv(output_file_path, index=False)
+    save_table(pivot_df, output_file_path)
     return pivot_df
 
 def add_prefix_to_features(directory, output_path, drop_cols=None):
-    files = glob.glob(f"{directory}/*_wide.csv")
+    files = list_tables(directory, "*_wide")
     print(f"Files found for merging: {files}")
     dataframes = {}
 
@@ -40,7 +60,7 @@ def add_prefix_to_features(directory, output_path, drop_cols=None):
         else:
             continue
         print(f"Processing file: {file_path} as {dtype}")
-        df = pd.read_csv(file_path)
+        df = load_table(file_path)
         df.columns = [f'{dtype}_{col}' if col[0].isdigit() else col for col in df.columns]
         dataframes[dtype] = df
 
@@ -58,9 +78,64 @@ def add_prefix_to_features(directory, output_path, drop_cols=None):
     if drop_cols:
         gt_crop.drop(drop_cols, axis=1, inplace=True)
 
-    gt_crop.to_csv(output_path, index=False)
+    save_table(gt_crop, output_path)
     return gt_crop
 
+def assemble_feature_matrix(wide_frames, drop_cols=None, sentinel=-9999.0):
+    # Aligns the VV/VH/NDVI wide tables by marker id (the reshape step numbers
+    # markers identically for every band) into one float32 feature matrix.
+    bands = ['VV', 'VH', 'NDVI']
+    missing = [band for band in bands if band not in wide_frames]
+    if missing:
+        raise ValueError(f"All three datasets (VV, VH, NDVI) are required. Missing: {missing}")
+
+    index_crop = ['id', 'crpname_eg', 'lat', 'lon']
+    ids = [wide_frames[band]['id'].to_numpy() for band in bands]
+    common = ids[0]
+    for band_ids in ids[1:]:
+        common = np.intersect1d(common, band_ids, assume_unique=True)
+    positions = [np.searchsorted(band_ids, common) for band_ids in ids]
+
+    meta = wide_frames['VV'][index_crop].iloc[positions[0]].reset_index(drop=True)
+    # Markers must agree on label and location across bands, as the old merge
+    # on all four index columns required.
+    aligned = np.ones(len(common), dtype=bool)
+    for band, pos in zip(bands[1:], positions[1:]):
+        other = wide_frames[band].iloc[pos]
+        for col in ['crpname_eg', 'lat', 'lon']:
+            aligned &= meta[col].to_numpy() == other[col].to_numpy()
+
+    feature_names = []
+    blocks = []
+    for band, pos in zip(bands, positions):
+        frame = wide_frames[band]
+        date_cols = [col for col in frame.columns if col not in index_crop]
+        feature_names += [f'{band}_{col}' for col in date_cols]
+        blocks.append((frame[date_cols].to_numpy(dtype=np.float32), pos))
+
+    X = np.empty((len(common), len(feature_names)), dtype=np.float32)
+    offset = 0
+    for values, pos in blocks:
+        X[:, offset:offset + values.shape[1]] = values[pos]
+        offset += values.shape[1]
+
+    # Sentinel pass over every band before dropping columns, like the old filter
+    valid = aligned & ~(X == sentinel).any(axis=1)
+
+    keep = np.ones(len(feature_names), dtype=bool)
+    if drop_cols:
+        unknown = [col for col in drop_cols if col not in feature_names]
+        if unknown:
+            raise KeyError(f"{unknown} not found in features")
+        keep = ~np.isin(feature_names, drop_cols)
+
+    X = X[valid][:, keep]
+    feature_names = [name for name, k in zip(feature_names, keep) if k]
+    meta = meta[valid].reset_index(drop=True)
+    # Classes numbered by first appearance, 0 for unlabeled markers
+    y = pd.factorize(meta['crpname_eg'])[0] + 1
+    return X, y, feature_names, meta
+
 def assign_class_values(input_file, output_file_path):
     gt_crop = input_file
     unique_crops = input_file['crpname_eg'].unique()
@@ -70,7 +145,7 @@ def assign_class_values(input_file, output_file_path):
     gt_crop = gt_crop.drop(cols_to_drop, axis=1)
     gt_crops3inc = gt_crop.drop('id', axis=1)
     gt_crops3inc.reset_index(drop=True)
-    gt_crops3inc.to_csv(output_file_path, index=False)
+    save_table(gt_crops3inc, output_file_path)
     return gt_crops3inc
 
 def plot_timeseries(df, prefix, file_name):
@@ -109,8 +184,9 @@ def plot_timeseries(df, prefix, file_name):
     plt.close()
     print(f"Plot saved as {file_name}")
 
-def PreProcess_PipeLine(project_name="ujjain"):
-    input_dir = f"Crop_mapping_{project_name}"
+@instrumented()
+def PreProcess_PipeLine(project_name="ujjain", drop_cols=None):
+    input_dir = project_dir(project_name)
     output_dir = os.path.join(input_dir, "timeseries")
     os.makedirs(output_dir, exist_ok=True)
 
@@ -120,20 +196,29 @@ def PreProcess_PipeLine(project_name="ujjain"):
         os.path.join(input_dir, f"NDVI_timeseries_{project_name}.csv")
     ]
 
+    wide_frames = {}
     for input_file_path in input_files:
         dir_name, file_name = os.path.split(input_file_path)
         base, ext = os.path.splitext(file_name)
         output_file_path = os.path.join(output_dir, f"{base}_wide{ext}")
         prefix = base.split('_')[0]
         print(f"Running conversion for {input_file_path} with {prefix}{output_file_path}...")
-        process_time_series(input_file_path, output_file_path, prefix, data_type='crop')
+        wide_frames[prefix] = process_time_series(input_file_path, output_file_path, prefix, data_type='crop')
+
+    if drop_cols is None:
+        drop_cols = DEFAULT_DROP_COLS
+    X, y, feature_names, meta = assemble_feature_matrix(wide_frames, drop_cols=drop_cols)
+    print(f"Assembled feature matrix: {X.shape}")
+    count("rows", X.shape[0])
+    count("features", X.shape[1])
 
+    features = pd.DataFrame(X, columns=feature_names)
     output_file = os.path.join(output_dir, "timeseries_crops3inc.csv")
-    drop_cols = ['NDVI_2023-10-31']
-    gt_crop_3bands = add_prefix_to_features(directory=output_dir, output_path=output_file, drop_cols=drop_cols)
+    save_table(pd.concat([meta, features], axis=1), output_file)
 
     output_file_path = os.path.join(output_dir, "crops3inc_multiclass_S1S2_onlytimeseries_v01.csv")
-    final_csv = assign_class_values(input_file=gt_crop_3bands, output_file_path=output_file_path)
+    final_csv = features.assign(Class=y)
+    save_table(final_csv, output_file_path)
 
     prefixes = ['VV_', 'VH_', 'NDVI_']
     plot_dir = os.path.join(input_dir, "timeseries_trend_figures")
@@ -1,10 +1,34 @@
 import os
 import re
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 import numpy as np
 import rasterio
 import matplotlib.pyplot as plt
 import joblib
+import geopandas as gpd
+from rasterio.features import geometry_mask
+from rasterio.windows import Window
+from rasterio.enums import Resampling
 from sklearn.utils.validation import check_is_fitted
+from workspace import DEFAULT_PROJECT, project_dir, upload_dir, find_shapefile
+from model_registry import ModelRegistry
+import raster_stack
+from instrumentation import instrumented, count
+
+# Upper bound on the number of pixels handed to model.predict at once in the
+# streaming path; bounds peak memory independently of the raster size.
+DEFAULT_TILE_BUDGET = 512 * 512
+
+# Written for pixels outside the ROI or with nodata inputs; same sentinel the
+# time-series extraction uses for missing values.
+PREDICTION_NODATA = -9999
+
+# Prediction rasters are written COG-style: internally tiled, deflate
+# compressed and with mode-resampled overviews, so viewers read only the
+# blocks of the level they display.
+OUTPUT_BLOCK_SIZE = 256
+OUTPUT_COMPRESSION = 'deflate'
 
 def ensure_output_directory(path):
     os.makedirs(os.path.dirname(path), exist_ok=True)
@@ -19,8 +43,8 @@ def reshape_raster_for_prediction(array):
     array_for_prediction = np.swapaxes(reshaped_array, 0, 1)
     return array_for_prediction
 
-def load_trained_model(model_path):
-    model = joblib.load(model_path)
+def load_trained_model(model_path, mmap_mode=None):
+    model = joblib.load(model_path, mmap_mode=mmap_mode)
     check_is_fitted(model)
     if hasattr(model, "feature_names_in_"):
         model.feature_names_in_ = None  # To suppress feature name warning
@@ -31,20 +55,196 @@ def predict_crop_map(model, data, original_shape):
     pred_reshaped = pred.reshape(original_shape[1], original_shape[2])
     return pred_reshaped
 
-def save_prediction_raster(output_path, data, reference_raster):
-    ensure_output_directory(output_path)
-    with rasterio.open(
-        output_path,
-        'w',
+def load_roi_shapes(roi_path, crs):
+    roi = gpd.read_file(roi_path).to_crs(crs)
+    return [geom.__geo_interface__ for geom in roi.geometry if geom is not None]
+
+def roi_pixel_mask(raster, window, roi_shapes, grid=OUTPUT_BLOCK_SIZE):
+    # Rasterized one output tile at a time: pixel centres on the ROI edge are
+    # decided differently depending on the origin rasterized from, and
+    # prediction windows always cover whole tiles, so every path agrees.
+    window = window or Window(0, 0, raster.width, raster.height)
+    mask = np.zeros((window.height, window.width), dtype=bool)
+    for row in range(0, window.height, grid):
+        for col in range(0, window.width, grid):
+            tile = Window(window.col_off + col, window.row_off + row, min(grid, window.width - col), min(grid, window.height - row))
+            mask[row:row + tile.height, col:col + tile.width] = geometry_mask(
+                roi_shapes, out_shape=(tile.height, tile.width), transform=raster.window_transform(tile), invert=True,
+            )
+    return mask
+
+def valid_pixel_mask(array, raster, window=None, roi_shapes=None):
+    valid = np.all(np.isfinite(array) & (array != PREDICTION_NODATA), axis=0)
+    if raster.nodata is not None:
+        valid &= np.all(array != raster.nodata, axis=0)
+    if roi_shapes:
+        valid &= roi_pixel_mask(raster, window, roi_shapes)
+    return valid
+
+def predict_masked(model, array, valid_mask, nodata=PREDICTION_NODATA):
+    # Gather only the valid pixels for model.predict and scatter the classes
+    # back into a nodata-filled map.
+    valid = valid_mask.ravel()
+    prediction = np.full(valid.shape, nodata, dtype=model.classes_.dtype)
+    if valid.any():
+        prediction[valid] = model.predict(reshape_raster_for_prediction(array)[valid])
+    return prediction.reshape(valid_mask.shape)
+
+def prediction_raster_profile(reference_raster, dtype, nodata=PREDICTION_NODATA):
+    return dict(
         driver='GTiff',
-        height=data.shape[0],
-        width=data.shape[1],
+        height=reference_raster.height,
+        width=reference_raster.width,
         count=1,
-        dtype=data.dtype,
+        dtype=dtype,
+        nodata=nodata,
         crs=reference_raster.crs.to_wkt(),
         transform=reference_raster.transform,
-    ) as dst:
+        tiled=True,
+        blockxsize=OUTPUT_BLOCK_SIZE,
+        blockysize=OUTPUT_BLOCK_SIZE,
+        compress=OUTPUT_COMPRESSION,
+    )
+
+def overview_factors(height, width, block_size=OUTPUT_BLOCK_SIZE):
+    # Halve the resolution until the coarsest level fits in a single block
+    factors = []
+    factor = 2
+    while max(height, width) / (factor // 2) > block_size:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+def build_overviews(output_path):
+    with rasterio.open(output_path, 'r+') as dst:
+        factors = overview_factors(dst.height, dst.width)
+        if factors:
+            # Class maps are categorical, so overviews take the most common class
+            dst.build_overviews(factors, Resampling.mode)
+            dst.update_tags(ns='rio_overview', resampling='mode')
+
+def aligned_unit(block_size, grid=OUTPUT_BLOCK_SIZE):
+    # Smallest span covering whole input blocks and whole output tiles; when
+    # neither size divides the other only the output tiles are kept whole.
+    if grid % block_size == 0 or block_size % grid == 0:
+        return max(block_size, grid)
+    return grid
+
+def within_block(size, block_size, grid=OUTPUT_BLOCK_SIZE):
+    # Largest multiple of grid up to size that tiles the block exactly, so
+    # sub-windows of a split block never straddle the next one
+    if size >= block_size:
+        return size
+    while block_size % size:
+        size -= grid
+    return size
+
+def prediction_window_shape(raster, tile_budget=DEFAULT_TILE_BUDGET, grid=OUTPUT_BLOCK_SIZE):
+    block_height, block_width = raster.block_shapes[0]
+    striped = block_width >= raster.width
+    unit_height = min(aligned_unit(block_height, grid), raster.height)
+    unit_width = raster.width if striped else min(aligned_unit(block_width, grid), raster.width)
+    split = unit_height * unit_width > tile_budget
+    if split:
+        # Blocks over the budget are split into output tiles, which still
+        # start on block boundaries. A striped stack keeps full-width windows
+        # unless a single row of output tiles is already over the budget.
+        unit_height = min(unit_height, grid)
+        if striped:
+            unit_width = min(raster.width, max(grid, tile_budget // unit_height // grid * grid))
+        else:
+            unit_width = min(unit_width, grid)
+
+    # Consecutive units are merged along the row, then over whole rows, up to
+    # the budget; one unit is the smallest window.
+    width = min(raster.width, unit_width * max(1, tile_budget // (unit_height * unit_width)))
+    height = min(raster.height, unit_height * max(1, tile_budget // (unit_height * width)))
+    if split:
+        height = within_block(height, block_height, grid)
+        if not striped:
+            width = within_block(width, block_width, grid)
+    return height, width
+
+def iter_prediction_windows(raster, tile_budget=DEFAULT_TILE_BUDGET):
+    # Windows start on the output tile grid and span whole input blocks where
+    # the layouts allow it, so reads and writes touch every block once.
+    height, width = prediction_window_shape(raster, tile_budget)
+    for row_off in range(0, raster.height, height):
+        for col_off in range(0, raster.width, width):
+            yield Window(col_off, row_off, min(width, raster.width - col_off), min(height, raster.height - row_off))
+
+def predict_window(model, raster, window, masked=False, roi_shapes=None):
+    array = raster.read(window=window)
+    if masked:
+        return predict_masked(model, array, valid_pixel_mask(array, raster, window, roi_shapes))
+    prediction_input = reshape_raster_for_prediction(array)
+    return predict_crop_map(model, prediction_input, array.shape)
+
+def predict_crop_map_streaming(model, raster, output_path, tile_budget=DEFAULT_TILE_BUDGET, masked=False, roi_shapes=None):
+    ensure_output_directory(output_path)
+    dtype = model.classes_.dtype
+    with rasterio.open(output_path, 'w', **prediction_raster_profile(raster, dtype)) as dst:
+        for window in iter_prediction_windows(raster, tile_budget):
+            prediction = predict_window(model, raster, window, masked, roi_shapes)
+            dst.write(prediction.astype(dtype, copy=False), 1, window=window)
+    build_overviews(output_path)
+
+# Per-process state of the parallel backend: each worker loads the model and
+# opens the stack once in its initializer instead of receiving them per task.
+_worker_model = None
+_worker_raster = None
+_worker_masked = False
+_worker_roi_shapes = None
+
+def _init_prediction_worker(model_path, input_raster_path, masked=False, roi_shapes=None):
+    global _worker_model, _worker_raster, _worker_masked, _worker_roi_shapes
+    _worker_model = load_trained_model(model_path, mmap_mode='r')
+    if hasattr(_worker_model, "n_jobs"):
+        _worker_model.n_jobs = 1  # Parallelism comes from the pool, not from joblib threads
+    _worker_raster = rasterio.open(input_raster_path)
+    _worker_masked = masked
+    _worker_roi_shapes = roi_shapes
+
+def _predict_window_in_worker(window):
+    return window, predict_window(_worker_model, _worker_raster, window, _worker_masked, _worker_roi_shapes)
+
+def predict_crop_map_parallel(model_path, input_raster_path, output_path, n_workers=None, tile_budget=DEFAULT_TILE_BUDGET, masked=False, roi_shapes=None):
+    n_workers = n_workers or os.cpu_count() or 1
+    ensure_output_directory(output_path)
+
+    with rasterio.open(input_raster_path) as raster, ProcessPoolExecutor(
+        max_workers=n_workers,
+        initializer=_init_prediction_worker,
+        initargs=(model_path, input_raster_path, masked, roi_shapes),
+    ) as executor:
+        windows = iter_prediction_windows(raster, tile_budget)
+        max_in_flight = 2 * n_workers  # Keeps every worker busy while bounding buffered tiles
+        pending = set()
+        dst = None
+        try:
+            while True:
+                for window in windows:
+                    pending.add(executor.submit(_predict_window_in_worker, window))
+                    if len(pending) >= max_in_flight:
+                        break
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    window, prediction = future.result()
+                    if dst is None:
+                        dst = rasterio.open(output_path, 'w', **prediction_raster_profile(raster, prediction.dtype))
+                    dst.write(prediction, 1, window=window)
+        finally:
+            if dst is not None:
+                dst.close()
+    build_overviews(output_path)
+
+def save_prediction_raster(output_path, data, reference_raster, nodata=PREDICTION_NODATA):
+    ensure_output_directory(output_path)
+    with rasterio.open(output_path, 'w', **prediction_raster_profile(reference_raster, data.dtype, nodata)) as dst:
         dst.write(data, 1)
+    build_overviews(output_path)
 
 def display_prediction(prediction_array):
     plt.imshow(prediction_array, cmap='viridis')
@@ -56,21 +256,64 @@ def get_accuracy_from_filename(filename):
     match = re.search(r"_([\d.]+)\.joblib$", filename)
     return match.group(1) if match else "unknown"
 
+def verify_band_order(raster_path, features):
+    # Fails fast, before any inference, if the stack does not line up with the
+    # model's training columns.
+    with rasterio.open(raster_path) as raster:
+        if raster.count != len(features):
+            raise ValueError(f"Raster has {raster.count} bands but the model expects {len(features)} features.")
+        descriptions = list(raster.descriptions)
+    if not all(descriptions):
+        print("Raster bands carry no descriptions; band order cannot be verified.")
+        return
+    for index, (band, feature) in enumerate(zip(descriptions, features), start=1):
+        if band != feature:
+            raise ValueError(f"Band {index} is '{band}' but the model expects '{feature}' at that position.")
+
 def find_model_file(directory, prefix, extension):
     for file in os.listdir(directory):
         if file.startswith(prefix) and file.endswith(extension):
             return file
     raise FileNotFoundError(f"No file found with prefix '{prefix}' and extension '{extension}' in directory '{directory}'.")
 
-def crop_map_prediction_pipeline(input_raster_path, model_path, output_raster_path):
-    raster, array = load_raster(input_raster_path)
-    print("Original raster shape:", array.shape)
+def crop_map_prediction_pipeline(input_raster_path, model_path, output_raster_path, streaming=False, tile_budget=DEFAULT_TILE_BUDGET, n_workers=1, masked=False, roi_path=None, model=None, raster=None):
+    # raster: the input stack already opened, e.g. by a model_cache.ProjectCache
+    roi_shapes = None
+    if masked and roi_path:
+        with rasterio.open(input_raster_path) as src:
+            roi_shapes = load_roi_shapes(roi_path, src.crs)
+        print(f"Masking prediction to ROI: {roi_path}")
 
-    prediction_input = reshape_raster_for_prediction(array)
-    print("Prepared input shape:", prediction_input.shape)
+    if n_workers != 1:
+        print(f"Parallel prediction with {n_workers or os.cpu_count()} workers...")
+        predict_crop_map_parallel(model_path, input_raster_path, output_raster_path, n_workers, tile_budget, masked, roi_shapes)
+        print(f"Saved prediction raster at: {output_raster_path}")
+        return
+
+    if model is None:
+        model = load_trained_model(model_path)
+
+    if streaming:
+        with rasterio.open(input_raster_path) if raster is None else nullcontext(raster) as raster:
+            print("Streaming prediction over raster shape:", (raster.count, raster.height, raster.width))
+            predict_crop_map_streaming(model, raster, output_raster_path, tile_budget, masked, roi_shapes)
+        print(f"Saved prediction raster at: {output_raster_path}")
+        return
+
+    if raster is None:
+        raster, array = load_raster(input_raster_path)
+    else:
+        array = raster.read()
+    print("Original raster shape:", array.shape)
 
-    model = load_trained_model(model_path)
-    prediction = predict_crop_map(model, prediction_input, array.shape)
+    if masked:
+        valid = valid_pixel_mask(array, raster, roi_shapes=roi_shapes)
+        print(f"Valid pixels: {int(valid.sum())} of {valid.size}")
+        prediction = predict_masked(model, array, valid)
+    else:
+        prediction_input = reshape_raster_for_prediction(array)
+        print("Prepared input shape:", prediction_input.shape)
+        prediction = predict_crop_map(model, prediction_input, array.shape)
 
     print("Prediction shape:", prediction.shape)
     print("Unique classes predicted:", np.unique(prediction))
@@ -79,21 +322,57 @@ def crop_map_prediction_pipeline(input_raster_path, model_path, output_raster_pa
     save_prediction_raster(output_raster_path, prediction, raster)
     print(f"Saved prediction raster at: {output_raster_path}")
 
-def prediction_PipeLine(project_name="ujjain"):
-    project_dir = f"Crop_mapping_{project_name}"
+@instrumented()
+def prediction_PipeLine(project_name=DEFAULT_PROJECT, streaming=False, tile_budget=DEFAULT_TILE_BUDGET, n_workers=1, masked=False, roi_path=None, cache=None, model_version="latest", build_stack=False):
+    # cache: optional model_cache.ProjectCache that keeps models and stacks warm
+    # across calls in a long-running process.
+    output_root = project_dir(project_name)
 
-    input_raster_path = os.path.join(project_dir, "raster_stack", f"S1S2_{project_name.capitalize()}_Rabi_Prediction_stack.tif")
+    input_raster_path = raster_stack.stack_path(project_name)
+    if not os.path.exists(input_raster_path):
+        # A VRT over the per-date band files works as well; build_stack
+        # assembles the stack from those files when neither exists.
+        if os.path.exists(raster_stack.stack_path(project_name, vrt=True)):
+            input_raster_path = raster_stack.stack_path(project_name, vrt=True)
+        elif build_stack:
+            input_raster_path = raster_stack.build_stack(project_name)
 
-    model_dir = os.path.join(project_dir, "metrics")
-    model_filename = find_model_file(model_dir, "BRF_crops3inc_multiclass", ".joblib")
-    accuracy = get_accuracy_from_filename(model_filename)
-    model_path = os.path.join(model_dir, model_filename)
+    model_dir = os.path.join(output_root, "metrics")
+    registry = ModelRegistry(model_dir)
+    if registry.exists():
+        # model_version: "latest", "best" or a pinned version number
+        entry = registry.resolve("BRF", model_version)
+        model_path = registry.model_path(entry)
+        print(f"Using BRF model version {entry['version']} (accuracy {entry['metrics']['accuracy']:.4f})")
+        verify_band_order(input_raster_path, entry["features"])
+    else:
+        if cache is not None:
+            model_filename = cache.model_file(project_name, model_dir, "BRF_crops3inc_multiclass", ".joblib")
+        else:
+            model_filename = find_model_file(model_dir, "BRF_crops3inc_multiclass", ".joblib")
+        accuracy = get_accuracy_from_filename(model_filename)
+        model_path = os.path.join(model_dir, model_filename)
 
     output_raster_path = os.path.join(
-        project_dir, "Predicted_Cropmap", f"output.tif"
+        output_root, "Predicted_Cropmap", f"output.tif"
     )
 
-    crop_map_prediction_pipeline(input_raster_path, model_path, output_raster_path)
+    if masked and roi_path is None:
+        roi_path = find_shapefile(upload_dir(project_name, "boundry"))
+
+    model = raster = None
+    if cache is not None and n_workers == 1:
+        model = cache.model(project_name, model_path)
+        raster = cache.raster(project_name, input_raster_path)
+
+    with rasterio.open(input_raster_path) as src:
+        count("pixels", src.width * src.height)
+
+    crop_map_prediction_pipeline(
+        input_raster_path, model_path, output_raster_path,
+        streaming=streaming, tile_budget=tile_budget, n_workers=n_workers,
+        masked=masked, roi_path=roi_path, model=model, raster=raster
+    )
 
 if __name__ == "__main__":
     prediction_PipeLine("ujjain")
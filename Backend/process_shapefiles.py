@@ -1,11 +1,50 @@
-import ee
 import pandas as pd
 import os
-from local_file_upload import localFeature
-
-
-# Initialize Earth Engine
-ee.Initialize(project='ee-sudharsanr836')
+import csv
+import json
+import math
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from ee_client import ee
+from local_file_upload import localMarkers
+from ee_cache import EECache
+from workspace import DEFAULT_PROJECT, project_dir
+from instrumentation import instrumented, count
+
+# Rabi season windows for Sentinel-1 and Sentinel-2
+START_S1 = '2023-10-01'
+END_S1 = '2024-04-30'
+
+START_S2 = '2023-10-15'
+END_S2 = '2024-04-30'
+
+S1_COLLECTION = "COPERNICUS/S1_GRD"
+S1_INSTRUMENT_MODE = 'IW'
+S1_ORBIT_PASS = 'DESCENDING'
+S2_COLLECTION = 'COPERNICUS/S2_SR_HARMONIZED'
+S2_MAX_CLOUDY_PIXEL_PERCENTAGE = 50
+# NDVI is composited over NDVI_COMPOSITES windows of NDVI_COMPOSITE_DAYS
+NDVI_COMPOSITES = 13
+NDVI_COMPOSITE_DAYS = 16
+
+# Batched extraction: each getInfo() covers at most MARKER_CHUNK x DATE_CHUNK
+# rows, which keeps requests under Earth Engine's 5000-element limit.
+MARKER_CHUNK = 500
+DATE_CHUNK = 8
+MAX_IN_FLIGHT = 6
+MAX_RETRIES = 5
+RETRY_BACKOFF_SECONDS = 2.0
+# Earth Engine reports quota, rate-limit and backend timeouts as EEException
+# like any other error; only these messages are worth retrying.
+TRANSIENT_ERROR_MESSAGES = (
+    "too many requests", "quota", "rate limit", "429",
+    "timed out", "timeout", "deadline exceeded", "service unavailable", "503",
+)
+
+# Geometry keys of the markers behind a project's time series, used to find
+# newly uploaded markers for incremental retraining.
+MARKER_INDEX_FILENAME = "markers_index.json"
 
 
 # --- Utility Functions ---
@@ -77,70 +116,250 @@ def export_table_to_pandas(feature_collection, selectors):
     return pd.DataFrame([f['properties'] for f in data])
 
 
+# --- Batched Extraction ---
+def collection_dates(collection):
+    return collection.aggregate_array('system:index').getInfo()
+
+
+def is_transient_error(error):
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    if isinstance(error, ee.EEException):
+        message = str(error).lower()
+        return any(marker in message for marker in TRANSIENT_ERROR_MESSAGES)
+    return False
+
+
+def fetch_with_retry(feature_collection, retries=MAX_RETRIES, backoff=RETRY_BACKOFF_SECONDS):
+    # Bad requests (missing bands, invalid geometries, ...) fail the same way
+    # on every attempt and are raised straight away.
+    for attempt in range(retries + 1):
+        try:
+            return [f['properties'] for f in feature_collection.getInfo()['features']]
+        except Exception as e:
+            if attempt == retries or not is_transient_error(e):
+                raise
+            delay = backoff * 2 ** attempt
+            print(f"Earth Engine request failed ({e}); retrying in {delay:.0f}s...")
+            time.sleep(delay)
+
+
+def chunked(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def submit_time_series(executor, collection, features, band_name, selectors, dates=None,
+                       marker_chunk=MARKER_CHUNK, date_chunk=DATE_CHUNK, retries=MAX_RETRIES):
+    # One request per (date chunk, marker chunk); returns the futures grouped by
+    # date chunk so the rows can be written back in extraction order.
+    if dates is None:
+        dates = collection_dates(collection)
+    plan = []
+    for dates in chunked(dates, date_chunk):
+        images = collection.filter(ee.Filter.inList('system:index', dates))
+        futures = [
+            executor.submit(
+                fetch_with_retry,
+                extract_time_series(images, ee.FeatureCollection(markers), band_name).select(selectors),
+                retries,
+            )
+            for markers in chunked(features, marker_chunk)
+        ]
+        plan.append((dates, futures))
+    return plan
+
+
+def write_time_series(plan, output_path, selectors):
+    # Same row order as the single flattened getInfo(): date by date, markers
+    # in upload order. Earth Engine returns properties sorted by name.
+    with open(output_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=sorted(selectors), extrasaction='ignore')
+        writer.writeheader()
+        for dates, futures in plan:
+            rows_by_date = {str(date): [] for date in dates}
+            for future in futures:
+                for row in future.result():
+                    rows_by_date.setdefault(str(row.get('date')), []).append(row)
+            for rows in rows_by_date.values():
+                writer.writerows(rows)
+
+
+# --- Cached Extraction ---
+def extraction_scope(roi_keys, **collection):
+    # Cached values are only reused for the same ROI (images are filtered to
+    # and clipped by it) and the same collection, date range and filters.
+    key = {"roi": sorted(roi_keys), **collection}
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def submit_missing_time_series(executor, cache, scope, collection, features, markers, band_name):
+    # Only (marker, date) pairs missing from the local cache are requested.
+    # Dates that miss the same markers share requests.
+    dates = [str(date) for date in collection_dates(collection)]
+    feature_by_key = {}
+    for feature, marker in zip(features, markers):
+        feature_by_key.setdefault(marker['geom_key'], feature)
+
+    missing = cache.missing(scope, list(feature_by_key), band_name, dates)
+    groups = {}
+    for date in dates:
+        if missing[date]:
+            groups.setdefault(tuple(missing[date]), []).append(date)
+
+    selectors = ['date', band_name, 'lat', 'lon', 'geom_key']
+    futures = []
+    for keys, group_dates in groups.items():
+        plan = submit_time_series(executor, collection, [feature_by_key[key] for key in keys], band_name, selectors, dates=group_dates)
+        futures.extend(future for _, group in plan for future in group)
+    print(f"{band_name}: {sum(len(keys) * len(d) for keys, d in groups.items())} of {len(feature_by_key) * len(dates)} values to fetch")
+    return dates, futures
+
+
+def marker_property(marker, name, default):
+    value = marker.get(name)
+    if value is None or (isinstance(value, float) and math.isnan(value)) or value == "":
+        return default
+    return value
+
+
+def write_cached_time_series(cache, scope, band_name, dates, markers, output_path):
+    # Rebuilds the tall table from the cache with the columns and row order of
+    # the Earth Engine export; id and crpname_eg follow extract_time_series.
+    selectors = ['id', 'date', band_name, 'crpname_eg', 'lat', 'lon', 'geometry']
+    with open(output_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=sorted(selectors))
+        writer.writeheader()
+        for date in dates:
+            values = cache.values(scope, band_name, date)
+            for marker in markers:
+                value, lat, lon = values[marker['geom_key']]
+                writer.writerow({
+                    'id': marker_property(marker, 'id', ""),
+                    'date': date,
+                    band_name: value,
+                    'crpname_eg': marker_property(marker, 'crpname_eg', marker_property(marker, 'type', 'unknown')),
+                    'lat': lat,
+                    'lon': lon,
+                    'geometry': "",
+                })
+
+
+def load_marker_index(output_folder):
+    path = os.path.join(output_folder, MARKER_INDEX_FILENAME)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_marker_index(output_folder, keys):
+    with open(os.path.join(output_folder, MARKER_INDEX_FILENAME), 'w') as f:
+        json.dump(list(dict.fromkeys(keys)), f)
+
+
 # --- Core Processing Function ---
-def process_crop_time_series(roi_path, markers_path, start_s1, end_s1, start_s2, end_s2, output_folder, project_name):
-    roi = localFeature(roi_path)
-    crop_points = localFeature(markers_path)
+def process_crop_time_series(roi_path, markers_path, start_s1, end_s1, start_s2, end_s2, output_folder, project_name, max_in_flight=MAX_IN_FLIGHT, use_cache=True, backend="ee", raster_dir=None):
+    if backend == "local":
+        # Sampled from local <band>_<date>.tif rasters; no Earth Engine access
+        from local_extraction import extract_local_time_series
+        keys = extract_local_time_series(
+            markers_path, output_folder, project_name, raster_dir,
+            date_ranges={'VV': (start_s1, end_s1), 'VH': (start_s1, end_s1), 'NDVI': (start_s2, end_s2)},
+        )
+        count("markers", len(keys))
+        save_marker_index(output_folder, keys)
+        print("All data exported successfully!")
+        return
+    if backend != "ee":
+        raise ValueError(f"Unknown extraction backend: {backend}")
+
+    roi_features, roi_records = localMarkers(roi_path)
+    roi = ee.FeatureCollection(roi_features)
+    roi_keys = [record['geom_key'] for record in roi_records]
+    crop_points, markers = localMarkers(markers_path)
+    count("markers", len(markers))
 
     os.makedirs(output_folder, exist_ok=True)
 
     print("Processing Sentinel-1...")
-    s1 = ee.ImageCollection("COPERNICUS/S1_GRD") \
+    s1 = ee.ImageCollection(S1_COLLECTION) \
         .filterDate(start_s1, end_s1) \
         .filterBounds(roi) \
-        .filter(ee.Filter.eq('instrumentMode', 'IW')) \
-        .filter(ee.Filter.eq('orbitProperties_pass', 'DESCENDING')) \
+        .filter(ee.Filter.eq('instrumentMode', S1_INSTRUMENT_MODE)) \
+        .filter(ee.Filter.eq('orbitProperties_pass', S1_ORBIT_PASS)) \
         .map(lambda image: image.clip(roi)) \
         .select('VV', 'VH')
 
     s1_mosaic = mosaic_by_date(s1)
-    vv_triplets = extract_time_series(s1_mosaic.select('VV'), crop_points, 'VV')
-    vh_triplets = extract_time_series(s1_mosaic.select('VH'), crop_points, 'VH')
-
-    vv_df = export_table_to_pandas(vv_triplets, ['id', 'date', 'VV', 'crpname_eg', 'lat', 'lon', 'geometry'])
-    vv_df.to_csv(f'{output_folder}/VV_timeseries_{project_name}.csv', index=False)
-
-    vh_df = export_table_to_pandas(vh_triplets, ['id', 'date', 'VH', 'crpname_eg', 'lat', 'lon', 'geometry'])
-    vh_df.to_csv(f'{output_folder}/VH_timeseries_{project_name}.csv', index=False)
 
     print("Processing Sentinel-2 NDVI...")
-    s2 = ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED') \
+    s2 = ee.ImageCollection(S2_COLLECTION) \
         .filterDate(start_s2, end_s2) \
-        .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 50)) \
+        .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', S2_MAX_CLOUDY_PIXEL_PERCENTAGE)) \
         .filterBounds(roi) \
         .map(lambda image: image.clip(roi))
 
     s2_ndvi = mosaic_by_date(s2).map(add_ndvi).select('NDVI')
-    ndvi_16days = temporal_collection(s2_ndvi, start_s2, 13, 16, 'day')
-
-    ndvi_triplets = extract_time_series(ndvi_16days, crop_points, 'NDVI')
-    ndvi_df = export_table_to_pandas(ndvi_triplets, ['id', 'date', 'NDVI', 'crpname_eg', 'lat', 'lon', 'geometry'])
-    ndvi_df.to_csv(f'{output_folder}/NDVI_timeseries_{project_name}.csv', index=False)
+    ndvi_16days = temporal_collection(s2_ndvi, start_s2, NDVI_COMPOSITES, NDVI_COMPOSITE_DAYS, 'day')
 
+    bands = (('VV', s1_mosaic.select('VV')), ('VH', s1_mosaic.select('VH')), ('NDVI', ndvi_16days))
+    s1_scope = extraction_scope(
+        roi_keys, collection=S1_COLLECTION, start=start_s1, end=end_s1,
+        instrument_mode=S1_INSTRUMENT_MODE, orbit_pass=S1_ORBIT_PASS, composite="daily mosaic",
+    )
+    s2_scope = extraction_scope(
+        roi_keys, collection=S2_COLLECTION, start=start_s2, end=end_s2,
+        max_cloudy_pixel_percentage=S2_MAX_CLOUDY_PIXEL_PERCENTAGE,
+        composite=f"max of daily mosaics over {NDVI_COMPOSITES} x {NDVI_COMPOSITE_DAYS} days",
+    )
+    scopes = {'VV': s1_scope, 'VH': s1_scope, 'NDVI': s2_scope}
+
+    # VV, VH and NDVI requests share one bounded pool and run concurrently.
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        if use_cache:
+            cache = EECache()
+            pending = [(band_name, *submit_missing_time_series(executor, cache, scopes[band_name], collection, crop_points, markers, band_name))
+                       for band_name, collection in bands]
+            for band_name, dates, futures in pending:
+                for future in futures:
+                    cache.store(scopes[band_name], band_name, future.result())
+                write_cached_time_series(cache, scopes[band_name], band_name, dates, markers, f'{output_folder}/{band_name}_timeseries_{project_name}.csv')
+                print(f"Exported {band_name} time series")
+            save_marker_index(output_folder, [marker['geom_key'] for marker in markers])
+            print("All data exported successfully!")
+            return
+
+        plans = []
+        for band_name, collection in bands:
+            selectors = ['id', 'date', band_name, 'crpname_eg', 'lat', 'lon', 'geometry']
+            plan = submit_time_series(executor, collection, crop_points, band_name, selectors)
+            plans.append((band_name, plan, selectors))
+
+        for band_name, plan, selectors in plans:
+            write_time_series(plan, f'{output_folder}/{band_name}_timeseries_{project_name}.csv', selectors)
+            print(f"Exported {band_name} time series")
+
+    save_marker_index(output_folder, [marker['geom_key'] for marker in markers])
     print("All data exported successfully!")
 
 
 # --- Main Entry ---
-def Process(boundry_path,markers_path):
+@instrumented()
+def Process(boundry_path,markers_path,project_name=DEFAULT_PROJECT,backend="ee",raster_dir=None):
     
-    project_name = "ujjain"
-    output_folder = f"Crop_mapping_{project_name}"
-
-    start_s1 = '2023-10-01'
-    end_s1 = '2024-04-30'
-
-    start_s2 = '2023-10-15'
-    end_s2 = '2024-04-30'
+    output_folder = project_dir(project_name)
 
     process_crop_time_series(
         roi_path=boundry_path,
         markers_path=markers_path,
-        start_s1=start_s1,
-        end_s1=end_s1,
-        start_s2=start_s2,
-        end_s2=end_s2,
+        start_s1=START_S1,
+        end_s1=END_S1,
+        start_s2=START_S2,
+        end_s2=END_S2,
         output_folder=output_folder,
-        project_name=project_name
+        project_name=project_name,
+        backend=backend,
+        raster_dir=raster_dir
     )
 
     
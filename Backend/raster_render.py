@@ -0,0 +1,165 @@
+import io
+import os
+import math
+import hashlib
+
+import numpy as np
+import rasterio
+from PIL import Image
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+
+from instrumentation import instrumented, count
+
+# Rendering of prediction rasters for the frontend. Reads are decimated with
+# out_shape, which GDAL serves from the internal overviews written by
+# prediction.build_overviews, so the cost follows the displayed size rather
+# than the district size.
+TILE_SIZE = 256
+DEFAULT_MAX_SIZE = 2048
+
+# Class maps are rendered through a fixed palette: class ids index a 256-entry
+# colour table directly, and index 0 (nodata) is transparent. Colours do not
+# depend on which classes a given map or tile happens to contain.
+CLASS_COLORS = [
+    (31, 119, 180), (255, 127, 14), (44, 160, 44), (214, 39, 40), (148, 103, 189),
+    (140, 86, 75), (227, 119, 194), (127, 127, 127), (188, 189, 34), (23, 190, 207),
+]
+NODATA_INDEX = 0
+
+
+def class_palette():
+    palette = np.zeros((256, 3), dtype=np.uint8)
+    for class_id in range(1, 256):
+        palette[class_id] = CLASS_COLORS[(class_id - 1) % len(CLASS_COLORS)]
+    return palette
+
+
+CLASS_PALETTE = class_palette().ravel().tolist()
+
+
+def decimated_shape(height, width, max_size=None):
+    if not max_size or max(height, width) <= max_size:
+        return height, width
+    scale = max_size / max(height, width)
+    return max(1, round(height * scale)), max(1, round(width * scale))
+
+
+def max_zoom(src, tile_size=TILE_SIZE):
+    # Zoom 0 shows the whole raster in one tile; every level doubles the resolution
+    return max(0, math.ceil(math.log2(max(src.height, src.width) / tile_size)))
+
+
+def tile_window(src, z, x, y, tile_size=TILE_SIZE):
+    # Tiles address the raster's own pixel grid (no reprojection), top-left origin
+    if not 0 <= z <= max_zoom(src, tile_size):
+        raise ValueError(f"Zoom {z} out of range")
+    scale = 2 ** (max_zoom(src, tile_size) - z)  # full-resolution pixels per tile pixel
+    span = tile_size * scale
+    col_off, row_off = x * span, y * span
+    if x < 0 or y < 0 or col_off >= src.width or row_off >= src.height:
+        raise ValueError(f"Tile {z}/{x}/{y} out of range")
+    width = min(span, src.width - col_off)
+    height = min(span, src.height - row_off)
+    return Window(col_off, row_off, width, height), (math.ceil(height / scale), math.ceil(width / scale))
+
+
+def stretch(array, vmin, vmax):
+    if vmax <= vmin:
+        return np.zeros(array.shape, dtype=np.uint8)
+    return ((np.clip(array, vmin, vmax) - vmin) / (vmax - vmin) * 255).astype(np.uint8)
+
+
+def class_indices(data, nodata):
+    # Class ids become palette indices in one uint8 conversion; nodata and
+    # ids outside the palette map to the transparent entry.
+    indices = data.astype(np.uint8)
+    indices[(data <= 0) | (data > 255)] = NODATA_INDEX
+    if nodata is not None:
+        indices[data == nodata] = NODATA_INDEX
+    return indices
+
+
+def class_image(indices):
+    img = Image.fromarray(indices, mode="P")
+    img.putpalette(CLASS_PALETTE)
+    return img
+
+
+def png_bytes(img):
+    buffer = io.BytesIO()
+    if img.mode == "P":
+        img.save(buffer, format="PNG", transparency=NODATA_INDEX)
+    else:
+        img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def raster_stamp(input_path):
+    stat = os.stat(input_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def render_etag(input_path, stamp, *variant):
+    # Derived from the raster's stamp, so a revalidation needs no rendering
+    key = repr((os.path.abspath(input_path), stamp, variant))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def raster_info(input_path, tile_size=TILE_SIZE):
+    with rasterio.open(input_path) as src:
+        return {
+            "width": src.width,
+            "height": src.height,
+            "count": src.count,
+            "crs": src.crs.to_string() if src.crs else None,
+            "bounds": list(src.bounds),
+            "nodata": src.nodata,
+            "overviews": src.overviews(1),
+            "tile_size": tile_size,
+            "max_zoom": max_zoom(src, tile_size),
+            "palette": {class_id: "#%02x%02x%02x" % color for class_id, color in enumerate(CLASS_COLORS, start=1)},
+        }
+
+
+@instrumented()
+def render_tile(input_path, z, x, y, tile_size=TILE_SIZE):
+    with rasterio.open(input_path) as src:
+        window, out_shape = tile_window(src, z, x, y, tile_size)
+        data = src.read(1, window=window, out_shape=out_shape, resampling=Resampling.nearest)
+        nodata = src.nodata
+
+    # The area past the raster edge stays transparent
+    tile = np.full((tile_size, tile_size), NODATA_INDEX, dtype=np.uint8)
+    tile[:data.shape[0], :data.shape[1]] = class_indices(data, nodata)
+    return png_bytes(class_image(tile))
+
+
+@instrumented()
+def render_preview(input_path, max_size=DEFAULT_MAX_SIZE):
+    with rasterio.open(input_path) as src:
+        band_count = src.count
+        if band_count == 1:
+            indexes = [1]
+        elif band_count >= 3:
+            indexes = [1, 2, 3]
+        else:
+            raise ValueError("Unsupported band count")
+        height, width = decimated_shape(src.height, src.width, max_size)
+        array = src.read(indexes, out_shape=(len(indexes), height, width), resampling=Resampling.nearest)
+        count("pixels", height * width)
+        nodata = src.nodata
+
+    if band_count == 1:
+        # Class map
+        return class_image(class_indices(array[0], nodata))
+    # RGB
+    img_array = np.transpose(array, (1, 2, 0))  # (bands, height, width) -> (height, width, bands)
+    img_array = stretch(img_array, img_array.min(), img_array.max())
+    return Image.fromarray(img_array, mode="RGB")
+
+
+@instrumented()
+def convert_raster(input_path, output_path, max_size=DEFAULT_MAX_SIZE):
+    with open(output_path, 'wb') as f:
+        f.write(png_bytes(render_preview(input_path, max_size)))
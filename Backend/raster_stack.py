@@ -0,0 +1,135 @@
+import os
+import contextlib
+from xml.sax.saxutils import escape
+
+import rasterio
+
+from artifact_store import load_table
+from model_registry import ModelRegistry
+from workspace import project_dir
+
+# Assembles the prediction stack from per-date band GeoTIFFs named after the
+# training columns (raster_stack/bands/VV_20231016.tif, ...). The band order is
+# taken from the model's feature list, so it always matches training. The stack
+# is either a VRT that references the band files, or a tiled GeoTIFF written
+# one block at a time.
+BAND_DIRNAME = "bands"
+STACK_DTYPE = "float32"
+STACK_BLOCK_SIZE = 256
+STACK_COMPRESSION = "deflate"
+
+GDAL_DATA_TYPES = {
+    "uint8": "Byte", "int8": "Int8", "uint16": "UInt16", "int16": "Int16",
+    "uint32": "UInt32", "int32": "Int32", "float32": "Float32", "float64": "Float64",
+}
+
+
+def stack_path(project_name, vrt=False):
+    extension = ".vrt" if vrt else ".tif"
+    return os.path.join(project_dir(project_name), "raster_stack", f"S1S2_{project_name.capitalize()}_Rabi_Prediction_stack{extension}")
+
+
+def band_dir(project_name):
+    return os.path.join(project_dir(project_name), "raster_stack", BAND_DIRNAME)
+
+
+def training_features(project_name):
+    # Feature order of the latest registered model, or of the training table
+    # for projects trained before the registry existed.
+    root = project_dir(project_name)
+    registry = ModelRegistry(os.path.join(root, "metrics"))
+    if registry.exists():
+        return registry.resolve("BRF", "latest")["features"]
+    features_path = os.path.join(root, "timeseries", "crops3inc_multiclass_S1S2_onlytimeseries_v01.csv")
+    return [col for col in load_table(features_path).columns if col != 'Class']
+
+
+def band_files(directory, features):
+    paths = [os.path.join(directory, f"{feature}.tif") for feature in features]
+    missing = [os.path.basename(path) for path in paths if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(f"Missing band rasters in '{directory}': {', '.join(missing)}")
+    return paths
+
+
+def check_grid(sources, paths):
+    # Every band must share the first band's grid to be stacked pixel for pixel
+    reference = sources[0]
+    for src, path in zip(sources[1:], paths[1:]):
+        if (src.crs, src.transform, src.width, src.height) != (reference.crs, reference.transform, reference.width, reference.height):
+            raise ValueError(f"'{path}' is not on the same grid as '{paths[0]}'")
+
+
+def build_vrt(paths, output_path, descriptions):
+    with contextlib.ExitStack() as stack:
+        sources = [stack.enter_context(rasterio.open(path)) for path in paths]
+        check_grid(sources, paths)
+        reference = sources[0]
+        lines = [
+            f'<VRTDataset rasterXSize="{reference.width}" rasterYSize="{reference.height}">',
+            f'  <SRS>{escape(reference.crs.to_wkt())}</SRS>',
+            f'  <GeoTransform>{", ".join(repr(value) for value in reference.transform.to_gdal())}</GeoTransform>',
+        ]
+        for index, (src, path, description) in enumerate(zip(sources, paths, descriptions), start=1):
+            lines.append(f'  <VRTRasterBand dataType="{GDAL_DATA_TYPES[src.dtypes[0]]}" band="{index}">')
+            lines.append(f'    <Description>{escape(description)}</Description>')
+            if src.nodata is not None:
+                lines.append(f'    <NoDataValue>{src.nodata!r}</NoDataValue>')
+            lines.append('    <SimpleSource>')
+            lines.append(f'      <SourceFilename relativeToVRT="0">{escape(os.path.abspath(path))}</SourceFilename>')
+            lines.append('      <SourceBand>1</SourceBand>')
+            lines.append('    </SimpleSource>')
+            lines.append('  </VRTRasterBand>')
+        lines.append('</VRTDataset>')
+
+    with open(output_path, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def materialize_stack(paths, output_path, descriptions):
+    # Block by block, band by band: only one block of one band is in memory
+    tmp_path = f"{output_path}.tmp-{os.getpid()}.tif"
+    with contextlib.ExitStack() as stack:
+        sources = [stack.enter_context(rasterio.open(path)) for path in paths]
+        check_grid(sources, paths)
+        reference = sources[0]
+        profile = dict(
+            driver='GTiff',
+            height=reference.height,
+            width=reference.width,
+            count=len(sources),
+            dtype=STACK_DTYPE,
+            nodata=reference.nodata,
+            crs=reference.crs,
+            transform=reference.transform,
+            tiled=True,
+            blockxsize=STACK_BLOCK_SIZE,
+            blockysize=STACK_BLOCK_SIZE,
+            compress=STACK_COMPRESSION,
+            BIGTIFF='IF_SAFER',
+        )
+        with rasterio.open(tmp_path, 'w', **profile) as dst:
+            for index, description in enumerate(descriptions, start=1):
+                dst.set_band_description(index, description)
+            for _, window in dst.block_windows(1):
+                for index, src in enumerate(sources, start=1):
+                    dst.write(src.read(1, window=window).astype(STACK_DTYPE, copy=False), index, window=window)
+    os.replace(tmp_path, output_path)
+
+
+def build_stack(project_name, directory=None, features=None, vrt=False):
+    features = features or training_features(project_name)
+    paths = band_files(directory or band_dir(project_name), features)
+    output_path = stack_path(project_name, vrt=vrt)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    print(f"Building {'VRT' if vrt else 'GeoTIFF'} stack of {len(features)} bands at: {output_path}")
+    if vrt:
+        build_vrt(paths, output_path, features)
+    else:
+        materialize_stack(paths, output_path, features)
+    return output_path
+
+
+if __name__ == "__main__":
+    build_stack("ujjain")
@@ -0,0 +1,195 @@
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import threading
+
+# Content-addressed memoization of pipeline stages. A stage's fingerprint is
+# the hash of its input files' contents plus its parameters; when it matches a
+# stored entry the stage's output files are restored instead of re-running it.
+# Outputs are recorded relative to the run's root directory, and the project
+# name in file names (VV_timeseries_<project>.csv, ...) is stored as a
+# placeholder, so an entry made by one project restores into another under
+# that project's own names.
+STAGE_CACHE_DIR = os.environ.get("CROPMAP_STAGE_CACHE_DIR", ".stage_cache")
+STAGE_CACHE_MAX_BYTES = int(os.environ.get("CROPMAP_STAGE_CACHE_MAX_BYTES", 5 * 1024 ** 3))
+
+MANIFEST = "manifest.json"
+# Part of every fingerprint; entries in an older manifest layout are never hit
+MANIFEST_VERSION = 3
+PROJECT_PLACEHOLDER = "{project}"
+
+
+def _iter_files(path):
+    if os.path.isdir(path):
+        for root, _, files in sorted(os.walk(path)):
+            for name in sorted(files):
+                yield os.path.join(root, name)
+    elif os.path.exists(path):
+        yield path
+
+
+def _project_pattern(project):
+    # "_<project>" ending a name part, as in <band>_timeseries_<project>_wide.csv
+    return re.compile(rf"_{re.escape(project)}(?=[_.]|$)")
+
+
+def neutral_name(name, project):
+    return _project_pattern(project).sub("_" + PROJECT_PLACEHOLDER, name) if project else name
+
+
+def project_name(name, project):
+    return name.replace("_" + PROJECT_PLACEHOLDER, f"_{project}") if project else name
+
+
+def _relpath_with(relpath, rename, project):
+    return os.path.join(*(rename(part, project) for part in relpath.split(os.sep)))
+
+
+def _rename_tree(path, rename, project):
+    # Bottom-up, so renaming a directory never moves entries not yet visited
+    for dirpath, dirnames, filenames in os.walk(path, topdown=False):
+        for name in filenames + dirnames:
+            renamed = rename(name, project)
+            if renamed != name:
+                os.replace(os.path.join(dirpath, name), os.path.join(dirpath, renamed))
+
+
+def _tree_size(path):
+    return sum(os.path.getsize(f) for f in _iter_files(path))
+
+
+class StageCache:
+    def __init__(self, root=STAGE_CACHE_DIR, max_bytes=STAGE_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._digests = {}  # (path, size, mtime_ns) -> sha256
+        self._lock = threading.Lock()
+
+    def file_digest(self, path):
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        digest = self._digests.get(key)
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    sha.update(chunk)
+            digest = self._digests[key] = sha.hexdigest()
+        return digest
+
+    def fingerprint(self, stage, inputs, params):
+        # Input paths are not part of the key, only their contents, so the same
+        # data uploaded under another project hits the same entry.
+        input_digests = []
+        for path in inputs:
+            input_digests.append(sorted(
+                (os.path.relpath(f, path) if os.path.isdir(path) else "", self.file_digest(f))
+                for f in _iter_files(path)
+            ))
+        payload = json.dumps(
+            {"stage": stage, "inputs": input_digests, "params": params, "manifest_version": MANIFEST_VERSION},
+            sort_keys=True, default=str,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def run(self, stage, inputs, params, outputs, fn, root="", project=None):
+        # outputs: paths under root, or a callable listing the paths fn wrote
+        # when they are only known once it has run. project: name to keep out
+        # of the stored file names.
+        entry_dir = os.path.join(self.root, stage, self.fingerprint(stage, inputs, params))
+        manifest_path = os.path.join(entry_dir, MANIFEST)
+
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            self._restore(entry_dir, manifest, root, project)
+            os.utime(manifest_path)  # Marks the entry as recently used
+            self.hits += 1
+            print(f"Stage '{stage}' restored from cache")
+            return True
+
+        self.misses += 1
+        fn()
+        self._store(entry_dir, outputs() if callable(outputs) else outputs, root, project)
+        self.evict()
+        return False
+
+    def _restore(self, entry_dir, manifest, root, project):
+        for index, (relpath, is_dir) in enumerate(manifest["outputs"]):
+            source = os.path.join(entry_dir, str(index))
+            target = os.path.join(root, _relpath_with(relpath, project_name, project))
+            # Replaced, not merged: files a later run left behind must not
+            # survive next to the restored ones.
+            if os.path.isdir(target):
+                shutil.rmtree(target)
+            elif os.path.exists(target):
+                os.remove(target)
+            if is_dir:
+                shutil.copytree(source, target)
+                _rename_tree(target, project_name, project)
+            else:
+                os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+                shutil.copy2(source, target)
+
+    def _store(self, entry_dir, outputs, root, project):
+        # Written to a temporary directory and renamed so concurrent runs never
+        # see a half-written entry.
+        tmp_dir = f"{entry_dir}.tmp-{os.getpid()}-{threading.get_ident()}"
+        os.makedirs(tmp_dir, exist_ok=True)
+        stored = []
+        for path in outputs:
+            target = os.path.join(tmp_dir, str(len(stored)))
+            relpath = _relpath_with(os.path.relpath(path, root or "."), neutral_name, project)
+            if os.path.isdir(path):
+                shutil.copytree(path, target)
+                _rename_tree(target, neutral_name, project)
+                stored.append((relpath, True))
+            elif os.path.exists(path):
+                shutil.copy2(path, target)
+                stored.append((relpath, False))
+        with open(os.path.join(tmp_dir, MANIFEST), "w") as f:
+            json.dump({"outputs": stored, "created_at": time.time()}, f)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)  # Another run stored it first
+
+    def evict(self):
+        # Least-recently-used entries go first until the cache fits its budget.
+        with self._lock:
+            entries = []
+            if not os.path.isdir(self.root):
+                return
+            for stage in os.listdir(self.root):
+                stage_dir = os.path.join(self.root, stage)
+                for name in os.listdir(stage_dir):
+                    manifest_path = os.path.join(stage_dir, name, MANIFEST)
+                    if os.path.exists(manifest_path):
+                        entry_dir = os.path.dirname(manifest_path)
+                        entries.append((os.path.getmtime(manifest_path), _tree_size(entry_dir), entry_dir))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry_dir in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                total -= size
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def shapefile_parts(shp_path):
+    # The .shp alone does not carry attributes or projection; hash all sidecars.
+    stem = os.path.splitext(shp_path)[0]
+    directory = os.path.dirname(shp_path) or "."
+    base = os.path.basename(stem)
+    return sorted(
+        os.path.join(directory, f) for f in os.listdir(directory)
+        if os.path.splitext(f)[0] == base and not f.endswith(".zip")
+    )
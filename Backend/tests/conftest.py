@@ -0,0 +1,71 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+# Backend modules are imported flat, as the API and the job workers do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MPLBACKEND", "Agg")  # Preprocessing and training draw figures
+
+import numpy as np
+import geopandas as gpd
+import rasterio
+from shapely.geometry import Point, box
+from rasterio.transform import from_origin
+
+DATES = ["2023-11-01", "2023-12-01", "2024-01-01"]
+CROPS = ["wheat", "gram", "mustard"]
+ORIGIN = (75.0, 23.0)
+RESOLUTION = 1e-4  # About 10 m
+RASTER_SIZE = 60
+
+
+def write_band_rasters(raster_dir, dates=DATES):
+    # <band>_<date>.tif files the local extraction backend samples
+    os.makedirs(raster_dir, exist_ok=True)
+    for band_index, band in enumerate(("VV", "VH", "NDVI")):
+        for date_index, date in enumerate(dates):
+            rng = np.random.default_rng(band_index * 100 + date_index)
+            with rasterio.open(
+                os.path.join(raster_dir, f"{band}_{date}.tif"), "w", driver="GTiff",
+                height=RASTER_SIZE, width=RASTER_SIZE, count=1, dtype="float32", crs="EPSG:4326",
+                transform=from_origin(*ORIGIN, RESOLUTION, RESOLUTION),
+            ) as dst:
+                dst.write(rng.normal(-15, 5, (RASTER_SIZE, RASTER_SIZE)).astype(np.float32), 1)
+
+
+def write_markers(path, start, stop):
+    # Markers on a 3-pixel grid; labels cycle through CROPS
+    indices = range(start, stop)
+    points = [Point(ORIGIN[0] + (3 + 3 * (i % 18) + 0.5) * RESOLUTION, ORIGIN[1] - (3 + 3 * (i // 18) + 0.5) * RESOLUTION) for i in indices]
+    gpd.GeoDataFrame({"crpname_eg": [CROPS[i % len(CROPS)] for i in indices]}, geometry=points, crs="EPSG:4326").to_file(path)
+    return path
+
+
+@pytest.fixture
+def local_workspace(tmp_path, monkeypatch):
+    # Project workspace, stage cache and uploads under tmp_path, with band
+    # rasters for the offline extraction backend
+    import workspace
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(workspace, "WORKSPACE_ROOT", str(tmp_path))
+    shapes = tmp_path / "shapes"
+    os.makedirs(shapes)
+    roi_path = str(shapes / "roi.shp")
+    extent = RASTER_SIZE * RESOLUTION
+    gpd.GeoDataFrame(geometry=[box(ORIGIN[0], ORIGIN[1] - extent, ORIGIN[0] + extent, ORIGIN[1])], crs="EPSG:4326").to_file(roi_path)
+    raster_dir = str(tmp_path / "bands")
+    write_band_rasters(raster_dir)
+
+    def markers(name, start, stop):
+        return write_markers(str(shapes / f"{name}.shp"), start, stop)
+
+    def job_params(project_name, markers_path, **extra):
+        return {
+            "project_name": project_name, "roi_path": roi_path, "markers_path": markers_path,
+            "extraction_backend": "local", "raster_dir": raster_dir,
+            "sample_size": 10, "test_size": 0.3, "n_trees": 5, "drop_cols": [], **extra,
+        }
+
+    return SimpleNamespace(root=tmp_path, roi_path=roi_path, raster_dir=raster_dir, markers=markers, job_params=job_params)
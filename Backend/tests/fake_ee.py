@@ -0,0 +1,140 @@
+import threading
+from time import sleep  # Bound at import: tests may patch time.sleep to skip the retry backoff
+
+# In-memory stand-in for the parts of the Earth Engine client used by the
+# batched extraction. Images are dates, features are marker dicts, and every
+# getInfo() of an extracted table is one recorded request. Queued failures
+# are raised by the next requests, and delay(rows) can slow a request down to
+# make concurrent requests finish out of order.
+
+
+class EEException(Exception):
+    pass
+
+
+class FakeReducer:
+    @staticmethod
+    def mean():
+        return FakeReducer()
+
+    def setOutputs(self, outputs):
+        return self
+
+
+class FakeFilter:
+    @staticmethod
+    def inList(prop, values):
+        return ("inList", prop, list(values))
+
+
+class FakeValue:
+    def __init__(self, value):
+        self.value = value
+
+    def getInfo(self):
+        return self.value
+
+
+class FakeTable:
+    def __init__(self, client, rows, selectors=None):
+        self.client = client
+        self.rows = rows
+        self.selectors = selectors
+
+    def map(self, fn):
+        # Per-feature formatting is already applied to the rows
+        return self
+
+    def select(self, selectors):
+        return FakeTable(self.client, self.rows, list(selectors))
+
+    def getInfo(self):
+        rows = [{key: row[key] for key in (self.selectors or row)} for row in self.rows]
+        return {"features": [{"properties": row} for row in self.client.request(rows)]}
+
+
+class FakeTables:
+    def __init__(self, tables):
+        self.tables = tables
+
+    def flatten(self):
+        client = self.tables[0].client if self.tables else None
+        return FakeTable(client, [row for table in self.tables for row in table.rows])
+
+
+class FakeImage:
+    def __init__(self, client, date, band=None):
+        self.client = client
+        self.date = date
+        self.band = band
+
+    def select(self, band):
+        return FakeImage(self.client, self.date, band)
+
+    def reduceRegions(self, collection, reducer, scale):
+        return FakeTable(self.client, [
+            {
+                "id": marker.get("id", ""),
+                "date": self.date,
+                self.band: self.client.value(marker, self.date),
+                "crpname_eg": marker.get("crpname_eg", "unknown"),
+                "lat": marker["lat"],
+                "lon": marker["lon"],
+                "geometry": "",
+                "geom_key": marker.get("geom_key"),
+            }
+            for marker in collection.rows
+        ])
+
+
+class FakeImageCollection:
+    def __init__(self, client, dates):
+        self.client = client
+        self.dates = list(dates)
+
+    def filter(self, condition):
+        kind, prop, values = condition
+        assert kind == "inList" and prop == "system:index"
+        return FakeImageCollection(self.client, [date for date in self.dates if date in values])
+
+    def aggregate_array(self, prop):
+        assert prop == "system:index"
+        return FakeValue(list(self.dates))
+
+    def map(self, fn):
+        return FakeTables([fn(FakeImage(self.client, date)) for date in self.dates])
+
+
+class FakeEarthEngine:
+    EEException = EEException
+    Filter = FakeFilter
+    Reducer = FakeReducer
+
+    def __init__(self, failures=None, delay=None):
+        self.failures = list(failures or [])
+        self.delay = delay
+        self.requests = []  # Rows asked for, in the order requests started
+        self.completed = []  # The same, in the order requests finished
+        self._lock = threading.Lock()
+
+    def ImageCollection(self, dates):
+        return FakeImageCollection(self, dates)
+
+    def FeatureCollection(self, markers):
+        return FakeTable(self, list(markers))
+
+    @staticmethod
+    def value(marker, date):
+        return float(f"{marker['id']}.{date}")
+
+    def request(self, rows):
+        with self._lock:
+            self.requests.append(rows)
+            failure = self.failures.pop(0) if self.failures else None
+        if failure is not None:
+            raise failure
+        if self.delay is not None:
+            sleep(self.delay(rows))
+        with self._lock:
+            self.completed.append(rows)
+        return rows
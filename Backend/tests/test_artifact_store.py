@@ -0,0 +1,61 @@
+import os
+import sys
+import subprocess
+
+import pandas as pd
+import pytest
+
+import artifact_store
+from artifact_store import save_table, load_table, has_columnar, artifact_path
+
+pytestmark = pytest.mark.skipif(artifact_store.feather is None, reason="pyarrow not installed")
+
+
+def test_load_table_reads_feather_after_save(tmp_path, monkeypatch):
+    monkeypatch.setattr(artifact_store, "ARTIFACT_FORMAT", "feather")
+    path = str(tmp_path / "table.csv")
+    df = pd.DataFrame({"id": [1, 2], "VV": [-12.5, -14.0]})
+    save_table(df, path, csv_export=True)
+
+    assert os.path.exists(path) and os.path.exists(artifact_path(path))
+    assert has_columnar(path)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("load_table parsed the CSV")
+    monkeypatch.setattr(artifact_store.pd, "read_csv", fail)
+    pd.testing.assert_frame_equal(load_table(path), df)
+
+
+def test_hand_edited_csv_takes_precedence(tmp_path, monkeypatch):
+    monkeypatch.setattr(artifact_store, "ARTIFACT_FORMAT", "feather")
+    path = str(tmp_path / "table.csv")
+    save_table(pd.DataFrame({"id": [1, 2]}), path, csv_export=True)
+
+    pd.DataFrame({"id": [3]}).to_csv(path, index=False)
+    feather_mtime = os.path.getmtime(artifact_path(path))
+    os.utime(path, (feather_mtime + 10, feather_mtime + 10))
+
+    assert not has_columnar(path)
+    assert load_table(path)["id"].tolist() == [3]
+
+
+def test_rewriting_a_loaded_table_keeps_the_loaded_frame_valid(tmp_path):
+    # Runs in a subprocess: rewriting a memory-mapped file in place dies with SIGBUS
+    script = f"""
+import sys
+sys.path.insert(0, {os.path.dirname(os.path.dirname(os.path.abspath(__file__)))!r})
+import numpy as np
+import pandas as pd
+import artifact_store
+artifact_store.ARTIFACT_FORMAT = "feather"
+path = {str(tmp_path / "table.csv")!r}
+# String columns come back as Arrow arrays backed by the mapped file
+table = pd.DataFrame({{"crpname_eg": ["wheat", "gram"] * 100_000, "value": np.arange(200_000, dtype=np.float64)}})
+artifact_store.save_table(table, path)
+loaded = artifact_store.load_table(path)
+artifact_store.save_table(pd.concat([loaded.head(1), loaded.head(1)]), path)
+assert (loaded["crpname_eg"] == table["crpname_eg"]).all()
+assert artifact_store.load_table(path)["crpname_eg"].tolist() == ["wheat", "wheat"]
+"""
+    completed = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True)
+    assert completed.returncode == 0, completed.stderr
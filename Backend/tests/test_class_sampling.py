@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from artifact_store import save_table
+from modelCreationp import stream_sample_per_class
+
+CLASS_SIZES = {"wheat": 50, "gram": 30, "mustard": 5}
+
+
+@pytest.fixture(params=["csv", "feather"])
+def table_path(request, tmp_path):
+    rng = np.random.default_rng(0)
+    classes = np.repeat(list(CLASS_SIZES), list(CLASS_SIZES.values()))
+    df = pd.DataFrame({"row": np.arange(len(classes)), "VV_1": rng.normal(size=len(classes)), "Class": rng.permutation(classes)})
+    path = str(tmp_path / "features.csv")
+    if request.param == "csv":
+        df.to_csv(path, index=False)
+    else:
+        save_table(df, path, csv_export=False)
+    return path
+
+
+def test_sample_is_balanced_and_without_replacement(table_path):
+    sample = stream_sample_per_class(table_path, 10, chunksize=16)
+
+    assert sample["Class"].value_counts().to_dict() == {"wheat": 10, "gram": 10, "mustard": 5}
+    assert sample["row"].is_unique
+    assert list(sample.columns) == ["row", "VV_1", "Class"]
+
+
+def test_sample_is_reproducible_and_independent_of_chunk_size(table_path):
+    expected = stream_sample_per_class(table_path, 10, chunksize=1_000)
+
+    for chunksize in (1, 7, 16, 85):
+        pd.testing.assert_frame_equal(stream_sample_per_class(table_path, 10, chunksize=chunksize), expected)
+    assert not stream_sample_per_class(table_path, 10, chunksize=7, seed=1).equals(expected)
+
+
+def test_every_row_is_equally_likely(tmp_path):
+    path = str(tmp_path / "features.csv")
+    pd.DataFrame({"row": np.arange(40), "Class": "wheat"}).to_csv(path, index=False)
+
+    picks = np.zeros(40)
+    for seed in range(200):
+        picks[stream_sample_per_class(path, 10, chunksize=15, seed=seed)["row"]] += 1
+    # 50 expected picks per row; binomial sd is about 6.1
+    assert np.abs(picks - 50).max() < 25
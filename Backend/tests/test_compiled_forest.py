@@ -0,0 +1,29 @@
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+
+from compiled_forest import CompiledForest, flatten_forest
+
+
+def test_predict_proba_matches_sklearn():
+    rng = np.random.default_rng(0)
+    y = rng.integers(1, 5, 500)
+    X = (rng.normal(0, 2, (500, 6)) + y[:, None]).astype(np.float32)
+    model = RandomForestClassifier(n_estimators=15, random_state=0).fit(X, y)
+    compiled = CompiledForest(flatten_forest(model))
+
+    X_new = rng.normal(2, 3, (2_000, 6)).astype(np.float32)
+    np.testing.assert_allclose(compiled.predict_proba(X_new), model.predict_proba(X_new), rtol=0, atol=1e-12)
+    np.testing.assert_array_equal(compiled.predict(X_new), model.predict(X_new))
+
+
+def test_missing_values_follow_sklearn():
+    rng = np.random.default_rng(1)
+    y = rng.integers(1, 4, 400)
+    X = (rng.normal(0, 2, (400, 5)) + y[:, None]).astype(np.float32)
+    X[rng.random(X.shape) < 0.1] = np.nan  # Some splits learn where missing values go
+    model = RandomForestClassifier(n_estimators=10, random_state=0).fit(X, y)
+    compiled = CompiledForest(flatten_forest(model))
+
+    X_new = rng.normal(2, 3, (1_000, 5)).astype(np.float32)
+    X_new[rng.random(X_new.shape) < 0.3] = np.nan
+    np.testing.assert_allclose(compiled.predict_proba(X_new), model.predict_proba(X_new), rtol=0, atol=1e-12)
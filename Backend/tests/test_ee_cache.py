@@ -0,0 +1,80 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import ee_client
+from ee_cache import EECache
+from process_shapefiles import extraction_scope, submit_missing_time_series
+from fake_ee import FakeEarthEngine
+
+DATES = ["20231016", "20231028", "20231109"]
+S1 = {"collection": "COPERNICUS/S1_GRD", "start": "2023-10-01", "end": "2024-04-30"}
+
+
+@pytest.fixture
+def client():
+    client = FakeEarthEngine()
+    ee_client.set_ee(client)
+    yield client
+    ee_client.set_ee(None)
+
+
+def markers(n):
+    return [{"id": i + 1, "lat": 23.0 + i, "lon": 75.0 + i, "geom_key": f"marker-{i + 1}"} for i in range(n)]
+
+
+def fetch(client, cache, scope, n_markers):
+    # One cached extraction of band VV, with the fake's features being the
+    # marker dicts; returns the number of values requested
+    collection = client.ImageCollection(DATES)
+    points = markers(n_markers)
+    before = sum(len(rows) for rows in client.requests)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        _, futures = submit_missing_time_series(executor, cache, scope, collection, points, points, "VV")
+        for future in futures:
+            cache.store(scope, "VV", future.result())
+    return sum(len(rows) for rows in client.requests) - before
+
+
+def test_scope_covers_roi_and_collection():
+    scope = extraction_scope(["roi-a", "roi-b"], **S1)
+
+    assert extraction_scope(["roi-b", "roi-a"], **S1) == scope
+    assert extraction_scope(["roi-a"], **S1) != scope
+    assert extraction_scope(["roi-a", "roi-b"], **{**S1, "end": "2024-03-31"}) != scope
+    assert extraction_scope(["roi-a", "roi-b"], **S1, orbit_pass="ASCENDING") != scope
+
+
+def test_hits_and_misses(tmp_path, client):
+    cache = EECache(str(tmp_path / "ee.sqlite"))
+    scope = extraction_scope(["roi"], **S1)
+
+    assert fetch(client, cache, scope, 2) == 2 * len(DATES)
+    assert fetch(client, cache, scope, 2) == 0
+    # Only the new marker is requested
+    assert fetch(client, cache, scope, 3) == len(DATES)
+    assert cache.values(scope, "VV", DATES[0])["marker-3"][0] == FakeEarthEngine.value({"id": 3}, DATES[0])
+
+
+def test_scopes_and_bands_do_not_share_values(tmp_path, client):
+    cache = EECache(str(tmp_path / "ee.sqlite"))
+    scope = extraction_scope(["roi"], **S1)
+    fetch(client, cache, scope, 2)
+
+    other_roi = extraction_scope(["other-roi"], **S1)
+    assert cache.missing(other_roi, ["marker-1", "marker-2"], "VV", DATES) == {date: ["marker-1", "marker-2"] for date in DATES}
+    assert cache.values(other_roi, "VV", DATES[0]) == {}
+    assert cache.missing(scope, ["marker-1"], "VH", DATES[:1]) == {DATES[0]: ["marker-1"]}
+    assert fetch(client, cache, other_roi, 2) == 2 * len(DATES)
+
+
+def test_tables_without_scope_are_replaced(tmp_path):
+    path = str(tmp_path / "ee.sqlite")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE ee_values (geom_key TEXT, band TEXT, date TEXT, value REAL, lat REAL, lon REAL)")
+        conn.execute("INSERT INTO ee_values VALUES ('marker-1', 'VV', '20231016', 1.0, 23.0, 75.0)")
+
+    cache = EECache(path)
+    assert cache.values("scope", "VV", "20231016") == {}
+    assert cache.missing("scope", ["marker-1"], "VV", ["20231016"]) == {"20231016": ["marker-1"]}
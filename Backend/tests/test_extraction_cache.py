@@ -0,0 +1,43 @@
+import os
+
+import incremental_training
+import process_shapefiles
+import workspace
+from jobs import pipeline_stage_functions
+
+
+def test_incremental_run_after_extraction_cache_hit(local_workspace):
+    markers_path = local_workspace.markers("markers", 0, 3)
+
+    assert not pipeline_stage_functions(local_workspace.job_params("first", markers_path))["extraction"]()
+    # Same uploads in a new project: restored from the first project's entry
+    assert pipeline_stage_functions(local_workspace.job_params("second", markers_path))["extraction"]()
+
+    restored = process_shapefiles.load_marker_index(workspace.project_dir("second"))
+    assert restored == process_shapefiles.load_marker_index(workspace.project_dir("first"))
+    assert len(restored) == 3
+
+    # Two markers added to the upload: only those are extracted
+    updated_path = local_workspace.markers("markers_updated", 0, 5)
+    assert incremental_training.extract_delta_markers(
+        "second", local_workspace.roi_path, updated_path, backend="local", raster_dir=local_workspace.raster_dir,
+    ) == 2
+
+
+def test_cross_project_cache_hits_restore_project_file_names(local_workspace):
+    markers_path = local_workspace.markers("markers", 0, 30)
+    first = pipeline_stage_functions(local_workspace.job_params("first", markers_path))
+    assert not first["extraction"]()
+    assert not first["preprocess"]()
+
+    second = pipeline_stage_functions(local_workspace.job_params("second", markers_path))
+    assert second["extraction"]()
+    assert second["preprocess"]()
+
+    second_dir = workspace.project_dir("second")
+    for band in ("VV", "VH", "NDVI"):
+        assert os.path.exists(os.path.join(second_dir, f"{band}_timeseries_second.csv"))
+    timeseries = os.listdir(os.path.join(second_dir, "timeseries"))
+    assert timeseries and not [name for name in timeseries if "first" in name]
+    # Training reads the restored tables under the second project's names
+    assert not second["training"]()
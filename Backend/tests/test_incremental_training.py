@@ -0,0 +1,36 @@
+import os
+
+import artifact_store
+import process_shapefiles
+import workspace
+from artifact_store import load_table
+from jobs import pipeline_stage_functions
+from model_registry import ModelRegistry
+from conftest import CROPS
+
+
+def run_stages(params, names=("extraction", "preprocess", "training")):
+    stages = pipeline_stage_functions(params)
+    for name in names:
+        stages[name]()
+
+
+def test_two_incremental_runs_with_feather_tables(local_workspace):
+    assert artifact_store.ARTIFACT_FORMAT == "feather"
+    root = workspace.project_dir("demo")
+    features_path = os.path.join(root, "timeseries", "crops3inc_multiclass_S1S2_onlytimeseries_v01.csv")
+    run_stages(local_workspace.job_params("demo", local_workspace.markers("markers", 0, 30), use_stage_cache=False))
+    assert len(load_table(features_path)) == 30
+
+    for version, stop in ((3, 36), (5, 42)):
+        params = local_workspace.job_params("demo", local_workspace.markers(f"markers_{stop}", 0, stop), incremental=True, n_new_trees=3)
+        run_stages(params)
+
+        registry = ModelRegistry(os.path.join(root, "metrics"))
+        assert registry.resolve("RF", "latest")["version"] == version
+        assert registry.resolve("BRF", "latest")["version"] == version + 1
+        assert registry.resolve("BRF", "latest")["parent"] == version - 1
+        assert len(load_table(features_path)) == stop
+        meta = load_table(os.path.join(root, "timeseries", "timeseries_crops3inc.csv"))
+        assert meta["crpname_eg"].tolist() == [CROPS[i % len(CROPS)] for i in range(stop)]
+        assert len(process_shapefiles.load_marker_index(root)) == stop
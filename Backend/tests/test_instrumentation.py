@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+import instrumentation
+
+ALLOCATION = 256 * 1024 * 1024
+
+pytestmark = pytest.mark.skipif(not instrumentation.SPAN_PEAK_RSS, reason="peak RSS cannot be reset here")
+
+
+@pytest.fixture
+def spans(monkeypatch):
+    records = {}
+    monkeypatch.setattr(instrumentation.metrics, "record", lambda record: records.__setitem__(record["name"], record))
+    return records
+
+
+def allocate():
+    array = np.ones(ALLOCATION // 8)
+    del array
+
+
+def test_peak_rss_is_measured_per_span(spans):
+    with instrumentation.span("large"):
+        allocate()
+    with instrumentation.span("small"):
+        pass
+
+    assert spans["large"]["peak_rss_bytes"] >= ALLOCATION
+    assert spans["small"]["peak_rss_bytes"] < spans["large"]["peak_rss_bytes"] - ALLOCATION // 2
+    assert spans["small"]["peak_rss_scope"] == "span"
+
+
+def test_enclosing_span_keeps_the_peak_of_nested_spans(spans):
+    with instrumentation.span("outer"):
+        allocate()
+        with instrumentation.span("inner"):
+            pass
+    with instrumentation.span("after"):
+        with instrumentation.span("nested"):
+            allocate()
+
+    assert spans["outer"]["peak_rss_bytes"] >= ALLOCATION
+    assert spans["inner"]["peak_rss_bytes"] < spans["outer"]["peak_rss_bytes"] - ALLOCATION // 2
+    assert spans["after"]["peak_rss_bytes"] >= spans["nested"]["peak_rss_bytes"] >= ALLOCATION
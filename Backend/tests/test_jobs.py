@@ -0,0 +1,120 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import jobs
+from jobs import JobStore, JobQueue, QUEUED, RUNNING, DONE, FAILED
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite"))
+
+
+@pytest.fixture
+def queue(store, monkeypatch):
+    queue = JobQueue(store, max_workers=1)
+    started = []
+    monkeypatch.setattr(queue, "_run", lambda job_id, params: started.append(job_id))
+    queue.started = started
+    yield queue
+    queue.executor.shutdown()
+
+
+@pytest.fixture
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def params(project="demo", **extra):
+    return {"project_name": project, "n_trees": 10, **extra}
+
+
+# Stand-ins for run_pipeline_job; the spawned workers import them from here
+def kill_worker(db_path, job_id, params):
+    os._exit(1)
+
+
+def finish_job(db_path, job_id, params):
+    JobStore(db_path).update_job(job_id, status=DONE, finished_at=time.time())
+
+
+def wait_for(store, job_id, timeout=60):
+    deadline = time.time() + timeout
+    while store.get(job_id)["status"] in (QUEUED, RUNNING):
+        assert time.time() < deadline, f"job {job_id} did not finish"
+        time.sleep(0.1)
+    return store.get(job_id)
+
+
+def test_orphaned_job_is_failed_and_unblocks_the_project(store, queue, dead_pid):
+    orphan = store.create(params(), owner_pid=dead_pid)
+    store.update_job(orphan, status=RUNNING)
+    store.update_stage(orphan, "extraction", status=RUNNING)
+
+    job_id = queue.submit(params())
+
+    assert job_id != orphan
+    job = store.get(orphan)
+    assert job["status"] == FAILED
+    assert job["error"] == jobs.ORPHANED_ERROR
+    assert job["stages"][0]["status"] == FAILED
+
+
+def test_job_of_a_live_server_is_joined(store, queue):
+    active = store.create(params(), owner_pid=queue.owner_pid)
+
+    assert queue.submit(params()) == active
+    assert store.get(active)["status"] == QUEUED
+
+
+def test_resume_claims_orphans_once(store, queue, dead_pid):
+    orphan = store.create(params(), owner_pid=dead_pid)
+    other = JobQueue(store, max_workers=1)
+    try:
+        assert queue.resume() == [orphan]
+        assert queue.resume() == []
+        # Another process finds the job owned by a live server now
+        assert other.resume() == []
+    finally:
+        other.executor.shutdown()
+    assert queue.started == [orphan]
+
+
+def test_active_job_with_other_parameters_conflicts(store, queue):
+    active = queue.submit(params())
+
+    with pytest.raises(jobs.JobConflict) as conflict:
+        queue.submit(params(n_trees=20))
+    assert conflict.value.job_id == active
+    assert queue.submit(params(project="other", n_trees=20)) != active
+
+
+def test_jobs_run_after_a_worker_dies(store, monkeypatch):
+    queue = JobQueue(store, max_workers=1)
+    try:
+        monkeypatch.setattr(jobs, "run_pipeline_job", kill_worker)
+        killed = queue.submit(params(project="killed"))
+        job = wait_for(store, killed)
+        assert job["status"] == FAILED and "BrokenProcessPool" in job["error"]
+
+        monkeypatch.setattr(jobs, "run_pipeline_job", finish_job)
+        assert wait_for(store, queue.submit(params(project="next")))["status"] == DONE
+    finally:
+        queue.executor.shutdown()
+
+
+def test_job_is_failed_when_it_cannot_be_queued(store):
+    queue = JobQueue(store, max_workers=1)
+    queue.executor.shutdown()
+
+    with pytest.raises(RuntimeError):
+        queue.submit(params())
+    [job] = store.list()
+    assert job["status"] == FAILED
+    assert store.active_job("demo") is None
@@ -0,0 +1,68 @@
+import json
+import re
+
+import geopandas as gpd
+import numpy as np
+from shapely import points
+
+from map_preview import markers_preview_map, point_payload, COORDINATE_SCALE
+
+LABELS = ["wheat", "rice", "gram", "mustard"]
+
+
+def marker_gdf(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return gpd.GeoDataFrame(
+        {"type": rng.choice(LABELS, n)},
+        geometry=points(rng.uniform(75, 76, n), rng.uniform(23, 24, n)),
+        crs="EPSG:4326",
+    )
+
+
+def render(tmp_path, n, **thresholds):
+    path = tmp_path / "markers_map.html"
+    markers_preview_map(marker_gdf(n), str(path), **thresholds)
+    return path.read_text()
+
+
+def embedded_payload(html):
+    return json.loads(re.search(r"var points = (\{.*?\});", html).group(1))
+
+
+def test_small_uploads_keep_one_marker_per_point(tmp_path):
+    html = render(tmp_path, 50, threshold=100)
+
+    assert html.count("L.marker(") == 50
+    assert "var points" not in html
+
+
+def test_points_over_the_threshold_are_one_payload(tmp_path):
+    html = render(tmp_path, 5_000, threshold=100)
+    payload = embedded_payload(html)
+
+    assert "L.marker(" not in html
+    assert len(payload["lat"]) == len(payload["lon"]) == len(payload["code"]) == 5_000
+    assert "count" not in payload
+    assert sorted(payload["labels"]) == sorted(LABELS)
+    # Quantised integer offsets and label codes: a few bytes per point
+    assert len(html) < 100_000 + 20 * 5_000
+
+
+def test_payload_round_trips_positions_and_labels():
+    gdf = marker_gdf(500)
+    lat, lon = gdf.geometry.y.to_numpy(), gdf.geometry.x.to_numpy()
+    labels = gdf["type"].to_numpy()
+    payload = point_payload(lat, lon, labels, np.full(500, "red", dtype=object))
+
+    decoded_lat = payload["origin"][0] + np.array(payload["lat"]) / payload["scale"]
+    np.testing.assert_allclose(decoded_lat, lat, atol=1 / COORDINATE_SCALE)
+    assert [payload["labels"][code] for code in payload["code"]] == labels.tolist()
+
+
+def test_large_uploads_are_aggregated(tmp_path):
+    html = render(tmp_path, 100_000, threshold=1_000, aggregate_threshold=20_000)
+    payload = embedded_payload(html)
+
+    assert sum(payload["count"]) == 100_000
+    assert len(payload["count"]) <= 128 * 128
+    assert len(html) < 500_000
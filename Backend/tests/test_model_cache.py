@@ -0,0 +1,121 @@
+import os
+
+import geopandas as gpd
+import joblib
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from shapely.geometry import box
+from sklearn.ensemble import RandomForestClassifier
+
+import raster_stack
+import workspace
+from model_cache import LRUCache, ProjectCache
+from prediction import crop_map_prediction_pipeline, prediction_PipeLine
+
+
+def load(cache, key, size, stamp=0):
+    loads = []
+    value = cache.get(key, stamp, lambda: loads.append(key) or f"value-{key}", lambda _: size)
+    return value, bool(loads)
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = LRUCache(max_bytes=100)
+    load(cache, "a", 40)
+    load(cache, "b", 40)
+    load(cache, "a", 40)  # "b" is now the least recently used
+    load(cache, "c", 40)
+
+    assert load(cache, "a", 40) == ("value-a", False)
+    assert load(cache, "c", 40) == ("value-c", False)
+    assert load(cache, "b", 40) == ("value-b", True)
+    assert cache.stats()["evictions"] == 2  # "b", then "a" to make room for "b" again
+
+
+def test_changed_stamp_reloads_the_entry():
+    cache = LRUCache(max_bytes=100)
+    load(cache, "a", 40, stamp=1)
+
+    assert load(cache, "a", 40, stamp=2) == ("value-a", True)
+    assert cache.stats()["entries"] == 1 and cache.stats()["bytes"] == 40
+
+
+def test_oversize_entries_are_returned_but_not_kept():
+    cache = LRUCache(max_bytes=100)
+    load(cache, "a", 40)
+
+    assert load(cache, "big", 150) == ("value-big", True)
+    assert load(cache, "big", 150) == ("value-big", True)
+    # The entries within the budget stay
+    assert load(cache, "a", 40) == ("value-a", False)
+    stats = cache.stats()
+    assert stats["oversize"] == 2 and stats["evictions"] == 0
+    assert stats["entries"] == 1 and stats["bytes"] == 40
+
+
+def test_entry_limit():
+    cache = LRUCache(max_bytes=100, max_entries=2)
+    for key in "abc":
+        load(cache, key, 0)
+
+    assert cache.stats()["entries"] == 2
+    assert load(cache, "a", 0) == ("value-a", True)
+
+
+def write_stack(path):
+    data = np.arange(2 * 8 * 8, dtype=np.float32).reshape(2, 8, 8)
+    with rasterio.open(
+        path, 'w', driver='GTiff', height=8, width=8, count=2, dtype='float32',
+        crs='EPSG:4326', transform=from_origin(75.2, 23.8, 1e-4, 1e-4),
+    ) as dst:
+        dst.write(data)
+    return data
+
+
+def test_rasters_are_cached_open_not_read(tmp_path):
+    path = str(tmp_path / "stack.tif")
+    data = write_stack(path)
+
+    cache = ProjectCache()
+    raster = cache.raster("demo", path)
+
+    assert cache.raster("demo", path) is raster
+    assert not raster.closed
+    np.testing.assert_array_equal(raster.read(), data)
+    assert cache.stats()["rasters"]["bytes"] == 0
+
+
+def test_cached_raster_stays_open_across_masked_runs(tmp_path):
+    path = str(tmp_path / "stack.tif")
+    data = write_stack(path)
+    roi_path = str(tmp_path / "roi.shp")
+    gpd.GeoDataFrame(geometry=[box(75.2, 23.7996, 75.2004, 23.8)], crs="EPSG:4326").to_file(roi_path)
+    model = RandomForestClassifier(n_estimators=2, random_state=0).fit(data.reshape(2, -1).T, np.arange(64) % 2)
+
+    cache = ProjectCache()
+    for run in range(2):
+        output_path = str(tmp_path / f"output_{run}.tif")
+        crop_map_prediction_pipeline(
+            path, None, output_path, masked=True, roi_path=roi_path, model=model, raster=cache.raster("demo", path),
+        )
+        with rasterio.open(output_path) as dst:
+            assert (dst.read(1) != dst.nodata).sum() == 16
+    assert not cache.raster("demo", path).closed
+
+
+def test_pipeline_runs_twice_from_the_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(workspace, "WORKSPACE_ROOT", str(tmp_path))
+    path = raster_stack.stack_path("demo")
+    os.makedirs(os.path.dirname(path))
+    data = write_stack(path)
+    metrics_dir = os.path.join(workspace.project_dir("demo"), "metrics")
+    os.makedirs(metrics_dir)
+    model = RandomForestClassifier(n_estimators=2, random_state=0).fit(data.reshape(2, -1).T, np.arange(64) % 2)
+    joblib.dump(model, os.path.join(metrics_dir, "BRF_crops3inc_multiclass_0.9000.joblib"))
+
+    cache = ProjectCache()
+    for streaming in (False, True, False):
+        prediction_PipeLine("demo", streaming=streaming, cache=cache)
+    assert cache.stats()["rasters"]["hits"] == 2
+    assert not cache.raster("demo", path).closed
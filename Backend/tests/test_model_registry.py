@@ -0,0 +1,87 @@
+import os
+import json
+
+import pytest
+
+import workspace
+from model_registry import ModelRegistry, REGISTRY_FILENAME
+from modelCreationp import register_restored_run, training_run_outputs, TRAINING_RUN_FILENAME
+from stage_cache import StageCache
+
+
+@pytest.fixture
+def metrics_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(workspace, "WORKSPACE_ROOT", str(tmp_path))
+    path = os.path.join(workspace.project_dir("demo"), "metrics", "")
+    os.makedirs(path)
+    return path
+
+
+def fake_training(metrics_dir, accuracy):
+    # The files and registrations modelCreation_PipeLine leaves behind
+    model = {
+        "model_type": "BRF", "model_path": f"BRF_crops3inc_multiclass_{accuracy:.4f}.joblib",
+        "metrics": {"accuracy": accuracy}, "features": ["VV_1"], "fingerprint": str(accuracy),
+    }
+    with open(os.path.join(metrics_dir, model["model_path"]), "w") as f:
+        f.write("model")
+    ModelRegistry(metrics_dir).register(**model)
+    with open(os.path.join(metrics_dir, TRAINING_RUN_FILENAME), "w") as f:
+        json.dump({"outputs": [model["model_path"]], "models": [model]}, f)
+
+
+def test_registry_lives_outside_the_metrics_directory(metrics_dir):
+    registry = ModelRegistry(metrics_dir)
+    registry.register("BRF", "model.joblib", {"accuracy": 0.9}, ["VV_1"], "abc")
+
+    assert not os.path.exists(os.path.join(metrics_dir, REGISTRY_FILENAME))
+    assert os.path.dirname(registry.path) == workspace.project_dir("demo")
+    assert registry.model_path(registry.resolve()) == os.path.join(metrics_dir, "model.joblib")
+
+
+def test_legacy_registry_is_moved_out(metrics_dir):
+    with open(os.path.join(metrics_dir, REGISTRY_FILENAME), "w") as f:
+        json.dump({"versions": {"1": {"version": 1, "model_type": "BRF"}}, "latest": {"BRF": 1}, "best": {"BRF": 1}}, f)
+
+    assert ModelRegistry(metrics_dir).resolve()["version"] == 1
+    assert not os.path.exists(os.path.join(metrics_dir, REGISTRY_FILENAME))
+
+
+def test_cache_hit_keeps_and_extends_the_registry(metrics_dir, tmp_path):
+    cache = StageCache(str(tmp_path / "cache"))
+
+    def train(params, accuracy):
+        if cache.run(
+            "training", [], params, lambda: training_run_outputs("demo"),
+            lambda: fake_training(metrics_dir, accuracy), root=workspace.project_dir("demo"),
+        ):
+            register_restored_run("demo")
+
+    train({"n_trees": 10}, 0.8)
+    train({"n_trees": 20}, 0.9)
+    train({"n_trees": 10}, 0.8)  # Restored from the first run
+
+    registry = ModelRegistry(metrics_dir)
+    assert sorted(registry._load()["versions"]) == ["1", "2", "3"]
+    latest = registry.resolve("BRF", "latest")
+    assert latest["version"] == 3
+    assert latest["path"] == "BRF_crops3inc_multiclass_0.8000.joblib"
+    assert os.path.exists(registry.model_path(latest))
+    assert registry.resolve("BRF", "best")["version"] == 2
+    # Only the run's own files were restored; later models stay in place
+    assert os.path.exists(registry.model_path(registry.resolve("BRF", "best")))
+
+    # A repeated hit on the latest run adds no version
+    train({"n_trees": 10}, 0.8)
+    assert sorted(registry._load()["versions"]) == ["1", "2", "3"]
+
+
+def test_pinned_version_must_have_the_requested_type(metrics_dir):
+    registry = ModelRegistry(metrics_dir)
+    rf = registry.register("RF", "rf.joblib", {"accuracy": 0.8}, ["VV_1"], "abc")
+    brf = registry.register("BRF", "brf.joblib", {"accuracy": 0.9}, ["VV_1"], "abc")
+
+    assert registry.resolve("BRF", brf["version"]) == brf
+    assert registry.resolve("RF", str(rf["version"])) == rf
+    with pytest.raises(ValueError, match="is a RF model"):
+        registry.resolve("BRF", rf["version"])
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from model_search import base_estimator, best_params, grow_until_plateau, search_models, LEADERBOARD_FILENAME
+
+
+def training_set(n_samples=240, n_features=6, seed=0):
+    rng = np.random.default_rng(seed)
+    y = rng.integers(1, 4, n_samples)
+    X = rng.normal(0, 2, (n_samples, n_features)) + y[:, None]
+    return X.astype(np.float32), y
+
+
+def test_search_ranks_both_model_types(tmp_path):
+    X, y = training_set()
+    leaderboard = search_models(X, y, str(tmp_path), n_iter=2, cv=3, n_jobs=1, max_trees=20)
+
+    assert set(leaderboard["model_type"]) == {"RF", "BRF"}
+    assert list(leaderboard["rank"]) == list(range(1, len(leaderboard) + 1))
+    assert leaderboard["cv_mean"].is_monotonic_decreasing
+    assert (leaderboard["n_estimators"] <= 20).all()
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / LEADERBOARD_FILENAME), leaderboard, check_dtype=False)
+
+    # The BRF that goes to training is the one evaluated: no bootstrapping
+    params = best_params(leaderboard, "BRF")
+    assert "bootstrap" not in params
+    assert base_estimator("BRF", params).get_params()["bootstrap"] is False
+
+
+def test_growth_stops_once_the_score_plateaus():
+    # Separable classes: the score stops improving after a few rounds
+    X, y = training_set()
+    X[:, 0] = y * 100
+    estimator = RandomForestClassifier(random_state=0)
+    n_trees, score = grow_until_plateau(estimator, X, y, max_trees=500, step=10, patience=2)
+
+    assert n_trees < 500 and score > 0.99
+    # Two rounds without improvement past the best size, then it stops
+    assert estimator.n_estimators == n_trees + 20
+
+
+@pytest.mark.parametrize("model_type", ["RF", "BRF"])
+def test_growth_is_bounded_by_max_trees(model_type):
+    X, y = training_set()
+    holdout = (X[:60], y[:60]) if model_type == "BRF" else None
+    estimator = base_estimator(model_type, {})
+    n_trees, score = grow_until_plateau(estimator, X[60:], y[60:], holdout=holdout, max_trees=15, step=10, tol=-1)
+
+    # A negative tolerance counts every round as an improvement
+    assert n_trees == 15 and estimator.n_estimators == 15
+    assert 0 < score <= 1
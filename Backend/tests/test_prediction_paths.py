@@ -0,0 +1,91 @@
+import geopandas as gpd
+import joblib
+import numpy as np
+import pytest
+import rasterio
+from rasterio.features import geometry_mask
+from rasterio.transform import from_origin
+from shapely.geometry import Polygon
+from sklearn.ensemble import RandomForestClassifier
+
+from prediction import crop_map_prediction_pipeline, roi_pixel_mask, PREDICTION_NODATA
+
+HEIGHT, WIDTH, BANDS = 600, 520, 3
+TILE_BUDGET = 256 * 256  # Several windows per stack
+
+LAYOUTS = {
+    "striped": {},
+    "tiled": {"tiled": True, "blockxsize": 128, "blockysize": 128},
+}
+
+
+def write_stack(path, layout, nodata=None, seed=0, holes=()):
+    # holes: values written into random pixels of single bands
+    rng = np.random.default_rng(seed)
+    data = rng.normal(0, 1, (BANDS, HEIGHT, WIDTH)).astype(np.float32)
+    for value in holes:
+        band = rng.integers(0, BANDS, 2_000)
+        data[band, rng.integers(0, HEIGHT, 2_000), rng.integers(0, WIDTH, 2_000)] = value
+    with rasterio.open(
+        path, 'w', driver='GTiff', height=HEIGHT, width=WIDTH, count=BANDS, dtype='float32',
+        crs='EPSG:4326', transform=from_origin(75.2, 23.8, 1e-4, 1e-4), nodata=nodata, **LAYOUTS[layout],
+    ) as dst:
+        dst.write(data)
+    return data
+
+
+@pytest.fixture
+def model_path(tmp_path):
+    rng = np.random.default_rng(1)
+    y = rng.integers(1, 4, 300)
+    X = rng.normal(0, 1, (300, BANDS)) + y[:, None] * 0.5
+    path = str(tmp_path / "BRF_crops3inc_multiclass_0.9000.joblib")
+    joblib.dump(RandomForestClassifier(n_estimators=10, random_state=0).fit(X, y), path)
+    return path
+
+
+def predict(tmp_path, stack_path, model_path, name, **options):
+    output_path = str(tmp_path / "Predicted_Cropmap" / f"{name}.tif")
+    crop_map_prediction_pipeline(stack_path, model_path, output_path, tile_budget=TILE_BUDGET, **options)
+    with rasterio.open(output_path) as dst:
+        return dst.read(1), dst.nodata, dst.overviews(1)
+
+
+@pytest.mark.parametrize("layout", sorted(LAYOUTS))
+def test_parallel_and_streaming_match_the_full_read(tmp_path, model_path, layout):
+    stack_path = str(tmp_path / "stack.tif")
+    write_stack(stack_path, layout)
+
+    full, nodata, overviews = predict(tmp_path, stack_path, model_path, "full")
+    assert overviews == [2, 4]
+    assert len(np.unique(full)) > 1
+    for name, options in (("streaming", {"streaming": True}), ("parallel", {"n_workers": 2})):
+        prediction, prediction_nodata, prediction_overviews = predict(tmp_path, stack_path, model_path, name, **options)
+        np.testing.assert_array_equal(prediction, full, err_msg=name)
+        assert prediction_nodata == nodata and prediction_overviews == overviews
+
+
+@pytest.mark.parametrize("layout", sorted(LAYOUTS))
+def test_masked_paths_skip_nodata_and_pixels_outside_the_roi(tmp_path, model_path, layout):
+    stack_path = str(tmp_path / "stack.tif")
+    data = write_stack(stack_path, layout, nodata=-32768, holes=(-32768, PREDICTION_NODATA, np.nan))
+    # An irregular district covering part of the stack. Its edges pass
+    # exactly through pixel centres, where rasterizing from different window
+    # origins disagrees unless every path rasterizes the same tiles.
+    roi = Polygon([(75.21, 23.795), (75.245, 23.79), (75.25, 23.75), (75.215, 23.745)])
+    roi_path = str(tmp_path / "roi.shp")
+    gpd.GeoDataFrame(geometry=[roi], crs="EPSG:4326").to_file(roi_path)
+
+    with rasterio.open(stack_path) as raster:
+        inside = roi_pixel_mask(raster, None, [roi.__geo_interface__])
+        whole = geometry_mask([roi.__geo_interface__], out_shape=(HEIGHT, WIDTH), transform=raster.transform, invert=True)
+    assert (inside != whole).sum() < 100  # Edge pixels only
+    valid = inside & np.all(np.isfinite(data) & (data != -32768) & (data != PREDICTION_NODATA), axis=0)
+    assert 0 < valid.sum() < inside.sum() < valid.size
+    expected = np.full((HEIGHT, WIDTH), PREDICTION_NODATA, dtype=np.int64)
+    expected[valid] = joblib.load(model_path).predict(data.reshape(BANDS, -1).T[valid.ravel()])
+
+    for name, options in (("full", {}), ("streaming", {"streaming": True}), ("parallel", {"n_workers": 2})):
+        prediction, nodata, overviews = predict(tmp_path, stack_path, model_path, name, masked=True, roi_path=roi_path, **options)
+        np.testing.assert_array_equal(prediction, expected, err_msg=name)
+        assert nodata == PREDICTION_NODATA and overviews == [2, 4]
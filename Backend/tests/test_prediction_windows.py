@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from prediction import iter_prediction_windows, OUTPUT_BLOCK_SIZE
+
+
+def open_stack(tmp_path, height, width, **layout):
+    path = tmp_path / "stack.tif"
+    with rasterio.open(
+        path, 'w', driver='GTiff', height=height, width=width, count=2, dtype='float32',
+        crs='EPSG:4326', transform=from_origin(75.2, 23.8, 1e-4, 1e-4), **layout,
+    ) as dst:
+        dst.write(np.zeros((2, height, width), dtype=np.float32))
+    return rasterio.open(path)
+
+
+@pytest.mark.parametrize("layout, tile_budget", [
+    ({}, 512 * 512),                                            # Striped, one row per strip
+    ({}, 64 * 64),                                              # Striped, budget below one tile row
+    ({"tiled": True, "blockxsize": 256, "blockysize": 256}, 512 * 512),
+    ({"tiled": True, "blockxsize": 512, "blockysize": 512}, 512 * 512),
+    ({"tiled": True, "blockxsize": 128, "blockysize": 128}, 300 * 300),
+])
+def test_windows_cover_the_raster_on_the_output_grid(tmp_path, layout, tile_budget):
+    with open_stack(tmp_path, 1300, 1000, **layout) as raster:
+        windows = list(iter_prediction_windows(raster, tile_budget))
+        block_height, block_width = raster.block_shapes[0]
+
+    covered = np.zeros((1300, 1000), dtype=np.int64)
+    for window in windows:
+        covered[window.row_off:window.row_off + window.height, window.col_off:window.col_off + window.width] += 1
+        assert window.row_off % OUTPUT_BLOCK_SIZE == 0 and window.col_off % OUTPUT_BLOCK_SIZE == 0
+        assert window.row_off % block_height == 0
+        if block_width < 1000:
+            assert window.col_off % block_width == 0
+        # At most the budget, or one output tile when the budget is smaller
+        assert window.width * window.height <= max(tile_budget, OUTPUT_BLOCK_SIZE ** 2)
+    assert (covered == 1).all()
+
+
+def test_striped_stack_merges_strips(tmp_path):
+    with open_stack(tmp_path, 1300, 1000) as raster:
+        assert raster.block_shapes[0][0] < 16
+        windows = list(iter_prediction_windows(raster, 512 * 512))
+
+    assert len(windows) == 6
+    assert {(window.width, window.height) for window in windows[:-1]} == {(1000, 256)}
+
+
+@pytest.mark.parametrize("layout, tile_budget", [
+    ({"tiled": True, "blockxsize": 2048, "blockysize": 2048}, 512 * 512),
+    ({"tiled": True, "blockxsize": 2048, "blockysize": 2048}, 768 * 256),  # Three tiles would straddle blocks
+    ({"tiled": True, "blockxsize": 1024, "blockysize": 2048}, 512 * 512),
+    ({"blockysize": 2048}, 512 * 512),  # Striped, with strips taller than the budget allows
+])
+def test_blocks_over_the_budget_are_split(tmp_path, layout, tile_budget):
+    with open_stack(tmp_path, 2600, 2300, compress="deflate", **layout) as raster:
+        windows = list(iter_prediction_windows(raster, tile_budget))
+        block_height, block_width = raster.block_shapes[0]
+
+    covered = np.zeros((2600, 2300), dtype=np.int64)
+    for window in windows:
+        covered[window.row_off:window.row_off + window.height, window.col_off:window.col_off + window.width] += 1
+        assert window.width * window.height <= tile_budget
+        assert window.row_off % OUTPUT_BLOCK_SIZE == 0 and window.col_off % OUTPUT_BLOCK_SIZE == 0
+        # Sub-windows never straddle two input blocks
+        assert window.row_off // block_height == (window.row_off + window.height - 1) // block_height
+        assert window.col_off // block_width == (window.col_off + window.width - 1) // block_width
+    assert (covered == 1).all()
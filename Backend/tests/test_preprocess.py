@@ -0,0 +1,17 @@
+import os
+
+import pandas as pd
+import pytest
+
+from preProcess import process_time_series
+
+UJJAIN_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Crop_mapping_ujjain")
+
+
+@pytest.mark.parametrize("band", ["VV", "VH", "NDVI"])
+def test_reshape_matches_committed_wide_tables(tmp_path, band):
+    output_path = tmp_path / f"{band}_timeseries_ujjain_wide.csv"
+    process_time_series(os.path.join(UJJAIN_DIR, f"{band}_timeseries_ujjain.csv"), str(output_path), band, data_type='crop')
+
+    expected = pd.read_csv(os.path.join(UJJAIN_DIR, "timeseries", f"{band}_timeseries_ujjain_wide.csv"))
+    pd.testing.assert_frame_equal(pd.read_csv(output_path), expected)
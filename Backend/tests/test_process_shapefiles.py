@@ -0,0 +1,113 @@
+import csv
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import ee_client
+import process_shapefiles
+from process_shapefiles import submit_time_series, write_time_series, fetch_with_retry
+from fake_ee import FakeEarthEngine, EEException
+
+DATES = ["20231016", "20231028", "20231109", "20231121", "20231203"]
+SELECTORS = ['id', 'date', 'VV', 'crpname_eg', 'lat', 'lon', 'geometry']
+
+
+@pytest.fixture
+def fake_ee():
+    def install(**kwargs):
+        client = FakeEarthEngine(**kwargs)
+        ee_client.set_ee(client)
+        return client
+    yield install
+    ee_client.set_ee(None)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(process_shapefiles.time, "sleep", lambda seconds: None)
+
+
+def markers(n):
+    return [{"id": i + 1, "crpname_eg": "wheat", "lat": 23.0 + i, "lon": 75.0 + i} for i in range(n)]
+
+
+def extract(client, n_markers, marker_chunk, date_chunk, max_workers=1, dates=DATES):
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        plan = submit_time_series(
+            executor, client.ImageCollection(dates), markers(n_markers), 'VV', SELECTORS,
+            marker_chunk=marker_chunk, date_chunk=date_chunk,
+        )
+        return plan, [[row for future in futures for row in future.result()] for _, futures in plan]
+
+
+def expected_rows(n_markers, dates=DATES):
+    return [(str(date), str(marker["id"])) for date in dates for marker in markers(n_markers)]
+
+
+@pytest.mark.parametrize("n_markers, marker_chunk, date_chunk, n_requests", [
+    (7, 3, 2, 9),   # Ragged last chunks on both axes
+    (6, 3, 5, 2),   # Exact multiples: no empty requests
+    (2, 500, 8, 1), # Everything in one request
+])
+def test_chunk_boundaries(fake_ee, n_markers, marker_chunk, date_chunk, n_requests):
+    client = fake_ee()
+    extract(client, n_markers, marker_chunk, date_chunk)
+
+    assert len(client.requests) == n_requests
+    for rows in client.requests:
+        assert 0 < len({row["id"] for row in rows}) <= marker_chunk
+        assert 0 < len({row["date"] for row in rows}) <= date_chunk
+    fetched = sorted((row["date"], row["id"]) for rows in client.requests for row in rows)
+    assert fetched == sorted((date, marker["id"]) for date in DATES for marker in markers(n_markers))
+
+
+def test_rows_keep_extraction_order_when_requests_finish_out_of_order(fake_ee, tmp_path):
+    # Earlier dates and markers take longer, so requests finish in reverse
+    client = fake_ee(delay=lambda rows: 0.02 * (len(DATES) - DATES.index(rows[0]["date"])) + 0.01 / rows[0]["id"])
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        plan = submit_time_series(
+            executor, client.ImageCollection(DATES), markers(5), 'VV', SELECTORS,
+            marker_chunk=2, date_chunk=2,
+        )
+        output_path = tmp_path / "VV_timeseries.csv"
+        write_time_series(plan, output_path, SELECTORS)
+
+    assert client.completed != client.requests
+    with open(output_path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert list(rows[0]) == sorted(SELECTORS)
+    assert [(row["date"], row["id"]) for row in rows] == expected_rows(5)
+    assert all(float(row["VV"]) == FakeEarthEngine.value({"id": row["id"]}, row["date"]) for row in rows)
+
+
+@pytest.mark.parametrize("error", [
+    EEException("Too Many Requests: Request was rejected because of quota limits (429)"),
+    EEException("Computation timed out."),
+    TimeoutError("read timed out"),
+])
+def test_transient_errors_are_retried(fake_ee, error):
+    client = fake_ee(failures=[error, error])
+    rows = fetch_with_retry(client.FeatureCollection(markers(1)), retries=3)
+
+    assert len(client.requests) == 3
+    assert rows == client.completed[0]
+
+
+def test_bad_requests_are_not_retried(fake_ee):
+    client = fake_ee(failures=[EEException("Image.select: Pattern 'VV' did not match any bands.")])
+    with pytest.raises(EEException):
+        fetch_with_retry(client.FeatureCollection(markers(1)), retries=3)
+    assert len(client.requests) == 1
+
+
+def test_retries_are_bounded(fake_ee):
+    client = fake_ee(failures=[EEException("Quota exceeded")] * 3)
+    with pytest.raises(EEException):
+        fetch_with_retry(client.FeatureCollection(markers(1)), retries=2)
+    assert len(client.requests) == 3
+
+
+def test_failed_chunk_fails_the_export(fake_ee, tmp_path):
+    client = fake_ee(failures=[EEException("Invalid geometry")])
+    with pytest.raises(EEException):
+        extract(client, 4, 2, 2)
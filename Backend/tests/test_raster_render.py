@@ -0,0 +1,44 @@
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+
+from prediction import save_prediction_raster, PREDICTION_NODATA
+from raster_render import render_preview, convert_raster, NODATA_INDEX
+
+
+def write_class_map(path, data):
+    # Stand-in for the input stack whose grid the prediction is written on
+    reference = SimpleNamespace(
+        height=data.shape[0], width=data.shape[1],
+        crs=CRS.from_epsg(4326), transform=from_origin(75.2, 23.8, 1e-4, 1e-4),
+    )
+    save_prediction_raster(str(path), data, reference)
+
+
+def test_render_preview_of_small_class_map(tmp_path):
+    data = np.array([[1, 2, 3], [PREDICTION_NODATA, 1, 1]], dtype=np.int64)
+    path = tmp_path / "output.tif"
+    write_class_map(path, data)
+
+    img = render_preview(str(path))
+
+    assert img.mode == "P"
+    indices = np.asarray(img)
+    assert indices.shape == data.shape
+    assert indices[1, 0] == NODATA_INDEX
+    np.testing.assert_array_equal(indices[0], [1, 2, 3])
+
+
+def test_convert_raster_single_class(tmp_path):
+    path = tmp_path / "output.tif"
+    write_class_map(path, np.full((4, 5), 2, dtype=np.int64))
+    png_path = tmp_path / "output.png"
+
+    convert_raster(str(path), str(png_path), max_size=2)
+
+    with Image.open(png_path) as img:
+        assert img.size == (2, 2)
+        assert set(np.unique(np.asarray(img))) == {2}
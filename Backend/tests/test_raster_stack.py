@@ -0,0 +1,91 @@
+import os
+
+import joblib
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+from sklearn.ensemble import RandomForestClassifier
+
+import raster_stack
+import workspace
+from model_registry import ModelRegistry
+from prediction import prediction_PipeLine, PREDICTION_NODATA
+
+# Training order, deliberately not the alphabetical order of the band files
+FEATURES = ["VV_20231101", "VV_20231201", "VH_20231101", "VH_20231201", "NDVI_20231101", "NDVI_20231201"]
+HEIGHT, WIDTH = 300, 280
+TRANSFORM = from_origin(75.2, 23.8, 1e-4, 1e-4)
+
+
+def write_band(path, data, transform=TRANSFORM):
+    with rasterio.open(
+        path, 'w', driver='GTiff', height=data.shape[0], width=data.shape[1], count=1, dtype='float32',
+        crs='EPSG:4326', transform=transform, nodata=PREDICTION_NODATA,
+    ) as dst:
+        dst.write(data, 1)
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    monkeypatch.setattr(workspace, "WORKSPACE_ROOT", str(tmp_path))
+    rng = np.random.default_rng(0)
+    bands = rng.normal(0, 1, (len(FEATURES), HEIGHT, WIDTH)).astype(np.float32)
+    bands[:, :10, :10] = PREDICTION_NODATA
+    os.makedirs(raster_stack.band_dir("demo"))
+    for feature, data in zip(FEATURES, bands):
+        write_band(os.path.join(raster_stack.band_dir("demo"), f"{feature}.tif"), data)
+
+    metrics_dir = os.path.join(workspace.project_dir("demo"), "metrics", "")
+    os.makedirs(metrics_dir)
+    y = rng.integers(1, 4, 400)
+    X = rng.normal(0, 1, (400, len(FEATURES))) + y[:, None] * 0.5
+    model = RandomForestClassifier(n_estimators=10, random_state=0).fit(X, y)
+    model_path = os.path.join(metrics_dir, "BRF_crops3inc_multiclass_0.9000.joblib")
+    joblib.dump(model, model_path)
+    ModelRegistry(metrics_dir).register("BRF", model_path, {"accuracy": 0.9}, FEATURES, "abc")
+    return bands, model
+
+
+@pytest.mark.parametrize("vrt", [False, True])
+def test_stack_follows_the_training_feature_order(project, vrt):
+    bands, _ = project
+    path = raster_stack.build_stack("demo", vrt=vrt)
+
+    assert path == raster_stack.stack_path("demo", vrt=vrt)
+    with rasterio.open(path) as stack:
+        assert list(stack.descriptions) == FEATURES
+        assert stack.nodata == PREDICTION_NODATA
+        assert (stack.transform, stack.width, stack.height) == (TRANSFORM, WIDTH, HEIGHT)
+        np.testing.assert_array_equal(stack.read(), bands)
+
+
+@pytest.mark.parametrize("vrt", [False, True])
+def test_prediction_reads_the_built_stack(project, vrt):
+    bands, model = project
+    if vrt:
+        raster_stack.build_stack("demo", vrt=True)
+        prediction_PipeLine("demo", streaming=True)
+    else:
+        # No stack yet: prediction assembles the GeoTIFF first
+        prediction_PipeLine("demo", streaming=True, build_stack=True)
+        assert os.path.exists(raster_stack.stack_path("demo"))
+
+    expected = model.predict(bands.reshape(len(FEATURES), -1).T).reshape(HEIGHT, WIDTH)
+    output_path = os.path.join(workspace.project_dir("demo"), "Predicted_Cropmap", "output.tif")
+    with rasterio.open(output_path) as dst:
+        np.testing.assert_array_equal(dst.read(1), expected)
+
+
+def test_missing_and_misaligned_bands_are_refused(project):
+    directory = raster_stack.band_dir("demo")
+    os.remove(os.path.join(directory, "VH_20231201.tif"))
+    with pytest.raises(FileNotFoundError, match="VH_20231201.tif"):
+        raster_stack.build_stack("demo")
+
+    # Shifted by one pixel: not on the grid of the other bands
+    shifted = from_origin(75.2001, 23.8, 1e-4, 1e-4)
+    write_band(os.path.join(directory, "VH_20231201.tif"), np.zeros((HEIGHT, WIDTH), dtype=np.float32), shifted)
+    for vrt in (False, True):
+        with pytest.raises(ValueError, match="same grid"):
+            raster_stack.build_stack("demo", vrt=vrt)
@@ -0,0 +1,78 @@
+import os
+
+from stage_cache import StageCache
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def test_hit_replaces_output_directories(tmp_path):
+    cache = StageCache(str(tmp_path / "cache"))
+    root = str(tmp_path / "project")
+    outputs = [os.path.join(root, "timeseries")]
+    calls = []
+
+    def stage(text):
+        def fn():
+            calls.append(text)
+            write(os.path.join(root, "timeseries", f"{text}.csv"), text)
+        return fn
+
+    assert not cache.run("preprocess", [], {"run": 1}, outputs, stage("first"), root=root)
+    assert not cache.run("preprocess", [], {"run": 2}, outputs, stage("second"), root=root)
+    assert cache.run("preprocess", [], {"run": 1}, outputs, stage("third"), root=root)
+
+    assert calls == ["first", "second"]
+    assert os.listdir(outputs[0]) == ["first.csv"]
+
+
+def test_listed_outputs_restore_into_another_root(tmp_path):
+    cache = StageCache(str(tmp_path / "cache"))
+    produced = []
+
+    def train(root):
+        def fn():
+            path = os.path.join(root, "metrics", "model_0.9.joblib")
+            write(path, "model")
+            produced.append(path)
+        return fn
+
+    first, second = str(tmp_path / "a"), str(tmp_path / "b")
+    write(os.path.join(second, "metrics", "older.joblib"), "older")
+    cache.run("training", [], {}, lambda: produced, train(first), root=first)
+    assert cache.run("training", [], {}, lambda: produced, train(second), root=second)
+
+    assert read(os.path.join(second, "metrics", "model_0.9.joblib")) == "model"
+    assert read(os.path.join(second, "metrics", "older.joblib")) == "older"
+    assert produced == [os.path.join(first, "metrics", "model_0.9.joblib")]
+
+
+def test_project_names_are_swapped_on_restore(tmp_path):
+    cache = StageCache(str(tmp_path / "cache"))
+
+    def outputs(project):
+        root = str(tmp_path / project)
+        return root, [os.path.join(root, f"VV_timeseries_{project}.csv"), os.path.join(root, "timeseries")]
+
+    def stage(project):
+        root, paths = outputs(project)
+        def fn():
+            write(paths[0], project)
+            write(os.path.join(paths[1], f"VV_timeseries_{project}_wide.csv"), project)
+        return fn
+
+    root, paths = outputs("ujjain")
+    assert not cache.run("extraction", [], {}, paths, stage("ujjain"), root=root, project="ujjain")
+    root, paths = outputs("indore")
+    assert cache.run("extraction", [], {}, paths, stage("indore"), root=root, project="indore")
+
+    assert read(paths[0]) == "ujjain"
+    assert os.listdir(paths[1]) == ["VV_timeseries_indore_wide.csv"]
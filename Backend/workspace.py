@@ -0,0 +1,33 @@
+import os
+import re
+
+# Every project gets its own Crop_mapping_<project> output tree and its own
+# upload directories, so pipelines for different projects never touch the
+# same files. WORKSPACE_ROOT defaults to the working directory the backend
+# has always used.
+WORKSPACE_ROOT = os.environ.get("CROPMAP_WORKSPACE_ROOT", "")
+
+DEFAULT_PROJECT = "ujjain"
+
+PROJECT_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def validate_project_name(project_name):
+    if not project_name or not PROJECT_NAME_PATTERN.match(project_name):
+        raise ValueError(f"Invalid project name: {project_name!r}")
+    return project_name
+
+
+def project_dir(project_name):
+    return os.path.join(WORKSPACE_ROOT, f"Crop_mapping_{validate_project_name(project_name)}")
+
+
+def upload_dir(project_name, kind):
+    return os.path.join(WORKSPACE_ROOT, "uploads", validate_project_name(project_name), kind)
+
+
+def find_shapefile(directory):
+    shp_file = next((f for f in sorted(os.listdir(directory)) if f.endswith('.shp')), None) if os.path.isdir(directory) else None
+    if shp_file is None:
+        raise FileNotFoundError(f"No shapefile (.shp) found in directory '{directory}'.")
+    return os.path.join(directory, shp_file)
@@ -55,13 +55,29 @@ function VerifyDataPoints() {
     setIsLoading(true);
     try {
       const response = await fetch('http://localhost:5000/processShapefiles', {
-        method: 'GET',
+        method: 'POST',
       });
 
       if (!response.ok) {
         throw new Error('Processing failed');
       }
 
+      const { job_id } = await response.json();
+
+      // Poll the job until the pipeline finishes instead of holding the request open
+      while (true) {
+        await new Promise((resolve) => setTimeout(resolve, 3000));
+        const statusResponse = await fetch(`http://localhost:5000/jobs/${job_id}`);
+        if (!statusResponse.ok) {
+          throw new Error('Job status unavailable');
+        }
+        const job = await statusResponse.json();
+        if (job.status === 'done') break;
+        if (job.status === 'failed') {
+          throw new Error(job.error || 'Processing failed');
+        }
+      }
+
       navigate('/Output');
     } catch (err) {
       console.error('Processing error:', err);